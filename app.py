@@ -1,11 +1,9 @@
-import config
-
 from flask import Flask
 from sqlalchemy import create_engine
 from flask_cors import CORS
 
-from model import UserDao, TweetDao
-from service import UserService, TweetService
+from model import UserDao, TweetDao, TimelineDao, ArchiveDao, ReplicaRouter, Snowflake, snowflake_worker_id, pool_options, instrument_pool, MetricsRegistry, instrument_queries
+from service import UserService, TweetService, LRUCache, TimelineCache, PasswordHasher, TweetWriteBehind, TimelineMerger, FollowGraph, TimelineVersions, SearchIndex, TimelineHub, TimelinePoller, ArchiveWatermark
 from view import create_endpoints
 
 class Service:
@@ -24,16 +22,113 @@ def create_app(test_config=None):
     else:
         app.config.update(test_config) 
     
-    database=create_engine(app.config['DB_URL'], encoding='utf-8', max_overflow=0)
+    database=create_engine(app.config['DB_URL'], encoding='utf-8', **pool_options(app.config, app.config['DB_URL']))
+    app.extensions['database']=instrument_pool(database, app.config.get('DB_MAX_OVERFLOW', 0))
+
+    replicas=[
+        instrument_pool(create_engine(replica_url, encoding='utf-8', **pool_options(app.config, replica_url)), app.config.get('DB_MAX_OVERFLOW', 0))
+        for replica_url in app.config.get('DB_REPLICA_URLS', [])
+    ]
+    router=ReplicaRouter(
+        database,
+        replicas,
+        app.config.get('DB_REPLICA_STRATEGY', 'round_robin'),
+        app.config.get('DB_READ_YOUR_WRITES', 5)
+    )
+
+    if app.config.get('METRICS', True):
+        app.extensions['metrics']=MetricsRegistry()
+        instrument_queries(database, app.extensions['metrics'])
+        for replica in replicas:
+            instrument_queries(replica, app.extensions['metrics'])
 
     # persistence layer
-    user_dao=UserDao(database)
-    tweet_dao=TweetDao(database)
+    id_generator=Snowflake(snowflake_worker_id(app.config)) if app.config.get('TWEET_IDS')=='snowflake' else None
+
+    user_dao=UserDao(database, router)
+    tweet_dao=TweetDao(database, router, id_generator)
+    timeline_dao=TimelineDao(database, router, id_generator is not None) if app.config.get('TIMELINE_FANOUT') else None
+    # tweets are moved to the archive by python -m service.archiver
+    archive_dao=ArchiveDao(database, router, id_generator is not None) if app.config.get('TWEET_ARCHIVE') else None
+    archive_watermark=ArchiveWatermark(archive_dao, app.config.get('TWEET_ARCHIVE_POLL', 1)) if archive_dao else None
 
     # business layer
+    timeline_cache=TimelineCache(
+        app.config['TIMELINE_CACHE_SIZE'],
+        app.config.get('TIMELINE_CACHE_TTL', 60)
+    ) if app.config.get('TIMELINE_CACHE_SIZE') else None
+
+    timeline_versions=TimelineVersions(user_dao, archive_watermark) if app.config.get('TIMELINE_ETAGS') else None
+
+    profile_cache=LRUCache(
+        app.config['PROFILE_CACHE_SIZE'],
+        app.config.get('PROFILE_CACHE_TTL', 300)
+    ) if app.config.get('PROFILE_CACHE_SIZE') else None
+
+    password_hasher=PasswordHasher(
+        app.config.get('PASSWORD_HASH_WORKERS', 0),
+        app.config.get('PASSWORD_HASH_MAX_PENDING'),
+        app.config.get('BCRYPT_ROUNDS', 12)
+    )
+
+    write_behind_mode=app.config.get('TWEET_WRITE_BEHIND')
+    if write_behind_mode and write_behind_mode not in ('durable', 'fast'):
+        raise ValueError(f"TWEET_WRITE_BEHIND must be 'durable' or 'fast', not {write_behind_mode!r}")
+
+    write_behind=TweetWriteBehind(
+        tweet_dao,
+        app.config.get('TWEET_WRITE_BEHIND_BATCH', 100),
+        app.config.get('TWEET_WRITE_BEHIND_DELAY', 0.005),
+        write_behind_mode=='durable',
+        app.config.get('TWEET_WRITE_BEHIND_MAX_PENDING', 10000)
+    ) if write_behind_mode else None
+
+    follow_graph=None
+    if app.config.get('FOLLOW_GRAPH'):
+        follow_graph=FollowGraph(
+            app.config.get('FOLLOW_GRAPH_COMPACT_AFTER', 100000),
+            user_dao,
+            app.config.get('FOLLOW_GRAPH_SYNC_INTERVAL', 1)
+        )
+        follow_graph.load_from(user_dao)
+
+    timeline_merger=None
+    if app.config.get('TIMELINE_ENGINE')=='pull':
+        # without the follow graph every merged page would query the follow list
+        if not follow_graph:
+            raise ValueError("TIMELINE_ENGINE 'pull' needs FOLLOW_GRAPH")
+
+        timeline_merger=TimelineMerger(
+            tweet_dao,
+            follow_graph.following,
+            app.config.get('TIMELINE_PULL_BUFFER', 50),
+            app.config.get('TIMELINE_PULL_AUTHORS', 100000),
+            ttl=app.config.get('TIMELINE_PULL_TTL', 60)
+        )
+
+    search_index=None
+    if app.config.get('SEARCH_INDEX'):
+        search_index=SearchIndex(
+            tweet_dao,
+            app.config.get('SEARCH_INDEX_BATCH', 10000),
+            app.config.get('SEARCH_INDEX_OVERLAP', 5),
+            compact_after=app.config.get('SEARCH_INDEX_COMPACT_AFTER', 1000)
+        )
+        search_index.refresh()
+
+    timeline_hub=None
+    if app.config.get('TIMELINE_STREAM'):
+        timeline_hub=TimelineHub(
+            app.config.get('TIMELINE_STREAM_MAX_CONNECTIONS', 1000),
+            app.config.get('TIMELINE_STREAM_MAX_PENDING', 100)
+        )
+        # tweets written by other processes reach the streams here through
+        # one poll for the whole process
+        app.extensions['timeline_poller']=TimelinePoller(timeline_hub, app.config.get('TIMELINE_STREAM_OVERLAP', 5)).start(tweet_dao, app.config.get('TIMELINE_STREAM_POLL_INTERVAL', 1))
+
     services=Service()
-    services.user_service=UserService(user_dao,app.config)
-    services.tweet_service=TweetService(tweet_dao)
+    services.user_service=UserService(user_dao,app.config,timeline_dao,timeline_cache,password_hasher,follow_graph,profile_cache,timeline_versions)
+    services.tweet_service=TweetService(tweet_dao,timeline_dao,timeline_cache,write_behind,timeline_merger,follow_graph,timeline_versions,search_index,archive_dao,timeline_hub,archive_watermark)
 
     # create endpoint
     create_endpoints(app,services)
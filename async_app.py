@@ -0,0 +1,103 @@
+import asyncio
+
+from quart import Quart
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from model import AsyncUserDao, AsyncTweetDao, AsyncArchiveDao, Snowflake, snowflake_worker_id, pool_options
+from service import AsyncUserService, AsyncTweetService, LRUCache, TimelineCache, PasswordHasher, FollowGraph, AsyncTimelineVersions, AsyncArchiveWatermark, TimelineHub, AsyncSubscription, TimelinePoller
+from view.async_endpoints import create_async_endpoints
+
+class Service:
+    pass
+
+##################################################
+# Create Async App
+##################################################
+
+def create_async_app(test_config=None):
+    app=Quart(__name__)
+
+    if test_config is None:
+        app.config.from_pyfile('config.py')
+    else:
+        app.config.update(test_config)
+
+    # DB_ASYNC_URL names an async driver, e.g. mysql+aiomysql:// or sqlite+aiosqlite://
+    url=app.config.get('DB_ASYNC_URL', app.config['DB_URL'])
+    options=pool_options(app.config, url)
+    if 'poolclass' in options:
+        options['poolclass']=AsyncAdaptedQueuePool
+    database=create_async_engine(url, **options)
+    app.extensions['database']=database
+
+    if app.config.get('JWT_CACHE_SIZE'):
+        app.extensions['token_cache']=LRUCache(app.config['JWT_CACHE_SIZE'])
+
+    # persistence layer
+    id_generator=Snowflake(snowflake_worker_id(app.config)) if app.config.get('TWEET_IDS')=='snowflake' else None
+
+    user_dao=AsyncUserDao(database)
+    tweet_dao=AsyncTweetDao(database, id_generator=id_generator)
+
+    # business layer
+    timeline_cache=TimelineCache(
+        app.config['TIMELINE_CACHE_SIZE'],
+        app.config.get('TIMELINE_CACHE_TTL', 60)
+    ) if app.config.get('TIMELINE_CACHE_SIZE') else None
+
+    # the archiver moves tweets out of timelines, which changes their ETags
+    archive_watermark=AsyncArchiveWatermark(AsyncArchiveDao(database), app.config.get('TWEET_ARCHIVE_POLL', 1)) if app.config.get('TWEET_ARCHIVE') else None
+    timeline_versions=AsyncTimelineVersions(user_dao, archive_watermark) if app.config.get('TIMELINE_ETAGS') else None
+
+    password_hasher=PasswordHasher(
+        app.config.get('PASSWORD_HASH_WORKERS', 0),
+        app.config.get('PASSWORD_HASH_MAX_PENDING'),
+        app.config.get('BCRYPT_ROUNDS', 12)
+    )
+
+    follow_graph=FollowGraph(app.config.get('FOLLOW_GRAPH_COMPACT_AFTER', 100000)) if app.config.get('FOLLOW_GRAPH') else None
+
+    timeline_hub=TimelineHub(
+        app.config.get('TIMELINE_STREAM_MAX_CONNECTIONS', 1000),
+        app.config.get('TIMELINE_STREAM_MAX_PENDING', 100),
+        AsyncSubscription
+    ) if app.config.get('TIMELINE_STREAM') else None
+    timeline_poller=TimelinePoller(timeline_hub, app.config.get('TIMELINE_STREAM_OVERLAP', 5)) if timeline_hub else None
+
+    # follows made through other processes are read from the change log by
+    # one task, since lookups on the event loop cannot query
+    async def sync_follow_graph():
+        while True:
+            await asyncio.sleep(app.config.get('FOLLOW_GRAPH_SYNC_INTERVAL', 1))
+            await user_dao.sync_follow_graph(follow_graph)
+
+    async def poll_timelines():
+        while True:
+            await asyncio.sleep(app.config.get('TIMELINE_STREAM_POLL_INTERVAL', 1))
+            await tweet_dao.poll_timelines(timeline_poller)
+
+    tasks=[]
+
+    @app.before_serving
+    async def load_follow_graph():
+        if follow_graph:
+            await user_dao.load_follow_graph(follow_graph)
+            tasks.append(asyncio.create_task(sync_follow_graph()))
+        if timeline_poller:
+            tasks.append(asyncio.create_task(poll_timelines()))
+
+    @app.after_serving
+    async def close_database():
+        for task in tasks:
+            task.cancel()
+        await database.dispose()
+
+    services=Service()
+    services.user_service=AsyncUserService(user_dao,app.config,timeline_cache=timeline_cache,password_hasher=password_hasher,follow_graph=follow_graph,timeline_versions=timeline_versions)
+    services.tweet_service=AsyncTweetService(tweet_dao,timeline_cache=timeline_cache,follow_graph=follow_graph,timeline_versions=timeline_versions,timeline_hub=timeline_hub)
+
+    # create endpoint
+    create_async_endpoints(app,services)
+
+    return app
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+
+from app import create_app
+from async_app import create_async_app
+from model.async_dao import AsyncDao
+from .hot_paths import build_database, percentile
+
+def summarize(name, latencies, elapsed):
+    latencies.sort()
+    return {
+        'name':name,
+        'requests':len(latencies),
+        'requests_per_second':round(len(latencies)/elapsed, 1),
+        'p50_ms':round(percentile(latencies, 0.5)*1000, 1),
+        'p99_ms':round(percentile(latencies, 0.99)*1000, 1)
+    }
+
+def run_sync(app_config, args):
+    app=create_app(app_config)
+
+    # every query holds its connection and its worker thread for the delay,
+    # like a round trip to a remote database
+    @event.listens_for(app.extensions['database'], 'before_cursor_execute')
+    def slow_query(*_):
+        time.sleep(args.delay_ms/1000)
+
+    def timeline_read(n):
+        started=time.perf_counter()
+        assert app.test_client().get(f'/timeline/{n%args.users+1}').status_code==200
+        return time.perf_counter()-started
+
+    started=time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        latencies=list(executor.map(timeline_read, range(args.requests)))
+    return summarize(f'sync_{args.threads}_threads', latencies, time.perf_counter()-started)
+
+def run_async(app_config, args):
+    app=create_async_app(app_config)
+
+    # the same delay, awaited while the connection is held
+    async def slow_run(self, call):
+        async with self.db.begin() as conn:
+            await asyncio.sleep(args.delay_ms/1000)
+            return await conn.run_sync(lambda sync_conn: call(self.dao_class(sync_conn, **self.options)))
+    AsyncDao.run=slow_run
+
+    async def scenario():
+        api=app.test_client()
+        in_flight=asyncio.Semaphore(args.concurrency)
+
+        async def timeline_read(n):
+            async with in_flight:
+                started=time.perf_counter()
+                resp=await api.get(f'/timeline/{n%args.users+1}')
+                assert resp.status_code==200
+                return time.perf_counter()-started
+
+        started=time.perf_counter()
+        latencies=await asyncio.gather(*[timeline_read(n) for n in range(args.requests)])
+        elapsed=time.perf_counter()-started
+        await app.extensions['database'].dispose()
+        return summarize(f'async_{args.concurrency}_in_flight', list(latencies), elapsed)
+
+    return asyncio.run(scenario())
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='many slow concurrent timeline reads against the sync and async apps')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--fanout', type=int, default=20)
+    parser.add_argument('--tweets-per-user', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--delay-ms', type=float, default=100, help='simulated database round trip per query')
+    parser.add_argument('--threads', type=int, default=16, help='worker threads of the sync app')
+    parser.add_argument('--concurrency', type=int, default=200, help='requests in flight against the async app')
+    parser.add_argument('--pool-size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args=parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='miniter-bench-') as directory:
+        db_path=os.path.join(directory, 'bench.sqlite')
+        build_database(f'sqlite:///{db_path}', args.users, args.fanout, args.tweets_per_user, args.seed, 4).dispose()
+
+        app_config={
+            'DB_URL':f'sqlite:///{db_path}',
+            'DB_ASYNC_URL':f'sqlite+aiosqlite:///{db_path}',
+            'DB_CONNECT_ARGS':{'check_same_thread':False},
+            'DB_POOL_SIZE':args.pool_size,
+            'JWT_SECRET_KEY':'benchmark',
+            'ALGORITHM':'HS256',
+            'METRICS':False
+        }
+
+        report={
+            'parameters':vars(args),
+            'results':[run_sync(app_config, args), run_async(app_config, args)]
+        }
+        sys.stdout.write(json.dumps(report, indent=2, sort_keys=True)+'\n')
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
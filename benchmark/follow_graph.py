@@ -0,0 +1,45 @@
+import sys
+import json
+import time
+import random
+import argparse
+
+from service import FollowGraph
+from .social_graph import SocialGraph
+
+def per_lookup_us(lookup, user_ids):
+    started=time.perf_counter()
+    for user_id in user_ids:
+        lookup(user_id)
+    return round((time.perf_counter()-started)*1000000/len(user_ids), 3)
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='load a power-law follow graph into the in-memory index')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--mean-follows', type=float, default=50)
+    parser.add_argument('--alpha', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args=parser.parse_args(argv)
+
+    graph=SocialGraph(args.users, args.mean_follows, args.alpha, 0, args.seed)
+    follow_graph=FollowGraph()
+
+    started=time.perf_counter()
+    follow_graph.load((follow['user_id'], follow['follow_user_id']) for follow in graph.iter_follows())
+    load_seconds=time.perf_counter()-started
+
+    rng=random.Random(args.seed)
+    user_ids=[rng.randrange(1, args.users+1) for _ in range(args.lookups)]
+
+    report=follow_graph.stats()
+    report.update({
+        'seed':args.seed,
+        'load_seconds':round(load_seconds, 3),
+        'following_us':per_lookup_us(follow_graph.following, user_ids),
+        'followers_us':per_lookup_us(follow_graph.followers, user_ids)
+    })
+    sys.stdout.write(json.dumps(report, sort_keys=True)+'\n')
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
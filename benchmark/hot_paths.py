@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import random
+import bcrypt
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+
+from app import create_app
+from model import TweetDao, migrate
+
+PASSWORD='password'
+
+def build_database(db_url, users, fanout, tweets_per_user, seed, rounds):
+    engine=create_engine(db_url)
+    migrate(engine)
+
+    rng=random.Random(seed)
+    hashed_password=bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    started_at=datetime(2020, 1, 1)
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO users (id, name, email, profile, hashed_password)
+            VALUES (:id, :name, :email, :profile, :hashed_password)
+        """), [{
+            'id':user_id,
+            'name':f'user{user_id}',
+            'email':f'user{user_id}@mail.com',
+            'profile':f'user{user_id} profile',
+            'hashed_password':hashed_password
+        } for user_id in range(1, users+1)])
+
+        follows=[]
+        for user_id in range(1, users+1):
+            candidates=[candidate for candidate in rng.sample(range(1, users+1), min(fanout+1, users)) if candidate!=user_id]
+            follows.extend({'user_id':user_id, 'follow_user_id':follow_id} for follow_id in candidates[:fanout])
+        conn.execute(text("""
+            INSERT INTO users_follow_list (user_id, follow_user_id)
+            VALUES (:user_id, :follow_user_id)
+        """), follows)
+
+        conn.execute(text("""
+            INSERT INTO tweets (user_id, tweet, created_at)
+            VALUES (:user_id, :tweet, :created_at)
+        """), [{
+            'user_id':user_id,
+            'tweet':f'tweet {n} from user{user_id}',
+            'created_at':started_at+timedelta(seconds=rng.randrange(365*24*60*60))
+        } for user_id in range(1, users+1) for n in range(tweets_per_user)])
+
+        # materialized timelines, for runs with TIMELINE_FANOUT
+        conn.execute(text("""
+            INSERT INTO timelines (user_id, tweet_id, created_at)
+            SELECT t.user_id, t.id, t.created_at FROM tweets t
+            UNION ALL
+            SELECT ufl.user_id, t.id, t.created_at
+            FROM tweets t
+            JOIN users_follow_list ufl ON ufl.follow_user_id=t.user_id
+        """))
+
+    return engine
+
+def percentile(samples, fraction):
+    return samples[min(int(len(samples)*fraction), len(samples)-1)]
+
+def measure(name, operation, iterations, memory_iterations):
+    for _ in range(min(iterations, 10)):
+        operation()
+
+    samples=[]
+    started=time.perf_counter()
+    for _ in range(iterations):
+        op_started=time.perf_counter()
+        operation()
+        samples.append(time.perf_counter()-op_started)
+    elapsed=time.perf_counter()-started
+
+    # tracemalloc slows every allocation down, so memory gets its own pass
+    tracemalloc.start()
+    for _ in range(memory_iterations):
+        operation()
+    _, peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        'name':name,
+        'iterations':iterations,
+        'ops_per_second':round(iterations/elapsed, 2),
+        'p50_ms':round(percentile(samples, 0.5)*1000, 3),
+        'p99_ms':round(percentile(samples, 0.99)*1000, 3),
+        'peak_memory_kb':round(peak/1024, 1)
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix='miniter-bench-') as directory:
+        return run_scenarios(args, directory)
+
+def run_scenarios(args, directory):
+    db_url='sqlite:///'+os.path.join(directory, 'bench.sqlite')
+    engine=build_database(db_url, args.users, args.fanout, args.tweets_per_user, args.seed, args.rounds)
+
+    app_config={
+        'DB_URL':db_url,
+        'DB_CONNECT_ARGS':{'check_same_thread':False},
+        'JWT_SECRET_KEY':'benchmark',
+        'ALGORITHM':'HS256',
+        'BCRYPT_ROUNDS':args.rounds
+    }
+    app_config.update(args.config)
+    api=create_app(app_config).test_client()
+
+    rng=random.Random(args.seed)
+    def random_user():
+        return rng.randrange(1, args.users+1)
+
+    access_token=api.post('/login', json={'email':'user1@mail.com', 'password':PASSWORD}).json['access_token']
+    tweet_dao=TweetDao(engine)
+
+    scenarios=[
+        ('dao_get_timeline', lambda: tweet_dao.get_timeline(random_user())),
+        ('dao_get_timeline_page', lambda: tweet_dao.get_timeline_page(random_user(), args.page_size)),
+        ('http_timeline', lambda: api.get(f'/timeline/{random_user()}')),
+        ('http_timeline_page', lambda: api.get(f'/timeline/{random_user()}?limit={args.page_size}')),
+        ('http_tweet', lambda: api.post('/tweet', json={'tweet':'benchmark tweet'}, headers={'Authorization':access_token})),
+        ('http_login', lambda: api.post('/login', json={'email':f'user{random_user()}@mail.com', 'password':PASSWORD}))
+    ]
+
+    results=[
+        measure(name, operation, args.iterations, args.memory_iterations)
+        for name, operation in scenarios
+        if not args.only or name in args.only
+    ]
+    engine.dispose()
+
+    return {
+        'revision':git_revision(),
+        'parameters':{
+            'users':args.users,
+            'fanout':args.fanout,
+            'tweets_per_user':args.tweets_per_user,
+            'page_size':args.page_size,
+            'iterations':args.iterations,
+            'seed':args.seed,
+            'rounds':args.rounds,
+            'config':args.config
+        },
+        'results':results
+    }
+
+def config_value(option):
+    key, _, value=option.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='timeline, tweet and login hot path benchmarks on SQLite')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=50)
+    parser.add_argument('--tweets-per-user', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--memory-iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--only', nargs='*', default=[])
+    parser.add_argument('--config', type=config_value, action='append', default=[], help='extra app config as KEY=JSON')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args=parser.parse_args(argv)
+    args.config=dict(args.config)
+
+    report=json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report+'\n')
+    else:
+        sys.stdout.write(report+'\n')
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
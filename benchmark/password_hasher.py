@@ -0,0 +1,52 @@
+import sys
+import json
+import time
+import bcrypt
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor
+from service import PasswordHasher, PasswordHasherBusy
+
+def run(workers, clients, requests, rounds):
+    hasher=PasswordHasher(workers, clients, rounds)
+    hashed_password=bcrypt.hashpw(b'password', bcrypt.gensalt(rounds))
+
+    def login(_):
+        try:
+            return hasher.checkpw('password', hashed_password)
+        except PasswordHasherBusy:
+            return None
+
+    # client threads stand in for the web server's request threads
+    started=time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results=list(pool.map(login, range(requests)))
+    elapsed=time.perf_counter()-started
+    hasher.shutdown()
+
+    rejected=results.count(None)
+    return {
+        'benchmark':'password_hasher',
+        'workers':workers,
+        'clients':clients,
+        'requests':requests,
+        'rounds':rounds,
+        'rejected':rejected,
+        'seconds':round(elapsed, 4),
+        'logins_per_second':round((requests-rejected)/elapsed, 2)
+    }
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='login throughput versus password hasher pool size')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=10)
+    args=parser.parse_args(argv)
+
+    for workers in args.workers:
+        print(json.dumps(run(workers, args.clients, args.requests, args.rounds)))
+        sys.stdout.flush()
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+import sys
+import json
+import gzip
+import time
+import argparse
+
+from datetime import datetime, timedelta
+from flask import Flask, jsonify
+
+from view import CustomJSONEncoder
+from view import serialization
+
+def timeline(items):
+    started_at=datetime(2020, 1, 1)
+    return {
+        'user_id':1,
+        'timeline':[{
+            'id':n,
+            'user_id':n%100,
+            'tweet':f'tweet {n} with a few more words to look like a real one',
+            'created_at':started_at+timedelta(seconds=n)
+        } for n in range(items, 0, -1)],
+        'next_cursor':None
+    }
+
+def measure(operation, iterations):
+    operation()
+    started=time.perf_counter()
+    for _ in range(iterations):
+        operation()
+    return round((time.perf_counter()-started)*1000/iterations, 3)
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='serialize a timeline response with each JSON backend')
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--gzip-level', type=int, default=6)
+    args=parser.parse_args(argv)
+
+    payload=timeline(args.items)
+    app=Flask(__name__)
+    app.json_encoder=CustomJSONEncoder
+
+    body=serialization.dumps(payload)
+    with app.app_context():
+        report={
+            'items':args.items,
+            'backend':'orjson' if serialization.orjson else 'json',
+            'jsonify_ms':measure(lambda: jsonify(payload).get_data(), args.iterations),
+            'json_response_ms':measure(lambda: serialization.json_response(payload).get_data(), args.iterations),
+            'gzip_ms':measure(lambda: gzip.compress(body, args.gzip_level), args.iterations),
+            'bytes':len(body),
+            'gzip_bytes':len(gzip.compress(body, args.gzip_level))
+        }
+
+    sys.stdout.write(json.dumps(report, sort_keys=True)+'\n')
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
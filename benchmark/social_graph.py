@@ -0,0 +1,150 @@
+import sys
+import json
+import time
+import bisect
+import random
+import bcrypt
+import argparse
+import itertools
+
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+
+from model import migrate
+
+INSERT_USERS=text("""
+    INSERT INTO users (id, name, email, profile, hashed_password)
+    VALUES (:id, :name, :email, :profile, :hashed_password)
+""")
+
+INSERT_FOLLOWS=text("""
+    INSERT INTO users_follow_list (user_id, follow_user_id)
+    VALUES (:user_id, :follow_user_id)
+""")
+
+INSERT_TWEETS=text("""
+    INSERT INTO tweets (user_id, tweet, created_at)
+    VALUES (:user_id, :tweet, :created_at)
+""")
+
+class SocialGraph:
+    def __init__(self, users, mean_follows, alpha, mean_tweets, seed, days=365):
+        self.users=users
+        self.mean_follows=mean_follows
+        self.alpha=alpha
+        self.mean_tweets=mean_tweets
+        self.seed=seed
+        self.days=days
+
+        # Zipf popularity: the account ranked r gets weight 1/r**alpha, so
+        # follower counts follow a power law with a few celebrity accounts
+        self.cum_weights=array('d', itertools.accumulate(1/rank**alpha for rank in range(1, users+1)))
+
+    def rng(self, stream):
+        # one independent stream per table keeps each table reproducible on its own
+        return random.Random(f'{self.seed}:{stream}')
+
+    def iter_users(self, hashed_password):
+        for user_id in range(1, self.users+1):
+            yield {
+                'id':user_id,
+                'name':f'user{user_id}',
+                'email':f'user{user_id}@mail.com',
+                'profile':f'user{user_id} profile',
+                'hashed_password':hashed_password
+            }
+
+    def iter_follows(self):
+        rng=self.rng('follows')
+        total=self.cum_weights[-1]
+        for user_id in range(1, self.users+1):
+            count=min(int(rng.expovariate(1/self.mean_follows)) if self.mean_follows else 0, self.users-1)
+            follows=set()
+            attempts=0
+            while len(follows)<count and attempts<count*4:
+                attempts+=1
+                follow_id=bisect.bisect_left(self.cum_weights, rng.random()*total)+1
+                if follow_id!=user_id and follow_id<=self.users:
+                    follows.add(follow_id)
+
+            for follow_id in sorted(follows):
+                yield {
+                    'user_id':user_id,
+                    'follow_user_id':follow_id
+                }
+
+    def iter_tweets(self):
+        rng=self.rng('tweets')
+        started_at=datetime(2020, 1, 1)
+        for user_id in range(1, self.users+1):
+            count=int(rng.expovariate(1/self.mean_tweets)) if self.mean_tweets else 0
+            for n in range(count):
+                yield {
+                    'user_id':user_id,
+                    'tweet':f'tweet {n} from user{user_id}',
+                    'created_at':started_at+timedelta(seconds=rng.randrange(self.days*24*60*60))
+                }
+
+def chunks(rows, size):
+    rows=iter(rows)
+    while True:
+        chunk=list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def load(engine, statement, rows, chunk_size, transaction_chunks):
+    loaded=0
+    started=time.perf_counter()
+    conn=engine.connect()
+    try:
+        transaction=conn.begin()
+        for n, chunk in enumerate(chunks(rows, chunk_size), 1):
+            conn.execute(statement, chunk)
+            loaded+=len(chunk)
+            if n%transaction_chunks==0:
+                transaction.commit()
+                transaction=conn.begin()
+        transaction.commit()
+    finally:
+        conn.close()
+
+    elapsed=time.perf_counter()-started
+    return {
+        'rows':loaded,
+        'seconds':round(elapsed, 3),
+        'rows_per_second':round(loaded/elapsed, 1) if elapsed else None
+    }
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='generate a power-law social graph and bulk load it')
+    parser.add_argument('--db-url', required=True)
+    parser.add_argument('--migrate', action='store_true', help='migrate the schema first')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--mean-follows', type=float, default=50)
+    parser.add_argument('--alpha', type=float, default=1.0, help='Zipf exponent of follower popularity')
+    parser.add_argument('--mean-tweets', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--transaction-chunks', type=int, default=10, help='chunks committed per transaction')
+    args=parser.parse_args(argv)
+
+    engine=create_engine(args.db_url)
+    if args.migrate:
+        migrate(engine)
+
+    graph=SocialGraph(args.users, args.mean_follows, args.alpha, args.mean_tweets, args.seed)
+    hashed_password=bcrypt.hashpw(b'password', bcrypt.gensalt(args.rounds)).decode('utf-8')
+
+    report={
+        'seed':args.seed,
+        'users':load(engine, INSERT_USERS, graph.iter_users(hashed_password), args.chunk_size, args.transaction_chunks),
+        'users_follow_list':load(engine, INSERT_FOLLOWS, graph.iter_follows(), args.chunk_size, args.transaction_chunks),
+        'tweets':load(engine, INSERT_TWEETS, graph.iter_tweets(), args.chunk_size, args.transaction_chunks)
+    }
+    sys.stdout.write(json.dumps(report, sort_keys=True)+'\n')
+
+if __name__=='__main__':
+    main()
\ No newline at end of file
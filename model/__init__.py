@@ -1,7 +1,31 @@
 from .user_dao import UserDao
 from .tweet_dao import TweetDao
+from .timeline_dao import TimelineDao
+from .archive_dao import ArchiveDao
+from .async_dao import AsyncUserDao, AsyncTweetDao, AsyncArchiveDao
+from .replica import ReplicaRouter
+from .schema import migrate
+from .snowflake import Snowflake, snowflake_worker_id, snowflake_span
+from .pool import pool_options, instrument_pool, pool_timed_out, pool_status
+from .metrics import MetricsRegistry, instrument_queries, ROW_BUCKETS
 
 __all__=[
     'UserDao',
-    'TweetDao'
+    'TweetDao',
+    'TimelineDao',
+    'ArchiveDao',
+    'AsyncUserDao',
+    'AsyncTweetDao',
+    'AsyncArchiveDao',
+    'ReplicaRouter',
+    'migrate',
+    'Snowflake',
+    'snowflake_span',
+    'pool_options',
+    'instrument_pool',
+    'pool_timed_out',
+    'pool_status',
+    'MetricsRegistry',
+    'instrument_queries',
+    'ROW_BUCKETS'
 ]
\ No newline at end of file
@@ -0,0 +1,119 @@
+from sqlalchemy import text, bindparam
+from .replica import ReplicaRouter
+from .metrics import label_queries
+
+def days_ago(dialect):
+    # past the horizon by the database clock, whatever the clock and time
+    # zone of the host running the archiver
+    if dialect=='sqlite':
+        return "datetime('now', '-' || :days || ' days')"
+    if dialect=='postgresql':
+        return "CURRENT_TIMESTAMP - :days * INTERVAL '1 day'"
+    return "CURRENT_TIMESTAMP - INTERVAL :days DAY"
+
+@label_queries
+class ArchiveDao:
+    def __init__(self, database, router=None, order_by_id=False):
+        self.db=database
+        self.router=router or ReplicaRouter(database)
+        self.order_by_id=order_by_id
+
+    def archive_tweets(self,horizon_days,limit):
+        # moves the oldest tweets created more than horizon_days ago and their
+        # timeline rows in one transaction, so a chunk is either hot or archived
+        with self.db.begin() as conn:
+            tweet_ids=[row['id'] for row in conn.execute(text(f"""
+                SELECT id
+                FROM tweets
+                WHERE created_at<{days_ago(conn.dialect.name)}
+                ORDER BY created_at, id
+                LIMIT :limit
+            """), {
+                'days':horizon_days,
+                'limit':limit
+            }).fetchall()]
+
+            if not tweet_ids:
+                return 0
+
+            conn.execute(text("""
+                INSERT INTO tweets_archive (
+                    id,
+                    user_id,
+                    tweet,
+                    created_at
+                )
+                SELECT id, user_id, tweet, created_at
+                FROM tweets
+                WHERE id IN :tweet_ids
+            """).bindparams(bindparam('tweet_ids', expanding=True)), {
+                'tweet_ids':tweet_ids
+            })
+            conn.execute(text("""
+                DELETE FROM timelines
+                WHERE tweet_id IN :tweet_ids
+            """).bindparams(bindparam('tweet_ids', expanding=True)), {
+                'tweet_ids':tweet_ids
+            })
+            conn.execute(text("""
+                DELETE FROM tweets
+                WHERE id IN :tweet_ids
+            """).bindparams(bindparam('tweet_ids', expanding=True)), {
+                'tweet_ids':tweet_ids
+            })
+            conn.execute(text("""
+                UPDATE archive_state
+                SET generation=generation+1
+                WHERE id=1
+            """))
+
+            return len(tweet_ids)
+
+    def get_generation(self):
+        return self.router.reader().execute(text("""
+            SELECT generation
+            FROM archive_state
+            WHERE id=1
+        """)).scalar() or 0
+
+    def get_timeline_page(self,user_id,limit,created_at=None,tweet_id=None):
+        if self.order_by_id:
+            order="ta.id DESC"
+            keyset="AND ta.id<:tweet_id" if tweet_id is not None else ""
+        else:
+            order="ta.created_at DESC, ta.id DESC"
+            keyset="""
+                AND ta.created_at<=:created_at
+                AND (ta.created_at<:created_at OR ta.id<:tweet_id)
+            """ if created_at is not None else ""
+
+        timeline=self.router.reader(user_id).execute(text(f"""
+            SELECT
+                ta.id,
+                ta.user_id,
+                ta.tweet,
+                ta.created_at
+            FROM tweets_archive ta
+            WHERE ta.user_id IN (
+                SELECT follow_user_id
+                FROM users_follow_list
+                WHERE user_id=:user_id
+                UNION ALL
+                SELECT :user_id
+            )
+            {keyset}
+            ORDER BY {order}
+            LIMIT :limit
+        """), {
+            'user_id':user_id,
+            'created_at':created_at,
+            'tweet_id':tweet_id,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
+        } for tweet in timeline]
\ No newline at end of file
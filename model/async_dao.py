@@ -0,0 +1,86 @@
+from .user_dao import UserDao
+from .tweet_dao import TweetDao
+from .archive_dao import ArchiveDao
+
+class AsyncDao:
+    dao_class=None
+
+    def __init__(self, database, **options):
+        self.db=database
+        self.options=options
+
+    async def run(self, call):
+        # the synchronous DAO runs on the AsyncEngine connection through
+        # run_sync; its queries await the async driver instead of blocking
+        # a thread, and the SQL stays in one place
+        async with self.db.begin() as conn:
+            return await conn.run_sync(lambda sync_conn: call(self.dao_class(sync_conn, **self.options)))
+
+class AsyncUserDao(AsyncDao):
+    dao_class=UserDao
+
+    async def get_user(self,user_id):
+        return await self.run(lambda dao: dao.get_user(user_id))
+
+    async def insert_user(self,user):
+        return await self.run(lambda dao: dao.insert_user(user))
+
+    async def get_users(self,user_ids):
+        return await self.run(lambda dao: dao.get_users(user_ids))
+
+    async def update_profile(self,user_id,name=None,profile=None):
+        return await self.run(lambda dao: dao.update_profile(user_id, name, profile))
+
+    async def get_user_id_and_password(self,email):
+        return await self.run(lambda dao: dao.get_user_id_and_password(email))
+
+    async def insert_follow(self,user_id,follow_id):
+        return await self.run(lambda dao: dao.insert_follow(user_id, follow_id))
+
+    async def insert_unfollow(self,user_id,unfollow_id):
+        return await self.run(lambda dao: dao.insert_unfollow(user_id, unfollow_id))
+
+    async def get_follow_ids(self,user_id):
+        return await self.run(lambda dao: dao.get_follow_ids(user_id))
+
+    async def bump_timeline_versions(self,user_ids,followers=False):
+        return await self.run(lambda dao: dao.bump_timeline_versions(user_ids, followers))
+
+    async def get_timeline_version(self,user_id):
+        return await self.run(lambda dao: dao.get_timeline_version(user_id))
+
+    async def load_follow_graph(self,follow_graph):
+        return await self.run(lambda dao: follow_graph.load_from(dao))
+
+    async def sync_follow_graph(self,follow_graph):
+        return await self.run(lambda dao: follow_graph.sync(dao))
+
+class AsyncTweetDao(AsyncDao):
+    dao_class=TweetDao
+
+    async def insert_tweet(self,user_id,tweet):
+        return await self.run(lambda dao: dao.insert_tweet(user_id, tweet))
+
+    async def get_tweet(self,tweet_id):
+        return await self.run(lambda dao: dao.get_tweet(tweet_id))
+
+    async def get_follower_ids(self,user_id):
+        return await self.run(lambda dao: dao.get_follower_ids(user_id))
+
+    async def get_timeline(self,user_id):
+        return await self.run(lambda dao: dao.get_timeline(user_id))
+
+    async def get_timeline_since(self,user_id,since_id,limit,overlap=0):
+        return await self.run(lambda dao: dao.get_timeline_since(user_id, since_id, limit, overlap))
+
+    async def get_timeline_page(self,user_id,limit,created_at=None,tweet_id=None):
+        return await self.run(lambda dao: dao.get_timeline_page(user_id, limit, created_at, tweet_id))
+
+    async def poll_timelines(self,timeline_poller):
+        return await self.run(lambda dao: timeline_poller.poll(dao))
+
+class AsyncArchiveDao(AsyncDao):
+    dao_class=ArchiveDao
+
+    async def get_generation(self):
+        return await self.run(lambda dao: dao.get_generation())
\ No newline at end of file
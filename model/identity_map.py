@@ -0,0 +1,33 @@
+from flask import g, has_app_context
+
+MISSING=object()
+
+# rows read through a DAO are remembered on flask.g, so a request that asks
+# for the same row twice only pays for one query
+def get_identity_map():
+    if not has_app_context():
+        return None
+
+    if 'identity_map' not in g:
+        g.identity_map={}
+
+    return g.identity_map
+
+def lookup(key):
+    identity_map=get_identity_map()
+    if identity_map is None:
+        return MISSING
+
+    return identity_map.get(key, MISSING)
+
+def remember(key, value):
+    identity_map=get_identity_map()
+    if identity_map is not None:
+        identity_map[key]=value
+
+    return value
+
+def forget(key):
+    identity_map=get_identity_map()
+    if identity_map is not None:
+        identity_map.pop(key, None)
\ No newline at end of file
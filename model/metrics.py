@@ -0,0 +1,158 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS=(0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+def format_labels(labelnames, labels, extra=()):
+    pairs=list(zip(labelnames, labels))+list(extra)
+    if not pairs:
+        return ''
+
+    return '{'+','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)+'}'
+
+class Histogram:
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name=name
+        self.description=description
+        self.labelnames=labelnames
+        self.buckets=buckets
+        self.series={}
+        self.lock=threading.Lock()
+
+    def observe(self, labels, value):
+        index=bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series=self.series.get(labels)
+            if series is None:
+                # per-bucket counts, accumulated into cumulative ones on render
+                series=self.series[labels]=[[0]*(len(self.buckets)+1), 0, 0.0]
+            series[0][index]+=1
+            series[1]+=1
+            series[2]+=value
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series=[(labels, list(counts), count, total) for labels, (counts, count, total) in self.series.items()]
+
+        for labels, counts, count, total in sorted(series):
+            cumulative=0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative+=bucket_count
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {count}')
+
+        return lines
+
+class Counter:
+    def __init__(self, name, description, labelnames=()):
+        self.name=name
+        self.description=description
+        self.labelnames=labelnames
+        self.series={}
+        self.lock=threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self.lock:
+            self.series[labels]=self.series.get(labels, 0)+value
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series=sorted(self.series.items())
+
+        for labels, value in series:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {value}')
+
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics={}
+
+    def register(self, metric):
+        # registering a name twice hands back the first metric, so several
+        # engines can share one query histogram
+        return self.metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labelnames, buckets))
+
+    def counter(self, name, description, labelnames=()):
+        return self.register(Counter(name, description, labelnames))
+
+    def render(self):
+        lines=[]
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+
+        return '\n'.join(lines)+'\n'
+
+# the DAO method running the current query, set by label_queries
+dao_method=contextvars.ContextVar('dao_method', default='other')
+
+def label_method(name, f):
+    if inspect.isgeneratorfunction(f):
+        # a generator runs its queries while it is iterated, not when called
+        @functools.wraps(f)
+        def generator(*args, **kwargs):
+            iterator=f(*args, **kwargs)
+            while True:
+                token=dao_method.set(name)
+                try:
+                    item=next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    dao_method.reset(token)
+                yield item
+        return generator
+
+    @functools.wraps(f)
+    def labelled(*args, **kwargs):
+        token=dao_method.set(name)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            dao_method.reset(token)
+    return labelled
+
+def label_queries(cls):
+    # class decorator naming every query of a public DAO method by
+    # Class.method for the query latency histogram
+    for name, f in list(vars(cls).items()):
+        if callable(f) and not name.startswith('_'):
+            setattr(cls, name, label_method(f'{cls.__name__}.{name}', f))
+    return cls
+
+def instrument_queries(engine, registry):
+    query_latency=registry.histogram(
+        'miniter_query_latency_seconds',
+        'SQL query latency per DAO method.',
+        ('method',)
+    )
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append((dao_method.get(), time.perf_counter()))
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        method, started=conn.info['query_started'].pop()
+        query_latency.observe((method,), time.perf_counter()-started)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+
+    return engine
\ No newline at end of file
@@ -0,0 +1,116 @@
+import time
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+class PoolStats:
+    def __init__(self, max_overflow=0):
+        self.max_overflow=max_overflow
+        self.connects=0
+        self.checkouts=0
+        self.checkins=0
+        self.invalidations=0
+        self.timeouts=0
+        self.saturations=0
+        self.saturated_seconds=0.0
+        self.max_saturated_seconds=0.0
+        self.saturated_since=None
+        self.lock=threading.Lock()
+
+    def checked_out(self, pool):
+        # there is no public event before a checkout starts waiting, so the
+        # pool counts as saturated from the checkout that took its last
+        # connection to the next checkin; any checkout in between waits
+        if not isinstance(pool, QueuePool) or self.max_overflow<0:
+            return
+
+        with self.lock:
+            if self.saturated_since is None and pool.checkedout()>=pool.size()+self.max_overflow:
+                self.saturated_since=time.perf_counter()
+                self.saturations+=1
+
+    def checked_in(self):
+        with self.lock:
+            if self.saturated_since is None:
+                return
+
+            seconds=time.perf_counter()-self.saturated_since
+            self.saturated_since=None
+            self.saturated_seconds+=seconds
+            self.max_saturated_seconds=max(self.max_saturated_seconds, seconds)
+
+def pool_options(config, url):
+    # sqlite keeps the dialect's own pool, a queue of connections to one
+    # file only adds locking
+    if make_url(url).get_backend_name()=='sqlite':
+        return {
+            'pool_recycle':config.get('DB_POOL_RECYCLE', -1),
+            'pool_pre_ping':config.get('DB_POOL_PRE_PING', False),
+            'connect_args':config.get('DB_CONNECT_ARGS', {})
+        }
+
+    return {
+        'poolclass':QueuePool,
+        'pool_size':config.get('DB_POOL_SIZE', 5),
+        'max_overflow':config.get('DB_MAX_OVERFLOW', 0),
+        'pool_timeout':config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle':config.get('DB_POOL_RECYCLE', -1),
+        'pool_pre_ping':config.get('DB_POOL_PRE_PING', False),
+        'connect_args':config.get('DB_CONNECT_ARGS', {})
+    }
+
+def instrument_pool(engine, max_overflow=0):
+    # held by the engine, so the counts survive the pool being recreated
+    stats=engine.pool_stats=PoolStats(max_overflow)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        stats.connects+=1
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts+=1
+        stats.checked_out(engine.pool)
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        stats.checkins+=1
+        stats.checked_in()
+
+    @event.listens_for(engine, 'invalidate')
+    def invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidations+=1
+
+    return engine
+
+def pool_timed_out(engine):
+    # a checkout that waited DB_POOL_TIMEOUT raises out of the pool, past
+    # every pool event, so the app counts it where it handles the error
+    stats=getattr(engine, 'pool_stats', None)
+    if stats:
+        stats.timeouts+=1
+
+def pool_status(engine):
+    pool=engine.pool
+    stats=getattr(engine, 'pool_stats', None) or PoolStats()
+    queued=isinstance(pool, QueuePool)
+    saturated_since=stats.saturated_since
+
+    return {
+        'pool':type(pool).__name__,
+        'size':pool.size() if queued else None,
+        'checked_in':pool.checkedin() if queued else None,
+        'checked_out':pool.checkedout() if queued else stats.checkouts-stats.checkins,
+        'overflow':max(pool.overflow(), 0) if queued else None,
+        'connects':stats.connects,
+        'checkouts':stats.checkouts,
+        'checkins':stats.checkins,
+        'invalidations':stats.invalidations,
+        'timeouts':stats.timeouts,
+        'saturated':saturated_since is not None,
+        'saturations':stats.saturations,
+        'saturated_seconds':stats.saturated_seconds+(time.perf_counter()-saturated_since if saturated_since is not None else 0),
+        'max_saturated_seconds':stats.max_saturated_seconds
+    }
\ No newline at end of file
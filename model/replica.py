@@ -0,0 +1,72 @@
+import time
+import itertools
+import threading
+from collections import OrderedDict
+
+class ReplicaRouter:
+    def __init__(self, primary, replicas=(), strategy='round_robin', read_your_writes=5, max_tracked_writes=100000, clock=time.monotonic):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f'unknown replica strategy: {strategy}')
+
+        self.primary=primary
+        self.replicas=list(replicas)
+        self.strategy=strategy
+        self.read_your_writes=read_your_writes
+        self.max_tracked_writes=max_tracked_writes
+        self.clock=clock
+        self.turns=itertools.count()
+        # keys written within the read-your-writes window are read back from
+        # the primary, so users see their own writes despite replication lag;
+        # oldest write first, at most max_tracked_writes of them
+        self.recent_writes=OrderedDict()
+        self.lock=threading.Lock()
+
+    def mark_write(self, *keys):
+        if not self.replicas or not self.read_your_writes:
+            return
+
+        now=self.clock()
+        with self.lock:
+            for key in keys:
+                self.recent_writes[key]=now
+                self.recent_writes.move_to_end(key)
+
+            while self.recent_writes:
+                written_at=next(iter(self.recent_writes.values()))
+                if len(self.recent_writes)<=self.max_tracked_writes and now-written_at<self.read_your_writes:
+                    break
+                self.recent_writes.popitem(last=False)
+
+    def written_since(self, key, since):
+        # callers hold the lock
+        written_at=self.recent_writes.get(key)
+        return written_at is not None and written_at>since
+
+    def wrote_recently(self, key):
+        since=self.clock()-self.read_your_writes
+        with self.lock:
+            return self.written_since(key, since)
+
+    def reader_for(self, keys):
+        # a read of several keys sees the writes to any of them
+        if not self.replicas:
+            return self.primary
+
+        since=self.clock()-self.read_your_writes
+        with self.lock:
+            if any(self.written_since(key, since) for key in keys):
+                return self.primary
+
+        return self.reader()
+
+    def reader(self, key=None):
+        if not self.replicas:
+            return self.primary
+
+        if key is not None and self.wrote_recently(key):
+            return self.primary
+
+        if self.strategy=='least_connections':
+            return min(self.replicas, key=lambda replica: replica.pool.checkedout())
+
+        return self.replicas[next(self.turns)%len(self.replicas)]
\ No newline at end of file
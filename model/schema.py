@@ -0,0 +1,165 @@
+import sys
+
+from sqlalchemy import (
+    MetaData, Table, Column, Index, PrimaryKeyConstraint, ForeignKey,
+    Integer, BigInteger, String, TIMESTAMP, create_engine, inspect, func, select, text
+)
+
+metadata=MetaData()
+
+# 64-bit tweet ids for generated, time ordered ids; sqlite integers are
+# 64-bit already and only INTEGER PRIMARY KEY autoincrements there
+TweetId=BigInteger().with_variant(Integer, 'sqlite')
+
+users=Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', String(255), nullable=False),
+    Column('email', String(255), nullable=False),
+    Column('hashed_password', String(255), nullable=False),
+    Column('profile', String(2000), nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+    Column('updated_at', TIMESTAMP, nullable=True),
+    # bumped whenever the user's timeline changes, read as its ETag
+    Column('timeline_version', BigInteger, nullable=False, server_default='0'),
+    Index('users_email', 'email', unique=True)
+)
+
+users_follow_list=Table(
+    'users_follow_list', metadata,
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('follow_user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+    # (user_id, follow_user_id) serves "who does X follow",
+    # the reverse index serves "who follows X" for fan-out and invalidation
+    PrimaryKeyConstraint('user_id', 'follow_user_id'),
+    Index('users_follow_list_follow_user_id', 'follow_user_id', 'user_id')
+)
+
+# one row per follow or unfollow, which app processes poll to resync their
+# in-memory follow graphs; rows past a retention horizon are pruned
+follow_changes=Table(
+    'follow_changes', metadata,
+    Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True),
+    Column('user_id', Integer, nullable=False),
+    Column('follow_user_id', Integer, nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+    Index('follow_changes_created_at', 'created_at')
+)
+
+tweets=Table(
+    'tweets', metadata,
+    Column('id', TweetId, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('tweet', String(300), nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+    Index('tweets_user_id_created_at', 'user_id', 'created_at'),
+    Index('tweets_user_id_id', 'user_id', 'id'),
+    Index('tweets_created_at', 'created_at')
+)
+
+# tweets past the retention horizon, moved out of the hot table in chunks
+tweets_archive=Table(
+    'tweets_archive', metadata,
+    Column('id', TweetId, primary_key=True, autoincrement=False),
+    Column('user_id', Integer, nullable=False),
+    Column('tweet', String(300), nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False),
+    Index('tweets_archive_user_id_created_at', 'user_id', 'created_at'),
+    Index('tweets_archive_user_id_id', 'user_id', 'id')
+)
+
+# bumped by every archive chunk; app processes poll it to drop what they
+# cached about the tweets that moved
+archive_state=Table(
+    'archive_state', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('generation', BigInteger, nullable=False)
+)
+
+timelines=Table(
+    'timelines', metadata,
+    Column('user_id', Integer, nullable=False),
+    Column('tweet_id', TweetId, nullable=False),
+    Column('created_at', TIMESTAMP, nullable=False),
+    PrimaryKeyConstraint('user_id', 'tweet_id'),
+    Index('timelines_user_id_created_at', 'user_id', 'created_at', 'tweet_id'),
+    Index('timelines_tweet_id', 'tweet_id')
+)
+
+schema_version=Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('applied_at', TIMESTAMP, nullable=False, server_default=func.current_timestamp())
+)
+
+def create_tables(conn):
+    metadata.create_all(conn, checkfirst=True)
+
+def create_missing_indexes(conn):
+    # tables created before the schema was owned here have no hot path indexes
+    inspector=inspect(conn)
+    for table in metadata.sorted_tables:
+        existing={index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+def widen_tweet_ids(conn):
+    # tables from before version 3 hold tweet ids in 32-bit columns
+    if conn.dialect.name=='mysql':
+        conn.execute(text("ALTER TABLE tweets MODIFY id BIGINT NOT NULL AUTO_INCREMENT"))
+        conn.execute(text("ALTER TABLE timelines MODIFY tweet_id BIGINT NOT NULL"))
+    elif conn.dialect.name=='postgresql':
+        conn.execute(text("ALTER TABLE tweets ALTER COLUMN id TYPE BIGINT"))
+        conn.execute(text("ALTER TABLE timelines ALTER COLUMN tweet_id TYPE BIGINT"))
+
+    create_missing_indexes(conn)
+
+def create_archive(conn):
+    create_tables(conn)
+    create_missing_indexes(conn)
+
+def create_follow_changes(conn):
+    create_tables(conn)
+    create_missing_indexes(conn)
+
+def create_archive_state(conn):
+    create_tables(conn)
+    if not conn.execute(select([func.count()]).select_from(archive_state)).scalar():
+        conn.execute(archive_state.insert(), {'id':1, 'generation':0})
+
+def add_timeline_version(conn):
+    if 'timeline_version' not in {column['name'] for column in inspect(conn).get_columns('users')}:
+        conn.execute(text("ALTER TABLE users ADD COLUMN timeline_version BIGINT NOT NULL DEFAULT 0"))
+
+MIGRATIONS=[
+    (1, create_tables),
+    (2, create_missing_indexes),
+    (3, widen_tweet_ids),
+    (4, create_archive),
+    (5, create_archive_state),
+    (6, add_timeline_version),
+    (7, create_follow_changes)
+]
+
+def current_version(conn):
+    schema_version.create(conn, checkfirst=True)
+    return conn.execute(select([func.max(schema_version.c.version)])).scalar() or 0
+
+def migrate(engine):
+    with engine.begin() as conn:
+        version=current_version(conn)
+        for migration_version, migration in MIGRATIONS:
+            if migration_version>version:
+                migration(conn)
+                conn.execute(schema_version.insert(), {'version':migration_version})
+                version=migration_version
+
+    return version
+
+if __name__=='__main__':
+    if len(sys.argv)!=2:
+        sys.exit('usage: python -m model.schema DB_URL')
+
+    print(f'schema version {migrate(create_engine(sys.argv[1]))}')
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import time
+import threading
+
+# 41 bits of milliseconds since EPOCH, 10 bits of worker id and 12 bits of
+# sequence; ids from one worker grow strictly and sort by time across workers
+EPOCH=1577836800000
+WORKER_BITS=10
+SEQUENCE_BITS=12
+MAX_WORKER=(1<<WORKER_BITS)-1
+MAX_SEQUENCE=(1<<SEQUENCE_BITS)-1
+
+def snowflake_time(snowflake_id):
+    # milliseconds since the unix epoch the id was generated at
+    return (snowflake_id>>(WORKER_BITS+SEQUENCE_BITS))+EPOCH
+
+def snowflake_span(seconds):
+    # how far apart ids generated that many seconds apart are
+    return int(seconds*1000)<<(WORKER_BITS+SEQUENCE_BITS)
+
+def snowflake_worker_id(config, environ=os.environ):
+    # a config file shared by all workers would give them all the same id, so
+    # the process manager sets TWEET_ID_WORKER in each worker's environment;
+    # the config value is for single process deployments
+    worker_id=environ.get('TWEET_ID_WORKER', config.get('TWEET_ID_WORKER'))
+    if worker_id is None:
+        raise ValueError("TWEET_IDS 'snowflake' needs a TWEET_ID_WORKER unique to each process")
+
+    return int(worker_id)
+
+class Snowflake:
+    def __init__(self, worker_id, clock=time.time):
+        if not 0<=worker_id<=MAX_WORKER:
+            raise ValueError(f'worker id must be between 0 and {MAX_WORKER}')
+
+        self.worker_id=worker_id
+        self.clock=clock
+        self.last_ms=0
+        self.sequence=0
+        self.pid=os.getpid()
+        self.lock=threading.Lock()
+
+    def next_id(self):
+        return self.next_ids(1)[0]
+
+    def next_ids(self, count):
+        if os.getpid()!=self.pid:
+            # forked workers would share the worker id and repeat ids
+            raise RuntimeError('Snowflake created before a fork; create the app in each worker')
+
+        with self.lock:
+            ids=[]
+            for _ in range(count):
+                now_ms=int(self.clock()*1000)-EPOCH
+                if now_ms>self.last_ms:
+                    self.last_ms=now_ms
+                    self.sequence=0
+                elif self.sequence<MAX_SEQUENCE:
+                    self.sequence+=1
+                else:
+                    # the sequence of this millisecond is used up, or the
+                    # clock went back: borrow the next millisecond instead
+                    # of waiting so ids never repeat or go backwards
+                    self.last_ms+=1
+                    self.sequence=0
+
+                ids.append((self.last_ms<<(WORKER_BITS+SEQUENCE_BITS))|(self.worker_id<<SEQUENCE_BITS)|self.sequence)
+
+            return ids
\ No newline at end of file
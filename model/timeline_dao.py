@@ -0,0 +1,233 @@
+import sys
+
+from sqlalchemy import text, create_engine
+from .replica import ReplicaRouter
+from .metrics import label_queries
+from .user_dao import UserDao
+
+@label_queries
+class TimelineDao:
+    def __init__(self, database, router=None, order_by_id=False):
+        self.db=database
+        self.router=router or ReplicaRouter(database)
+        self.order_by_id=order_by_id
+
+    def fan_out_tweet(self,tweet_id):
+        return self.db.execute(text("""
+            INSERT INTO timelines (
+                user_id,
+                tweet_id,
+                created_at
+            )
+            SELECT t.user_id, t.id, t.created_at
+            FROM tweets t
+            WHERE t.id=:tweet_id
+            UNION ALL
+            SELECT ufl.user_id, t.id, t.created_at
+            FROM tweets t
+            JOIN users_follow_list ufl ON ufl.follow_user_id=t.user_id
+            WHERE t.id=:tweet_id
+            AND ufl.user_id<>t.user_id
+        """), {
+            'tweet_id':tweet_id
+        }).rowcount
+
+    def fan_out_pending(self,user_id,after_id=0,conn=None):
+        # fans out the author's tweets after after_id that are not in the
+        # author's own timeline yet, for tweets written in bulk without
+        # their ids; conn runs it inside the insert's transaction
+        return (conn or self.db).execute(text("""
+            INSERT INTO timelines (
+                user_id,
+                tweet_id,
+                created_at
+            )
+            SELECT t.user_id, t.id, t.created_at
+            FROM tweets t
+            WHERE t.user_id=:user_id
+            AND t.id>:after_id
+            AND NOT EXISTS (
+                SELECT 1 FROM timelines tl
+                WHERE tl.user_id=t.user_id AND tl.tweet_id=t.id
+            )
+            UNION ALL
+            SELECT ufl.user_id, t.id, t.created_at
+            FROM tweets t
+            JOIN users_follow_list ufl ON ufl.follow_user_id=t.user_id
+            WHERE t.user_id=:user_id
+            AND t.id>:after_id
+            AND ufl.user_id<>t.user_id
+            AND NOT EXISTS (
+                SELECT 1 FROM timelines tl
+                WHERE tl.user_id=t.user_id AND tl.tweet_id=t.id
+            )
+        """), {
+            'user_id':user_id,
+            'after_id':after_id
+        }).rowcount
+
+    def backfill_timeline(self,user_id,follow_id,limit=None):
+        # with a limit only the author's newest tweets, so following a
+        # prolific account is not one insert of its whole history
+        order="t.id DESC" if self.order_by_id else "t.created_at DESC, t.id DESC"
+        limit_clause=f"ORDER BY {order} LIMIT :limit" if limit is not None else ""
+
+        return self.db.execute(text(f"""
+            INSERT INTO timelines (
+                user_id,
+                tweet_id,
+                created_at
+            )
+            SELECT :user_id, t.id, t.created_at
+            FROM tweets t
+            WHERE t.user_id=:follow_id
+            AND NOT EXISTS (
+                SELECT 1 FROM timelines tl
+                WHERE tl.user_id=:user_id AND tl.tweet_id=t.id
+            )
+            {limit_clause}
+        """), {
+            'user_id':user_id,
+            'follow_id':follow_id,
+            'limit':limit
+        }).rowcount
+
+    def prune_timeline(self,user_id,unfollow_id):
+        if user_id==unfollow_id:
+            return 0
+
+        return self.db.execute(text("""
+            DELETE FROM timelines
+            WHERE user_id=:user_id
+            AND tweet_id IN (
+                SELECT id FROM tweets WHERE user_id=:unfollow_id
+            )
+        """), {
+            'user_id':user_id,
+            'unfollow_id':unfollow_id
+        }).rowcount
+
+    def get_timeline(self,user_id):
+        # by id the primary key (user_id, tweet_id) already holds the order
+        order="tl.tweet_id DESC" if self.order_by_id else "tl.created_at DESC, tl.tweet_id DESC"
+
+        timeline=self.router.reader(user_id).execute(text(f"""
+            SELECT
+                t.user_id,
+                t.tweet
+            FROM timelines tl
+            JOIN tweets t ON t.id=tl.tweet_id
+            WHERE tl.user_id=:user_id
+            ORDER BY {order}
+        """), {
+            'user_id':user_id
+        }).fetchall()
+
+        return [{
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet']
+        } for tweet in timeline]
+
+    def get_timeline_since(self,user_id,since_id,limit,overlap=0):
+        # like TweetDao.get_timeline_since, fanned out rows commit late too
+        windows=[("AND tl.tweet_id>:since_id", "LIMIT :limit")]
+        if overlap:
+            windows.insert(0, ("AND tl.tweet_id>:since_id-:overlap AND tl.tweet_id<=:since_id", ""))
+
+        timeline=[]
+        for window, limit_clause in windows:
+            timeline+=self.router.reader(user_id).execute(text(f"""
+                SELECT
+                    t.id,
+                    t.user_id,
+                    t.tweet
+                FROM timelines tl
+                JOIN tweets t ON t.id=tl.tweet_id
+                WHERE tl.user_id=:user_id
+                {window}
+                ORDER BY tl.tweet_id
+                {limit_clause}
+            """), {
+                'user_id':user_id,
+                'since_id':since_id,
+                'overlap':overlap,
+                'limit':limit
+            }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet']
+        } for tweet in timeline]
+
+    def get_timeline_page(self,user_id,limit,created_at=None,tweet_id=None):
+        if self.order_by_id:
+            order="tl.tweet_id DESC"
+            keyset="AND tl.tweet_id<:tweet_id" if tweet_id is not None else ""
+        else:
+            order="tl.created_at DESC, tl.tweet_id DESC"
+            keyset="""
+                AND tl.created_at<=:created_at
+                AND (tl.created_at<:created_at OR tl.tweet_id<:tweet_id)
+            """ if created_at is not None else ""
+
+        timeline=self.router.reader(user_id).execute(text(f"""
+            SELECT
+                t.id,
+                t.user_id,
+                t.tweet,
+                t.created_at
+            FROM timelines tl
+            JOIN tweets t ON t.id=tl.tweet_id
+            WHERE tl.user_id=:user_id
+            {keyset}
+            ORDER BY {order}
+            LIMIT :limit
+        """), {
+            'user_id':user_id,
+            'created_at':created_at,
+            'tweet_id':tweet_id,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
+        } for tweet in timeline]
+
+def backfill_timelines(database, chunk_size=1000):
+    # fills timelines for a database that was running without fan-out;
+    # each backfill skips rows that already exist, so it can be rerun
+    timeline_dao=TimelineDao(database)
+    user_id=0
+    rows=0
+    while True:
+        user_ids=[row['id'] for row in database.execute(text("""
+            SELECT id
+            FROM users
+            WHERE id>:user_id
+            ORDER BY id
+            LIMIT :limit
+        """), {
+            'user_id':user_id,
+            'limit':chunk_size
+        }).fetchall()]
+
+        for user_id in user_ids:
+            rows+=timeline_dao.backfill_timeline(user_id, user_id)
+
+        if len(user_ids)<chunk_size:
+            break
+
+    for user_id, follow_id in UserDao(database).iter_follow_edges(chunk_size):
+        rows+=timeline_dao.backfill_timeline(user_id, follow_id)
+
+    return rows
+
+if __name__=='__main__':
+    if len(sys.argv)!=3 or sys.argv[1]!='backfill':
+        sys.exit('usage: python -m model.timeline_dao backfill DB_URL')
+
+    print(f'backfilled {backfill_timelines(create_engine(sys.argv[2]))} timeline rows')
\ No newline at end of file
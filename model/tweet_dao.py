@@ -1,10 +1,38 @@
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
+from .replica import ReplicaRouter
+from .metrics import label_queries
 
+@label_queries
 class TweetDao:
-    def __init__(self, database):
+    def __init__(self, database, router=None, id_generator=None):
         self.db=database
+        self.router=router or ReplicaRouter(database)
+        # with generated ids, id order is time order and timelines sort and
+        # page by id alone
+        self.id_generator=id_generator
+        self.order_by_id=id_generator is not None
     
     def insert_tweet(self,user_id,tweet):
+        self.router.mark_write(user_id)
+        if self.id_generator:
+            tweet_id=self.id_generator.next_id()
+            self.db.execute(text("""
+                INSERT INTO tweets (
+                    id,
+                    user_id,
+                    tweet
+                ) VALUES (
+                    :tweet_id,
+                    :id,
+                    :tweet
+                )
+            """), {
+                'tweet_id':tweet_id,
+                'id':user_id,
+                'tweet':tweet
+            })
+            return tweet_id
+
         return self.db.execute(text("""
             INSERT INTO tweets (
                 user_id,
@@ -16,19 +44,211 @@ class TweetDao:
         """), { 
             'id':user_id,
             'tweet':tweet
-        }).rowcount
+        }).lastrowid
+
+    def insert_tweets(self,tweets,timeline_dao=None):
+        user_ids={tweet['user_id'] for tweet in tweets}
+        self.router.mark_write(*user_ids)
+        if self.id_generator:
+            columns, values="id, user_id, tweet", ":id, :user_id, :tweet"
+            rows=[{
+                'id':tweet_id,
+                'user_id':tweet['user_id'],
+                'tweet':tweet['tweet']
+            } for tweet_id, tweet in zip(self.id_generator.next_ids(len(tweets)), tweets)]
+        else:
+            columns, values="user_id, tweet", ":user_id, :tweet"
+            rows=[{
+                'user_id':tweet['user_id'],
+                'tweet':tweet['tweet']
+            } for tweet in tweets]
+
+        with self.db.begin() as conn:
+            # the newest id per author before the insert bounds the fan-out
+            # to this batch, in the same transaction as the tweets
+            latest_ids={}
+            if timeline_dao:
+                latest_ids={row['user_id']:row['id'] for row in conn.execute(text("""
+                    SELECT user_id, MAX(id) AS id
+                    FROM tweets
+                    WHERE user_id IN :user_ids
+                    GROUP BY user_id
+                """).bindparams(bindparam('user_ids', expanding=True)), {
+                    'user_ids':list(user_ids)
+                }).fetchall()}
+
+            rowcount=conn.execute(text(f"""
+                INSERT INTO tweets (
+                    {columns}
+                ) VALUES (
+                    {values}
+                )
+            """), rows).rowcount
+
+            if timeline_dao:
+                for user_id in user_ids:
+                    timeline_dao.fan_out_pending(user_id, latest_ids.get(user_id) or 0, conn)
+
+            return rowcount
+
+    def get_tweet(self,tweet_id):
+        tweet=self.db.execute(text("""
+            SELECT
+                id,
+                user_id,
+                tweet,
+                created_at
+            FROM tweets
+            WHERE id=:tweet_id
+        """), {
+            'tweet_id':tweet_id
+        }).fetchone()
+
+        return {
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
+        } if tweet else None
+
+    def get_tweets(self,tweet_ids,primary=False):
+        tweets=(self.db if primary else self.router.reader()).execute(text("""
+            SELECT
+                id,
+                user_id,
+                tweet,
+                created_at
+            FROM tweets
+            WHERE id IN :tweet_ids
+        """).bindparams(bindparam('tweet_ids', expanding=True)), {
+            'tweet_ids':list(tweet_ids)
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
+        } for tweet in tweets]
+
+    def get_tweets_after(self,tweet_id,limit):
+        tweets=self.db.execute(text("""
+            SELECT
+                id,
+                user_id,
+                tweet
+            FROM tweets
+            WHERE id>:tweet_id
+            ORDER BY id
+            LIMIT :limit
+        """), {
+            'tweet_id':tweet_id,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet']
+        } for tweet in tweets]
+
+    def get_tweet_ids_after(self,tweet_id,max_id):
+        rows=self.db.execute(text("""
+            SELECT id
+            FROM tweets
+            WHERE id>:tweet_id
+            AND id<=:max_id
+        """), {
+            'tweet_id':tweet_id,
+            'max_id':max_id
+        }).fetchall()
+
+        return [row['id'] for row in rows]
+
+    def get_recent_tweets(self,user_ids,limit):
+        order="id DESC" if self.order_by_id else "created_at DESC, id DESC"
+        recent_order="t.id DESC" if self.order_by_id else "t.created_at DESC, t.id DESC"
+
+        # an author who just tweeted, the reader of their own timeline
+        # among them, gets their buffer from the primary
+        user_ids=list(user_ids)
+        tweets=self.router.reader_for(user_ids).execute(text(f"""
+            SELECT
+                id,
+                user_id,
+                tweet,
+                created_at
+            FROM (
+                SELECT
+                    t.id,
+                    t.user_id,
+                    t.tweet,
+                    t.created_at,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY t.user_id
+                        ORDER BY {recent_order}
+                    ) AS recent_rank
+                FROM tweets t
+                WHERE t.user_id IN :user_ids
+            ) recent
+            WHERE recent_rank<=:limit
+            ORDER BY user_id, {order}
+        """).bindparams(bindparam('user_ids', expanding=True)), {
+            'user_ids':user_ids,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
+        } for tweet in tweets]
+
+    def get_follower_ids(self,user_id):
+        rows=self.db.execute(text("""
+            SELECT user_id
+            FROM users_follow_list
+            WHERE follow_user_id=:user_id
+        """), {
+            'user_id':user_id
+        }).fetchall()
+
+        return [row['user_id'] for row in rows]
+
+    def get_follows_among(self,user_ids,follow_ids):
+        # which of user_ids follow which of follow_ids, for pushing tweets to
+        # the users streaming in this process
+        rows=self.db.execute(text("""
+            SELECT
+                user_id,
+                follow_user_id
+            FROM users_follow_list
+            WHERE user_id IN :user_ids
+            AND follow_user_id IN :follow_ids
+        """).bindparams(bindparam('user_ids', expanding=True), bindparam('follow_ids', expanding=True)), {
+            'user_ids':list(user_ids),
+            'follow_ids':list(follow_ids)
+        }).fetchall()
+
+        return [(row['user_id'], row['follow_user_id']) for row in rows]
 
     def get_timeline(self,user_id):
-        timeline=self.db.execute(text("""
-            SELECT DISTINCT
+        order="t.id DESC" if self.order_by_id else "t.created_at DESC, t.id DESC"
+
+        timeline=self.router.reader(user_id).execute(text(f"""
+            SELECT
                 t.user_id,
-                t.tweet,
-                t.created_at
+                t.tweet
             FROM tweets t
-            LEFT JOIN users_follow_list ufl ON ufl.user_id = :user_id
-            WHERE t.user_id=:user_id
-            OR t.user_id=ufl.follow_user_id
-            ORDER BY -t.created_at
+            WHERE t.user_id IN (
+                SELECT follow_user_id
+                FROM users_follow_list
+                WHERE user_id=:user_id
+                UNION ALL
+                SELECT :user_id
+            )
+            ORDER BY {order}
         """), {
             'user_id':user_id
         }).fetchall()
@@ -36,4 +256,92 @@ class TweetDao:
         return [{
             'user_id':tweet['user_id'],
             'tweet':tweet['tweet']
+        } for tweet in timeline]
+
+    def get_timeline_since(self,user_id,since_id,limit,overlap=0):
+        # oldest first, so a client catching up in steps never skips a tweet
+        # past since_id. Ids are assigned before commit, so a tweet below
+        # since_id can commit after the client read since_id; the overlap ids
+        # below it are read again and the client drops the tweets it has
+        windows=[("AND t.id>:since_id", "LIMIT :limit")]
+        if overlap:
+            windows.insert(0, ("AND t.id>:since_id-:overlap AND t.id<=:since_id", ""))
+
+        timeline=[]
+        for window, limit_clause in windows:
+            timeline+=self.router.reader(user_id).execute(text(f"""
+                SELECT
+                    t.id,
+                    t.user_id,
+                    t.tweet
+                FROM tweets t
+                WHERE t.user_id IN (
+                    SELECT follow_user_id
+                    FROM users_follow_list
+                    WHERE user_id=:user_id
+                    UNION ALL
+                    SELECT :user_id
+                )
+                {window}
+                ORDER BY t.id
+                {limit_clause}
+            """), {
+                'user_id':user_id,
+                'since_id':since_id,
+                'overlap':overlap,
+                'limit':limit
+            }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet']
+        } for tweet in timeline]
+
+    def get_last_tweet_id(self):
+        return self.db.execute(text("""
+            SELECT MAX(id)
+            FROM tweets
+        """)).scalar() or 0
+
+    def get_timeline_page(self,user_id,limit,created_at=None,tweet_id=None):
+        if self.order_by_id:
+            order="t.id DESC"
+            keyset="AND t.id<:tweet_id" if tweet_id is not None else ""
+        else:
+            order="t.created_at DESC, t.id DESC"
+            keyset="""
+                AND t.created_at<=:created_at
+                AND (t.created_at<:created_at OR t.id<:tweet_id)
+            """ if created_at is not None else ""
+
+        timeline=self.router.reader(user_id).execute(text(f"""
+            SELECT
+                t.id,
+                t.user_id,
+                t.tweet,
+                t.created_at
+            FROM tweets t
+            WHERE t.user_id IN (
+                SELECT follow_user_id
+                FROM users_follow_list
+                WHERE user_id=:user_id
+                UNION ALL
+                SELECT :user_id
+            )
+            {keyset}
+            ORDER BY {order}
+            LIMIT :limit
+        """), {
+            'user_id':user_id,
+            'created_at':created_at,
+            'tweet_id':tweet_id,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet'],
+            'created_at':tweet['created_at']
         } for tweet in timeline]
\ No newline at end of file
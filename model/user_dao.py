@@ -1,11 +1,22 @@
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import IntegrityError
+from . import identity_map
+from .archive_dao import days_ago
+from .replica import ReplicaRouter
+from .metrics import label_queries
 
+@label_queries
 class UserDao:
-    def __init__(self, database):
+    def __init__(self, database, router=None):
         self.db=database
+        self.router=router or ReplicaRouter(database)
     
     def get_user(self,user_id):
-        user=self.db.execute(text("""
+        user=identity_map.lookup(('user',user_id))
+        if user is not identity_map.MISSING:
+            return user
+
+        user=self.router.reader(user_id).execute(text("""
             SELECT
                 id,
                 name,
@@ -17,15 +28,80 @@ class UserDao:
             'user_id':user_id
         }).fetchone()
 
-        return {
+        return identity_map.remember(('user',user_id), {
             'id':user['id'],
             'name':user['name'],
             'email':user['email'],
             'profile':user['profile']
-        } if user else None
+        } if user else None)
 
-    def insert_user(self,user):
+    def get_users(self,user_ids):
+        user_ids=list(user_ids)
+        users=self.router.reader_for(user_ids).execute(text("""
+            SELECT
+                id,
+                name,
+                email,
+                profile
+            FROM users
+            WHERE id IN :user_ids
+        """).bindparams(bindparam('user_ids', expanding=True)),{
+            'user_ids':user_ids
+        }).fetchall()
+
+        return [{
+            'id':user['id'],
+            'name':user['name'],
+            'email':user['email'],
+            'profile':user['profile']
+        } for user in users]
+
+    def update_profile(self,user_id,name=None,profile=None):
+        identity_map.forget(('user',user_id))
+        self.router.mark_write(user_id)
         return self.db.execute(text("""
+            UPDATE users
+            SET
+                name=COALESCE(:name, name),
+                profile=COALESCE(:profile, profile),
+                updated_at=CURRENT_TIMESTAMP
+            WHERE id=:user_id
+        """),{
+            'user_id':user_id,
+            'name':name,
+            'profile':profile
+        }).rowcount
+
+    def bump_timeline_versions(self,user_ids,followers=False):
+        # with followers, also the timelines of everyone following user_ids
+        followers_clause="""
+            OR id IN (
+                SELECT user_id
+                FROM users_follow_list
+                WHERE follow_user_id IN :user_ids
+            )
+        """ if followers else ""
+
+        return self.db.execute(text(f"""
+            UPDATE users
+            SET timeline_version=timeline_version+1
+            WHERE id IN :user_ids
+            {followers_clause}
+        """).bindparams(bindparam('user_ids', expanding=True)),{
+            'user_ids':list(user_ids)
+        }).rowcount
+
+    def get_timeline_version(self,user_id):
+        return self.router.reader(user_id).execute(text("""
+            SELECT timeline_version
+            FROM users
+            WHERE id=:user_id
+        """),{
+            'user_id':user_id
+        }).scalar() or 0
+
+    def insert_user(self,user):
+        user_id=self.db.execute(text("""
             INSERT INTO users (
                 name,
                 email,
@@ -39,8 +115,23 @@ class UserDao:
             )
         """), user).lastrowid
 
+        identity_map.remember(('user',user_id), {
+            'id':user_id,
+            'name':user['name'],
+            'email':user['email'],
+            'profile':user['profile']
+        })
+        identity_map.forget(('credential',user['email']))
+        self.router.mark_write(user_id, user['email'])
+
+        return user_id
+
     def get_user_id_and_password(self,email):
-        row=self.db.execute(text("""
+        credential=identity_map.lookup(('credential',email))
+        if credential is not identity_map.MISSING:
+            return credential
+
+        row=self.router.reader(email).execute(text("""
             SELECT
                 id,
                 hashed_password
@@ -48,13 +139,29 @@ class UserDao:
             WHERE email=:email
         """),{'email':email}).fetchone()
 
-        return {
+        return identity_map.remember(('credential',email), {
             'id':row['id'],
             'hashed_password':row['hashed_password']
-        } if row else None
+        } if row else None)
+
+    def log_follow_changes(self,user_id,follow_ids,conn=None):
+        # after the edge is written, so a process reading the change sees it
+        (conn or self.db).execute(text("""
+            INSERT INTO follow_changes (
+                user_id,
+                follow_user_id
+            ) VALUES (
+                :id,
+                :follow
+            )
+        """), [{
+            'id':user_id,
+            'follow':follow_id
+        } for follow_id in follow_ids])
 
     def insert_follow(self,user_id,follow_id):
-        return self.db.execute(text("""
+        self.router.mark_write(user_id)
+        rowcount=self.db.execute(text("""
             INSERT INTO users_follow_list(
                 user_id,
                 follow_user_id
@@ -66,12 +173,148 @@ class UserDao:
             'id':user_id,
             'follow':follow_id
         }).rowcount
+        self.log_follow_changes(user_id, [follow_id])
+
+        return rowcount
 
     def insert_unfollow(self,user_id,unfollow_id):
-        return self.db.execute(text("""
+        self.router.mark_write(user_id)
+        rowcount=self.db.execute(text("""
             DELETE FROM users_follow_list
             WHERE user_id=:id AND follow_user_id=:unfollow
         """),{
             'id':user_id,
             'unfollow':unfollow_id
+        }).rowcount
+        self.log_follow_changes(user_id, [unfollow_id])
+
+        return rowcount
+
+    def get_follow_ids(self,user_id):
+        rows=self.db.execute(text("""
+            SELECT follow_user_id
+            FROM users_follow_list
+            WHERE user_id=:user_id
+        """),{
+            'user_id':user_id
+        }).fetchall()
+
+        return [row['follow_user_id'] for row in rows]
+
+    def get_follower_ids(self,user_id):
+        rows=self.db.execute(text("""
+            SELECT user_id
+            FROM users_follow_list
+            WHERE follow_user_id=:user_id
+        """),{
+            'user_id':user_id
+        }).fetchall()
+
+        return [row['user_id'] for row in rows]
+
+    def iter_follow_edges(self,chunk_size=10000):
+        user_id, follow_user_id=0, 0
+        while True:
+            rows=self.db.execute(text("""
+                SELECT
+                    user_id,
+                    follow_user_id
+                FROM users_follow_list
+                WHERE user_id>=:user_id AND (user_id>:user_id OR follow_user_id>:follow_user_id)
+                ORDER BY user_id, follow_user_id
+                LIMIT :limit
+            """),{
+                'user_id':user_id,
+                'follow_user_id':follow_user_id,
+                'limit':chunk_size
+            }).fetchall()
+
+            for row in rows:
+                yield row['user_id'], row['follow_user_id']
+
+            if len(rows)<chunk_size:
+                return
+            user_id, follow_user_id=rows[-1]['user_id'], rows[-1]['follow_user_id']
+
+    def insert_follows(self,user_id,follow_ids):
+        # returns the ids followed now; when another process followed one of
+        # them first, the batch is retried row by row and that one skipped
+        self.router.mark_write(user_id)
+        try:
+            with self.db.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO users_follow_list(
+                        user_id,
+                        follow_user_id
+                    ) VALUES (
+                        :id,
+                        :follow
+                    )
+                """), [{
+                    'id':user_id,
+                    'follow':follow_id
+                } for follow_id in follow_ids])
+                self.log_follow_changes(user_id, follow_ids, conn)
+            return list(follow_ids)
+        except IntegrityError:
+            if len(follow_ids)==1:
+                return []
+
+        followed_ids=[]
+        for follow_id in follow_ids:
+            followed_ids+=self.insert_follows(user_id, [follow_id])
+        return followed_ids
+
+    def insert_unfollows(self,user_id,unfollow_ids):
+        self.router.mark_write(user_id)
+        with self.db.begin() as conn:
+            rowcount=conn.execute(text("""
+                DELETE FROM users_follow_list
+                WHERE user_id=:id AND follow_user_id=:unfollow
+            """), [{
+                'id':user_id,
+                'unfollow':unfollow_id
+            } for unfollow_id in unfollow_ids]).rowcount
+            self.log_follow_changes(user_id, unfollow_ids, conn)
+            return rowcount
+
+    def get_last_follow_change_id(self):
+        return self.db.execute(text("""
+            SELECT MAX(id)
+            FROM follow_changes
+        """)).scalar() or 0
+
+    def get_follow_changes(self,after_id,limit):
+        # each changed edge as it stands now, so applying a change twice or
+        # out of order leaves the graph right
+        rows=self.db.execute(text("""
+            SELECT
+                fc.id,
+                fc.user_id,
+                fc.follow_user_id,
+                ufl.user_id IS NOT NULL AS following
+            FROM follow_changes fc
+            LEFT JOIN users_follow_list ufl
+            ON ufl.user_id=fc.user_id AND ufl.follow_user_id=fc.follow_user_id
+            WHERE fc.id>:after_id
+            ORDER BY fc.id
+            LIMIT :limit
+        """),{
+            'after_id':after_id,
+            'limit':limit
+        }).fetchall()
+
+        return [{
+            'id':row['id'],
+            'user_id':row['user_id'],
+            'follow_user_id':row['follow_user_id'],
+            'following':bool(row['following'])
+        } for row in rows]
+
+    def prune_follow_changes(self,retention_days):
+        return self.db.execute(text(f"""
+            DELETE FROM follow_changes
+            WHERE created_at<{days_ago(self.db.dialect.name)}
+        """),{
+            'days':retention_days
         }).rowcount
\ No newline at end of file
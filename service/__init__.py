@@ -1,7 +1,37 @@
 from .user_service import UserService
 from .tweet_service import TweetService
+from .cache import LRUCache, TimelineCache
+from .password_hasher import PasswordHasher, PasswordHasherBusy
+from .write_behind import TweetWriteBehind, TweetWriteBehindFull
+from .timeline_merge import TimelineMerger
+from .follow_graph import FollowGraph
+from .timeline_versions import TimelineVersions, AsyncTimelineVersions
+from .async_service import AsyncUserService, AsyncTweetService
+from .search_index import SearchIndex
+from .archiver import TweetArchiver, ArchiveWatermark, AsyncArchiveWatermark
+from .timeline_stream import TimelineHub, AsyncSubscription, StreamCursor, TimelinePoller
 
 __all__=[
     'UserService',
-    'TweetService'
+    'TweetService',
+    'LRUCache',
+    'TimelineCache',
+    'PasswordHasher',
+    'PasswordHasherBusy',
+    'TweetWriteBehind',
+    'TweetWriteBehindFull',
+    'TimelineMerger',
+    'FollowGraph',
+    'TimelineVersions',
+    'AsyncTimelineVersions',
+    'AsyncUserService',
+    'AsyncTweetService',
+    'SearchIndex',
+    'TweetArchiver',
+    'ArchiveWatermark',
+    'AsyncArchiveWatermark',
+    'TimelineHub',
+    'AsyncSubscription',
+    'StreamCursor',
+    'TimelinePoller'
 ]
\ No newline at end of file
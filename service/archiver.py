@@ -0,0 +1,110 @@
+import sys
+import time
+import logging
+import argparse
+import threading
+
+logger=logging.getLogger(__name__)
+
+class TweetArchiver:
+    def __init__(self, archive_dao, horizon_days, chunk_size=1000, pause=0.1):
+        self.archive_dao=archive_dao
+        self.horizon_days=horizon_days
+        self.chunk_size=chunk_size
+        self.pause=pause
+
+        self.runs=0
+        self.chunks=0
+        self.archived_tweets=0
+
+    def run(self):
+        # small transactions with a pause in between keep row locks short and
+        # leave the primary and its replicas room for live traffic
+        archived=0
+        while True:
+            moved=self.archive_dao.archive_tweets(self.horizon_days, self.chunk_size)
+            if moved:
+                self.chunks+=1
+                archived+=moved
+            if moved<self.chunk_size:
+                break
+            time.sleep(self.pause)
+
+        self.runs+=1
+        self.archived_tweets+=archived
+        return archived
+
+    def run_forever(self, interval):
+        while True:
+            try:
+                archived=self.run()
+                logger.info('archived %d tweets', archived)
+            except Exception:
+                logger.exception('tweet archival failed')
+            time.sleep(interval)
+
+    def stats(self):
+        return {
+            'horizon_days':self.horizon_days,
+            'runs':self.runs,
+            'chunks':self.chunks,
+            'archived_tweets':self.archived_tweets
+        }
+
+class ArchiveWatermark:
+    # the archive generation as the archiver process last bumped it, read
+    # from the database at most every interval seconds
+    def __init__(self, archive_dao, interval=1, clock=time.monotonic):
+        self.archive_dao=archive_dao
+        self.interval=interval
+        self.clock=clock
+        self.generation=None
+        self.checked_at=None
+        self.lock=threading.Lock()
+
+    def current(self):
+        now=self.clock()
+        with self.lock:
+            if self.checked_at is not None and now-self.checked_at<self.interval:
+                return self.generation
+
+        generation=self.archive_dao.get_generation()
+        with self.lock:
+            self.generation=generation
+            self.checked_at=now
+
+        return generation
+
+class AsyncArchiveWatermark(ArchiveWatermark):
+    # for the async app, reading the generation through an AsyncArchiveDao;
+    # the event loop runs one check at a time, so it needs no lock
+    async def current(self):
+        now=self.clock()
+        if self.checked_at is not None and now-self.checked_at<self.interval:
+            return self.generation
+
+        self.generation=await self.archive_dao.get_generation()
+        self.checked_at=now
+        return self.generation
+
+def main(argv=None):
+    from sqlalchemy import create_engine
+    from model import ArchiveDao
+
+    parser=argparse.ArgumentParser(description='move tweets older than the horizon into tweets_archive')
+    parser.add_argument('db_url')
+    parser.add_argument('--days', type=int, default=365, help='tweets older than this many days are archived')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='tweets moved per transaction')
+    parser.add_argument('--pause', type=float, default=0.1, help='seconds to sleep between chunks')
+    parser.add_argument('--interval', type=float, help='keep running, archiving every this many seconds')
+    args=parser.parse_args(argv)
+
+    archiver=TweetArchiver(ArchiveDao(create_engine(args.db_url)), args.days, args.chunk_size, args.pause)
+    if args.interval:
+        logging.basicConfig(level=logging.INFO)
+        archiver.run_forever(args.interval)
+
+    print(f'archived {archiver.run()} tweets')
+
+if __name__=='__main__':
+    sys.exit(main())
\ No newline at end of file
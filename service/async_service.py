@@ -0,0 +1,143 @@
+import asyncio
+
+from .user_service import UserService
+from .cache import MISSING
+from .tweet_service import TweetService, decode_cursor, timeline_page
+
+class AsyncUserService(UserService):
+    # every UserService method that reaches the database is overridden, so
+    # none of them hands a coroutine back unawaited
+    async def create_new_user(self, new_user):
+        # bcrypt holds the CPU, so it runs off the event loop
+        new_user['password']=await asyncio.to_thread(self.password_hasher.hashpw, new_user['password'])
+        return await self.user_dao.insert_user(new_user)
+
+    async def sign_up(self, new_user):
+        new_user_id=await self.create_new_user(new_user)
+
+        return self.signed_up(new_user_id, new_user)
+
+    async def get_user(self, new_user_id):
+        if self.profile_cache:
+            return (await self.get_users([new_user_id])).get(new_user_id)
+
+        return await self.user_dao.get_user(new_user_id)
+
+    async def get_users(self, user_ids, cached=True):
+        users={}
+        missing=[]
+        for user_id in set(user_ids):
+            user=self.profile_cache.get(user_id) if self.profile_cache and cached else None
+            if user is None:
+                missing.append(user_id)
+            else:
+                users[user_id]=user
+
+        for user in await self.user_dao.get_users(missing) if missing else []:
+            users[user['id']]=user
+            if self.profile_cache:
+                self.profile_cache.set(user['id'], user)
+
+        return users
+
+    async def update_profile(self, user_id, name=None, profile=None):
+        result=await self.user_dao.update_profile(user_id, name, profile)
+        if self.profile_cache:
+            self.profile_cache.delete(user_id)
+        await self.bump_timelines([user_id], followers=True)
+
+        return result
+
+    async def get_user_id_and_password(self, email):
+        return await self.user_dao.get_user_id_and_password(email)
+
+    async def login(self, credential):
+        user_credential=await self.user_dao.get_user_id_and_password(credential['email'])
+
+        authorized=user_credential and await asyncio.to_thread(self.password_hasher.checkpw, credential['password'], user_credential['hashed_password'])
+
+        return {'id':user_credential['id']} if authorized else None
+
+    async def get_follow_ids(self, user_id):
+        if self.follow_graph:
+            return self.follow_graph.following(user_id)
+
+        return await self.user_dao.get_follow_ids(user_id)
+
+    async def bump_timelines(self, user_ids, followers=False):
+        if self.timeline_versions:
+            await self.timeline_versions.bump(user_ids, followers)
+
+    async def follow(self, user_id, follow_id):
+        result=await self.user_dao.insert_follow(user_id, follow_id)
+        self.followed(user_id, [follow_id])
+        await self.bump_timelines([user_id])
+
+        return result
+
+    async def unfollow(self, user_id, unfollow_id):
+        result=await self.user_dao.insert_unfollow(user_id, unfollow_id)
+        self.unfollowed(user_id, [unfollow_id])
+        await self.bump_timelines([user_id])
+
+        return result
+
+    def follows(self, user_id, follow_ids):
+        raise NotImplementedError('batch follows are served by the WSGI app')
+
+    def unfollows(self, user_id, unfollow_ids):
+        raise NotImplementedError('batch unfollows are served by the WSGI app')
+
+class AsyncTweetService(TweetService):
+    async def tweet(self, user_id, tweet):
+        if len(tweet)>300:
+            return None
+
+        tweet_id=await self.tweet_dao.insert_tweet(user_id, tweet)
+
+        if self.timeline_versions:
+            await self.timeline_versions.bump([user_id], followers=True)
+
+        streaming=self.timeline_hub and self.timeline_hub.connections
+        if self.timeline_cache or streaming:
+            user_ids=[user_id]+await self.get_follower_ids(user_id)
+            self.invalidate_timelines(user_ids)
+            if streaming:
+                self.timeline_hub.publish(user_ids, {'id':tweet_id, 'user_id':user_id, 'tweet':tweet})
+
+        return tweet_id
+
+    async def get_follower_ids(self, user_id):
+        if self.follow_graph:
+            return self.follow_graph.followers(user_id)
+
+        return await self.tweet_dao.get_follower_ids(user_id)
+
+    async def get_timeline(self, user_id, version=None):
+        return await self.cached(user_id, (version, 'all'), lambda: self.tweet_dao.get_timeline(user_id))
+
+    async def load_timeline_since(self, user_id, since_id, limit, overlap=0):
+        return (await self.tweet_dao.get_timeline_since(user_id, since_id, limit, overlap))[::-1]
+
+    async def get_timeline_page(self, user_id, limit, cursor=None, version=None):
+        return await self.cached(user_id, (version, limit, cursor), lambda: self.load_timeline_page(user_id, limit, cursor))
+
+    async def load_timeline_page(self, user_id, limit, cursor=None):
+        created_at, tweet_id=decode_cursor(cursor) if cursor else (None, None)
+
+        # fetch one extra row to know whether there is a next page
+        tweets=await self.tweet_dao.get_timeline_page(user_id, limit+1, created_at, tweet_id)
+
+        return timeline_page(tweets, limit)
+
+    async def cached(self, user_id, key, load):
+        if not self.timeline_cache:
+            return await load()
+
+        value=self.timeline_cache.get(user_id, key, MISSING)
+        if value is MISSING:
+            generation=self.timeline_cache.generation(user_id)
+            value=await load()
+            self.timeline_cache.set(user_id, key, value, generation)
+
+        return value
\ No newline at end of file
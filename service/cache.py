@@ -0,0 +1,112 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+MISSING=object()
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.clock=clock
+        self.hits=0
+        self.misses=0
+        self.entries=OrderedDict()
+        self.lock=threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None:
+                self.misses+=1
+                return default
+
+            value, expires_at=entry
+            if expires_at is not None and expires_at<=self.clock():
+                del self.entries[key]
+                self.misses+=1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl=self.ttl if ttl is None else ttl
+        expires_at=self.clock()+ttl if ttl is not None else None
+
+        with self.lock:
+            self.entries[key]=(value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size':len(self.entries),
+            'maxsize':self.maxsize,
+            'hits':self.hits,
+            'misses':self.misses
+        }
+
+class TimelineCache:
+    # one LRU entry per (user_id, key), so maxsize bounds the cached views,
+    # and a generation per user: invalidating bumps it in O(1) and leaves
+    # the old entries to age out of the LRU
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.entries=LRUCache(maxsize, ttl, clock)
+        self.max_generations=maxsize
+        self.generations=OrderedDict()
+        # users without a generation of their own are at least this one, so
+        # forgetting a generation can never bring back older entries
+        self.floor=0
+        self.last_generation=0
+        self.lock=threading.Lock()
+
+    def generation(self, user_id):
+        with self.lock:
+            return self.generations.get(user_id, self.floor)
+
+    def get(self, user_id, key, default=None):
+        entry=self.entries.get((user_id, key))
+        if entry is None or entry[0]!=self.generation(user_id):
+            return default
+
+        return entry[1]
+
+    def set(self, user_id, key, value, generation):
+        # generation is read before the value was loaded; a load that raced
+        # an invalidation is dropped instead of stored
+        with self.lock:
+            if generation!=self.generations.get(user_id, self.floor):
+                return False
+            self.entries.set((user_id, key), (generation, value))
+            return True
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.last_generation+=1
+                self.generations[user_id]=self.last_generation
+                self.generations.move_to_end(user_id)
+            while len(self.generations)>self.max_generations:
+                _, generation=self.generations.popitem(last=False)
+                self.floor=max(self.floor, generation)
+
+    def invalidate_all(self):
+        with self.lock:
+            self.last_generation+=1
+            self.floor=self.last_generation
+            self.generations.clear()
+
+    def stats(self):
+        return self.entries.stats()
\ No newline at end of file
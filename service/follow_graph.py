@@ -0,0 +1,276 @@
+import time
+import bisect
+import threading
+
+from array import array
+from collections import deque
+
+class Adjacency:
+    # CSR: the neighbours of v are targets[offsets[v]:offsets[v+1]], sorted,
+    # plus small per-vertex delta sets for changes since the last build
+    def __init__(self, offsets=None, targets=None):
+        self.offsets=offsets if offsets is not None else array('q', [0])
+        self.targets=targets if targets is not None else array('I')
+        self.added={}
+        self.removed={}
+        self.changes=0
+
+    @classmethod
+    def build(cls, sources, targets, size):
+        # counting sort; rows come out sorted as long as the edges arrive
+        # ordered by source and, within a source, by target
+        offsets=array('q', bytes(8*(size+1)))
+        for source in sources:
+            offsets[source+1]+=1
+        for vertex in range(size):
+            offsets[vertex+1]+=offsets[vertex]
+
+        positions=array('q', offsets)
+        rows=array('I', bytes(4*len(targets)))
+        for source, target in zip(sources, targets):
+            rows[positions[source]]=target
+            positions[source]+=1
+
+        return cls(offsets, rows)
+
+    @property
+    def size(self):
+        return len(self.offsets)-1
+
+    def base(self, vertex):
+        if vertex>=self.size:
+            return self.targets[0:0]
+        return self.targets[self.offsets[vertex]:self.offsets[vertex+1]]
+
+    def in_base(self, vertex, neighbour):
+        if vertex>=self.size:
+            return False
+        start, end=self.offsets[vertex], self.offsets[vertex+1]
+        position=bisect.bisect_left(self.targets, neighbour, start, end)
+        return position<end and self.targets[position]==neighbour
+
+    def neighbours(self, vertex):
+        neighbours=self.base(vertex)
+        removed=self.removed.get(vertex)
+        added=self.added.get(vertex)
+        if not removed and not added:
+            return neighbours.tolist()
+
+        neighbours=[neighbour for neighbour in neighbours if not removed or neighbour not in removed]
+        if added:
+            neighbours=sorted(neighbours+list(added))
+        return neighbours
+
+    def has(self, vertex, neighbour):
+        if neighbour in self.added.get(vertex, ()):
+            return True
+        return self.in_base(vertex, neighbour) and neighbour not in self.removed.get(vertex, ())
+
+    def add(self, vertex, neighbour):
+        removed=self.removed.get(vertex)
+        if removed and neighbour in removed:
+            removed.discard(neighbour)
+        elif not self.in_base(vertex, neighbour):
+            self.added.setdefault(vertex, set()).add(neighbour)
+        self.changes+=1
+
+    def remove(self, vertex, neighbour):
+        added=self.added.get(vertex)
+        if added and neighbour in added:
+            added.discard(neighbour)
+        elif self.in_base(vertex, neighbour):
+            self.removed.setdefault(vertex, set()).add(neighbour)
+        self.changes+=1
+
+    def snapshot(self):
+        # the arrays are never changed in place, only the delta sets
+        snapshot=Adjacency(self.offsets, self.targets)
+        snapshot.added={vertex:set(neighbours) for vertex, neighbours in self.added.items()}
+        snapshot.removed={vertex:set(neighbours) for vertex, neighbours in self.removed.items()}
+        return snapshot
+
+    def edges(self):
+        size=max([self.size]+[vertex+1 for vertex in self.added])
+        for vertex in range(size):
+            for neighbour in self.neighbours(vertex):
+                yield vertex, neighbour
+
+    def nbytes(self):
+        return self.offsets.itemsize*len(self.offsets)+self.targets.itemsize*len(self.targets)
+
+class FollowGraph:
+    def __init__(self, compact_after=100000, user_dao=None, interval=1, overlap=5, batch=10000, retention_days=1, clock=time.monotonic):
+        self.compact_after=compact_after
+        self.lock=threading.Lock()
+        self.following_index=Adjacency()
+        self.followers_index=Adjacency()
+        self.edge_count=0
+        # follows and unfollows made while compact builds new arrays
+        self.pending=None
+        # with user_dao, lookups resync from the follow_changes log at most
+        # every interval seconds, so changes made by other processes show up
+        self.user_dao=user_dao
+        self.interval=interval
+        self.overlap=overlap
+        self.batch=batch
+        self.retention_days=retention_days
+        self.clock=clock
+        # (time, last change id) after each sync, back to overlap seconds ago
+        self.checkpoints=deque()
+        self.synced_at=None
+        self.pruned_at=None
+        self.sync_lock=threading.Lock()
+        self.synced_changes=0
+
+    def build(self, edges):
+        # edges are (user_id, follow_user_id) pairs in primary key order
+        sources=array('I')
+        targets=array('I')
+        for user_id, follow_id in edges:
+            sources.append(user_id)
+            targets.append(follow_id)
+
+        size=max(max(sources, default=0), max(targets, default=0))+1
+        return Adjacency.build(sources, targets, size), Adjacency.build(targets, sources, size), len(sources)
+
+    def load(self, edges):
+        indexes=self.build(edges)
+        with self.lock:
+            self.following_index, self.followers_index, self.edge_count=indexes
+
+    def load_from(self, user_dao):
+        # the log position is read before the edges, so a change made while
+        # they stream in is applied again by the next sync
+        change_id=user_dao.get_last_follow_change_id()
+        self.load(user_dao.iter_follow_edges())
+        with self.sync_lock:
+            self.checkpoints=deque([(self.clock(), change_id)])
+            self.synced_at=self.clock()
+
+    def sync(self, user_dao):
+        # change ids are assigned before commit, so the log is read again
+        # from overlap seconds back; each change comes with the edge as it
+        # stands now, which makes reading it twice harmless
+        if not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            now=self.clock()
+            after_id=self.checkpoints[0][1] if self.checkpoints else 0
+            last_id=self.checkpoints[-1][1] if self.checkpoints else 0
+            while True:
+                changes=user_dao.get_follow_changes(after_id, self.batch)
+                for change in changes:
+                    if change['following']:
+                        self.follow(change['user_id'], change['follow_user_id'])
+                    else:
+                        self.unfollow(change['user_id'], change['follow_user_id'])
+                    after_id=change['id']
+                last_id=max(last_id, after_id)
+                self.synced_changes+=len(changes)
+                if len(changes)<self.batch:
+                    break
+
+            self.checkpoints.append((now, last_id))
+            while len(self.checkpoints)>1 and self.checkpoints[1][0]<=now-self.overlap:
+                self.checkpoints.popleft()
+            self.synced_at=now
+
+            # any process may prune; one down for longer than the retention
+            # loads the whole graph again when it starts
+            if self.pruned_at is None or now-self.pruned_at>=3600:
+                user_dao.prune_follow_changes(self.retention_days)
+                self.pruned_at=now
+        finally:
+            self.sync_lock.release()
+
+    def poll(self):
+        if self.user_dao is None:
+            return
+        if self.synced_at is None or self.clock()-self.synced_at>=self.interval:
+            self.sync(self.user_dao)
+
+    def compact(self):
+        # folds the delta sets back into the arrays; the arrays are built
+        # from a snapshot outside the lock and changes made meanwhile are
+        # replayed onto them before they are swapped in
+        with self.lock:
+            if self.pending is not None:
+                return
+            self.pending=[]
+            snapshot=self.following_index.snapshot()
+
+        try:
+            following_index, followers_index, edge_count=self.build(snapshot.edges())
+        except Exception:
+            with self.lock:
+                self.pending=None
+            raise
+
+        with self.lock:
+            for user_id, follow_id, followed in self.pending:
+                if followed:
+                    following_index.add(user_id, follow_id)
+                    followers_index.add(follow_id, user_id)
+                    edge_count+=1
+                else:
+                    following_index.remove(user_id, follow_id)
+                    followers_index.remove(follow_id, user_id)
+                    edge_count-=1
+
+            self.following_index, self.followers_index, self.edge_count=following_index, followers_index, edge_count
+            self.pending=None
+
+    def following(self, user_id):
+        self.poll()
+        with self.lock:
+            return self.following_index.neighbours(user_id)
+
+    def followers(self, user_id):
+        self.poll()
+        with self.lock:
+            return self.followers_index.neighbours(user_id)
+
+    def is_following(self, user_id, follow_id):
+        self.poll()
+        with self.lock:
+            return self.following_index.has(user_id, follow_id)
+
+    def follow(self, user_id, follow_id):
+        with self.lock:
+            if self.following_index.has(user_id, follow_id):
+                return
+            self.following_index.add(user_id, follow_id)
+            self.followers_index.add(follow_id, user_id)
+            self.edge_count+=1
+            if self.pending is not None:
+                self.pending.append((user_id, follow_id, True))
+            compact=self.following_index.changes>=self.compact_after and self.pending is None
+
+        if compact:
+            self.compact()
+
+    def unfollow(self, user_id, unfollow_id):
+        with self.lock:
+            if not self.following_index.has(user_id, unfollow_id):
+                return
+            self.following_index.remove(user_id, unfollow_id)
+            self.followers_index.remove(unfollow_id, user_id)
+            self.edge_count-=1
+            if self.pending is not None:
+                self.pending.append((user_id, unfollow_id, False))
+            compact=self.following_index.changes>=self.compact_after and self.pending is None
+
+        if compact:
+            self.compact()
+
+    def stats(self):
+        with self.lock:
+            nbytes=self.following_index.nbytes()+self.followers_index.nbytes()
+            return {
+                'users':self.following_index.size,
+                'edges':self.edge_count,
+                'pending_changes':self.following_index.changes,
+                'synced_changes':self.synced_changes,
+                'bytes':nbytes,
+                'bytes_per_million_edges':round(nbytes*1000000/self.edge_count) if self.edge_count else None
+            }
\ No newline at end of file
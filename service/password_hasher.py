@@ -0,0 +1,45 @@
+import bcrypt
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    # bcrypt releases the GIL while hashing, so a thread pool is enough to
+    # keep the work off the request threads without pickling to a process pool
+    def __init__(self, workers=0, max_pending=None, rounds=12):
+        self.rounds=rounds
+        self.executor=ThreadPoolExecutor(workers, thread_name_prefix='password-hasher') if workers else None
+        self.slots=threading.BoundedSemaphore(max_pending or workers*4) if workers else None
+
+    def hashpw(self, password):
+        return self.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+
+    def checkpw(self, password, hashed_password):
+        if isinstance(hashed_password,str):
+            hashed_password=hashed_password.encode('utf-8')
+
+        return self.run(bcrypt.checkpw, password.encode('utf-8'), hashed_password)
+
+    def run(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+
+        # fail fast instead of queueing behind a saturated pool
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+
+        try:
+            future=self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
\ No newline at end of file
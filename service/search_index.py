@@ -0,0 +1,191 @@
+import re
+import json
+import time
+import heapq
+import base64
+import bisect
+import binascii
+import threading
+
+from array import array
+from collections import deque
+
+TOKEN=re.compile(r'\w+')
+
+def tokenize(text):
+    return {token[:40] for token in TOKEN.findall(text.lower())}
+
+def encode_search_cursor(score, tweet_id):
+    cursor=json.dumps([score, tweet_id])
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('utf-8')
+
+def decode_search_cursor(cursor):
+    try:
+        score, tweet_id=json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+    if not isinstance(score,int) or not isinstance(tweet_id,int):
+        raise ValueError('invalid cursor')
+
+    return score, tweet_id
+
+class SearchIndex:
+    def __init__(self, tweet_dao, batch=10000, overlap=5, recheck_every=1, compact_after=1000, clock=time.monotonic):
+        self.tweet_dao=tweet_dao
+        self.batch=batch
+        self.overlap=overlap
+        self.recheck_every=recheck_every
+        self.compact_after=compact_after
+        self.clock=clock
+        # token -> ascending tweet ids, and tweet id -> author as two
+        # parallel arrays, all in id order
+        self.postings={}
+        self.tweet_ids=array('q')
+        self.authors=array('q')
+        # tweets gone from the tweets table since they were indexed, until
+        # compact drops them from the arrays
+        self.removed=set()
+        # the newest id read from the tweets table; tweets added by tweeted
+        # may be past it, and refresh skips them when it gets there
+        self.scanned_id=0
+        # (time, scanned_id) after each refresh, back to overlap seconds ago
+        self.checkpoints=deque()
+        self.rechecked_at=None
+        self.lock=threading.Lock()
+        self.refresh_lock=threading.Lock()
+
+    @property
+    def last_id(self):
+        return self.tweet_ids[-1] if self.tweet_ids else 0
+
+    def tweeted(self, tweet):
+        # the tweet this process just wrote, without a query or refresh_lock
+        with self.lock:
+            self.index(tweet)
+
+    def index(self, tweet):
+        if tweet['id']>self.last_id:
+            self.add(tweet)
+        elif not self.indexed(tweet['id']):
+            self.insert(tweet)
+
+    def refresh(self):
+        # indexes tweets past the newest id read, whichever process wrote them
+        with self.refresh_lock:
+            while True:
+                tweets=self.tweet_dao.get_tweets_after(self.scanned_id, self.batch)
+                with self.lock:
+                    for tweet in tweets:
+                        self.index(tweet)
+                if tweets:
+                    self.scanned_id=tweets[-1]['id']
+
+                if len(tweets)<self.batch:
+                    break
+
+            self.recheck()
+
+    def recheck(self):
+        # ids are handed out before commit, so a tweet can commit after a
+        # higher id is indexed; ids written in the last overlap seconds are
+        # listed again and the tweets missing from the index are added
+        now=self.clock()
+        if not self.checkpoints or self.checkpoints[-1][1]!=self.scanned_id:
+            self.checkpoints.append((now, self.scanned_id))
+        while len(self.checkpoints)>1 and self.checkpoints[1][0]<=now-self.overlap:
+            self.checkpoints.popleft()
+
+        if self.rechecked_at is not None and now-self.rechecked_at<self.recheck_every:
+            return
+        self.rechecked_at=now
+
+        after_id=self.checkpoints[0][1]
+        if after_id>=self.scanned_id:
+            return
+
+        tweet_ids=self.tweet_dao.get_tweet_ids_after(after_id, self.scanned_id)
+        with self.lock:
+            missing=[tweet_id for tweet_id in tweet_ids if not self.indexed(tweet_id)]
+
+        if missing:
+            tweets=self.tweet_dao.get_tweets(missing, True)
+            with self.lock:
+                for tweet in tweets:
+                    self.index(tweet)
+
+    def indexed(self, tweet_id):
+        position=bisect.bisect_left(self.tweet_ids, tweet_id)
+        return position<len(self.tweet_ids) and self.tweet_ids[position]==tweet_id
+
+    def insert(self, tweet):
+        # a tweet below the newest indexed id goes in at its place
+        position=bisect.bisect_left(self.tweet_ids, tweet['id'])
+        self.tweet_ids.insert(position, tweet['id'])
+        self.authors.insert(position, tweet['user_id'])
+        for token in tokenize(tweet['tweet']):
+            bisect.insort(self.postings.setdefault(token, array('q')), tweet['id'])
+
+    def remove(self, tweet_ids):
+        with self.lock:
+            self.removed.update(tweet_ids)
+            if len(self.removed)>=self.compact_after:
+                self.compact()
+
+    def compact(self):
+        # drops the removed tweets from the arrays, in one pass over them
+        kept=[position for position, tweet_id in enumerate(self.tweet_ids) if tweet_id not in self.removed]
+        self.tweet_ids=array('q', (self.tweet_ids[position] for position in kept))
+        self.authors=array('q', (self.authors[position] for position in kept))
+        for token in list(self.postings):
+            postings=array('q', (tweet_id for tweet_id in self.postings[token] if tweet_id not in self.removed))
+            if postings:
+                self.postings[token]=postings
+            else:
+                del self.postings[token]
+        self.removed=set()
+
+    def add(self, tweet):
+        self.tweet_ids.append(tweet['id'])
+        self.authors.append(tweet['user_id'])
+        for token in tokenize(tweet['tweet']):
+            postings=self.postings.get(token)
+            if postings is None:
+                postings=self.postings[token]=array('q')
+            postings.append(tweet['id'])
+
+    def author(self, tweet_id):
+        position=bisect.bisect_left(self.tweet_ids, tweet_id)
+        return self.authors[position]
+
+    def search(self, query, limit, score=None, tweet_id=None, author_ids=None):
+        # ranked by the number of query terms a tweet contains, newest first
+        # within a rank; (score, tweet_id) is the last result of the previous page
+        scores={}
+        with self.lock:
+            for token in tokenize(query):
+                for match_id in self.postings.get(token, ()):
+                    scores[match_id]=scores.get(match_id, 0)+1
+
+            for match_id in self.removed.intersection(scores):
+                del scores[match_id]
+
+            if author_ids is not None:
+                scores={match_id:match_score for match_id, match_score in scores.items() if self.author(match_id) in author_ids}
+
+        ranked=((match_score, match_id) for match_id, match_score in scores.items())
+        if score is not None:
+            ranked=(rank for rank in ranked if rank<(score, tweet_id))
+
+        return heapq.nlargest(limit, ranked)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tweets':len(self.tweet_ids)-len(self.removed),
+                'tokens':len(self.postings),
+                'postings':sum(len(postings) for postings in self.postings.values()),
+                'removed':len(self.removed),
+                'last_id':self.last_id,
+                'scanned_id':self.scanned_id
+            }
\ No newline at end of file
@@ -0,0 +1,176 @@
+import time
+import heapq
+import threading
+
+from collections import OrderedDict, deque
+
+def tweet_key(tweet):
+    # the same (created_at, id) ordering as the SQL timeline and its cursors
+    return (str(tweet['created_at']), tweet['id'])
+
+def tweet_id_key(tweet):
+    # generated ids are in time order by themselves
+    return (tweet['id'],)
+
+class RecentTweets:
+    def __init__(self, tweets, size, expires_at=None):
+        # newest first; complete means the author has no tweets beyond these
+        self.tweets=deque(tweets, maxlen=size)
+        self.complete=len(self.tweets)<size
+        self.expires_at=expires_at
+
+    def push(self, tweet):
+        if len(self.tweets)==self.tweets.maxlen:
+            self.complete=False
+        self.tweets.appendleft(tweet)
+
+class NewestFirst:
+    __slots__=('key', 'tweet', 'author', 'position')
+
+    def __init__(self, key, tweet, author, position):
+        self.key=key
+        self.tweet=tweet
+        self.author=author
+        self.position=position
+
+    def __lt__(self, other):
+        return self.key>other.key
+
+class TimelineMerger:
+    def __init__(self, tweet_dao, following, per_author=50, max_authors=100000, load_batch=500, ttl=None, clock=time.monotonic):
+        self.tweet_dao=tweet_dao
+        self.following=following
+        self.per_author=per_author
+        self.max_authors=max_authors
+        self.load_batch=load_batch
+        # buffers only see tweets written through this process, so they are
+        # reloaded after ttl seconds to pick up the tweets of other processes
+        self.ttl=ttl
+        self.clock=clock
+        self.key=tweet_id_key if tweet_dao.order_by_id else tweet_key
+        self.buffers=OrderedDict()
+        self.generations={}
+        # bumped by invalidate_all, for the loads it raced
+        self.epoch=0
+        self.lock=threading.Lock()
+        self.merged_pages=0
+        self.fallback_pages=0
+
+    def tweeted(self, user_id, tweet_id):
+        with self.lock:
+            self.generations[user_id]=self.generations.get(user_id, 0)+1
+            loaded=user_id in self.buffers
+
+        if loaded:
+            tweet=self.tweet_dao.get_tweet(tweet_id)
+            with self.lock:
+                if tweet and user_id in self.buffers:
+                    self.buffers[user_id].push(tweet)
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.generations[user_id]=self.generations.get(user_id, 0)+1
+                self.buffers.pop(user_id, None)
+
+    def invalidate_all(self):
+        with self.lock:
+            self.epoch+=1
+            self.buffers.clear()
+
+    def get_buffers(self, user_ids):
+        buffers={}
+        missing=[]
+        with self.lock:
+            now=self.clock()
+            for user_id in user_ids:
+                buffer=self.buffers.get(user_id)
+                if buffer is not None and buffer.expires_at is not None and buffer.expires_at<=now:
+                    del self.buffers[user_id]
+                    buffer=None
+                if buffer is None:
+                    missing.append(user_id)
+                else:
+                    self.buffers.move_to_end(user_id)
+                    buffers[user_id]=buffer
+
+        for start in range(0, len(missing), self.load_batch):
+            batch=missing[start:start+self.load_batch]
+            with self.lock:
+                epoch=self.epoch
+                generations={user_id:self.generations.get(user_id, 0) for user_id in batch}
+
+            recent={user_id:[] for user_id in batch}
+            for tweet in self.tweet_dao.get_recent_tweets(batch, self.per_author):
+                recent[tweet['user_id']].append(tweet)
+
+            with self.lock:
+                expires_at=self.clock()+self.ttl if self.ttl is not None else None
+                for user_id, tweets in recent.items():
+                    buffer=RecentTweets(tweets, self.per_author, expires_at)
+                    buffers[user_id]=buffer
+                    # a tweet written while loading may be missing from the
+                    # rows, so only a buffer nobody wrote to in between is kept
+                    if self.epoch==epoch and self.generations.get(user_id, 0)==generations[user_id]:
+                        self.buffers[user_id]=buffer
+                while len(self.buffers)>self.max_authors:
+                    self.buffers.popitem(last=False)
+
+        return buffers
+
+    def get_timeline_page(self, user_id, limit, created_at=None, tweet_id=None):
+        authors=set(self.following(user_id))
+        authors.add(user_id)
+        if self.key is tweet_id_key:
+            before=(tweet_id,) if tweet_id is not None else None
+        else:
+            before=(created_at, tweet_id) if created_at is not None else None
+
+        snapshots={}
+        heap=[]
+        for author, buffer in self.get_buffers(authors).items():
+            tweets=list(buffer.tweets)
+            snapshots[author]=(tweets, buffer.complete)
+
+            position=0
+            if before is not None:
+                while position<len(tweets) and self.key(tweets[position])>=before:
+                    position+=1
+
+            if position<len(tweets):
+                heap.append(NewestFirst(self.key(tweets[position]), tweets[position], author, position))
+            elif not buffer.complete:
+                # the page starts below what is buffered for this author
+                return self.fell_back()
+
+        heapq.heapify(heap)
+        page=[]
+        while heap and len(page)<limit:
+            newest=heapq.heappop(heap)
+            page.append(newest.tweet)
+
+            tweets, complete=snapshots[newest.author]
+            position=newest.position+1
+            if position<len(tweets):
+                heapq.heappush(heap, NewestFirst(self.key(tweets[position]), tweets[position], newest.author, position))
+            elif not complete and len(page)<limit:
+                # older tweets of this author are not buffered and could
+                # still belong on this page
+                return self.fell_back()
+
+        with self.lock:
+            self.merged_pages+=1
+        return page
+
+    def fell_back(self):
+        with self.lock:
+            self.fallback_pages+=1
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                'authors':len(self.buffers),
+                'merged_pages':self.merged_pages,
+                'fallback_pages':self.fallback_pages
+            }
\ No newline at end of file
@@ -0,0 +1,209 @@
+import time
+import asyncio
+import logging
+import threading
+
+from collections import deque
+
+logger=logging.getLogger(__name__)
+
+class Subscription:
+    def __init__(self, user_id, max_pending):
+        self.user_id=user_id
+        self.tweets=deque(maxlen=max_pending)
+        self.event=threading.Event()
+        # set when pushes were dropped or arrived without the tweet, the
+        # reader then catches up from the database instead
+        self.stale=False
+
+    def push(self, tweet):
+        if tweet is None or len(self.tweets)==self.tweets.maxlen:
+            self.stale=True
+        if tweet is not None:
+            self.tweets.append(tweet)
+        self.event.set()
+
+    def get(self, timeout):
+        # an idle subscriber is one Event wait, no polling; clearing before
+        # draining means a push racing the drain only causes a spare wakeup
+        self.event.wait(timeout)
+        self.event.clear()
+        return self.drain()
+
+    def drain(self):
+        stale, self.stale=self.stale, False
+        tweets=[]
+        while self.tweets:
+            tweets.append(self.tweets.popleft())
+
+        return tweets, stale
+
+class AsyncSubscription(Subscription):
+    # for the async app, where tweets are published on the event loop; an
+    # idle connection is a suspended coroutine instead of a blocked thread
+    def __init__(self, user_id, max_pending):
+        super().__init__(user_id, max_pending)
+        self.event=asyncio.Event()
+
+    async def get(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.event.clear()
+        return self.drain()
+
+class StreamCursor:
+    # ids are handed out before commit, so a tweet can commit after a higher
+    # id was sent; the stream reads from a watermark trailing the newest sent
+    # id by overlap seconds and skips the ids above it it already sent
+    def __init__(self, since_id, overlap=5, clock=time.monotonic):
+        self.overlap=overlap
+        self.clock=clock
+        self.newest_id=since_id
+        self.sent=set()
+        # (time, newest_id) after each send, back to overlap seconds ago
+        self.checkpoints=deque([(clock(), since_id)])
+
+    @property
+    def after_id(self):
+        return self.checkpoints[0][1]
+
+    def unsent(self, tweets):
+        # the tweets not sent yet in id order, which are then counted as sent
+        tweets={tweet['id']:tweet for tweet in tweets if tweet['id']>self.after_id and tweet['id'] not in self.sent}
+        tweets=[tweets[tweet_id] for tweet_id in sorted(tweets)]
+        self.sent.update(tweet['id'] for tweet in tweets)
+        if tweets:
+            self.newest_id=max(self.newest_id, tweets[-1]['id'])
+
+        now=self.clock()
+        if self.checkpoints[-1][1]!=self.newest_id:
+            self.checkpoints.append((now, self.newest_id))
+        after_id=self.after_id
+        while len(self.checkpoints)>1 and self.checkpoints[1][0]<=now-self.overlap:
+            self.checkpoints.popleft()
+        if self.after_id!=after_id:
+            self.sent={tweet_id for tweet_id in self.sent if tweet_id>self.after_id}
+
+        return tweets
+
+class TimelineHub:
+    def __init__(self, max_connections=1000, max_pending=100, subscription_class=Subscription):
+        self.max_connections=max_connections
+        self.max_pending=max_pending
+        self.subscription_class=subscription_class
+        self.subscribers={}
+        self.connections=0
+        self.published=0
+        self.lock=threading.Lock()
+
+    def subscribe(self, user_id):
+        with self.lock:
+            if self.connections>=self.max_connections:
+                return None
+
+            subscription=self.subscription_class(user_id, self.max_pending)
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+            self.connections+=1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions=self.subscribers.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.user_id]
+            self.connections-=1
+
+    def user_ids(self):
+        with self.lock:
+            return list(self.subscribers)
+
+    def publish(self, user_ids, tweet):
+        # tweet None tells the subscribers to read their timeline since the
+        # last tweet they sent, for writes that do not know their tweet ids
+        with self.lock:
+            subscriptions=[subscription for user_id in set(user_ids) for subscription in self.subscribers.get(user_id, ())]
+            self.published+=1
+
+        for subscription in subscriptions:
+            subscription.push(tweet)
+
+        return len(subscriptions)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'connections':self.connections,
+                'users':len(self.subscribers),
+                'published':self.published
+            }
+
+class TimelinePoller:
+    # other processes publish to their own hubs; one poll per process reads
+    # the tweets committed since the last poll and publishes them to the
+    # users streaming here who follow their authors, so an idle connection
+    # never queries. Tweets this process published already are published
+    # again and dropped by each connection's cursor
+    def __init__(self, timeline_hub, overlap=5, batch=1000, clock=time.monotonic):
+        self.timeline_hub=timeline_hub
+        self.overlap=overlap
+        self.batch=batch
+        self.clock=clock
+        self.cursor=None
+        self.polls=0
+        self.polled_tweets=0
+        self.stopped=threading.Event()
+        self.thread=None
+
+    def start(self, tweet_dao, interval=1):
+        self.thread=threading.Thread(target=self.run, args=(tweet_dao, interval), name='timeline-poller', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self, tweet_dao, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.poll(tweet_dao)
+            except Exception:
+                logger.exception('timeline poll failed')
+
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def poll(self, tweet_dao):
+        if self.cursor is None:
+            self.cursor=StreamCursor(tweet_dao.get_last_tweet_id(), self.overlap, self.clock)
+
+        # read past the watermark in batches, so more than a batch of tweets
+        # within the overlap cannot hold the cursor in place
+        tweets=[]
+        after_id=self.cursor.after_id
+        while True:
+            batch=tweet_dao.get_tweets_after(after_id, self.batch)
+            tweets+=batch
+            if len(batch)<self.batch:
+                break
+            after_id=batch[-1]['id']
+
+        tweets=self.cursor.unsent(tweets)
+        self.polls+=1
+        self.polled_tweets+=len(tweets)
+        user_ids=self.timeline_hub.user_ids()
+        if not tweets or not user_ids:
+            return 0
+
+        followers={}
+        for user_id, follow_id in tweet_dao.get_follows_among(user_ids, {tweet['user_id'] for tweet in tweets}):
+            followers.setdefault(follow_id, []).append(user_id)
+
+        for tweet in tweets:
+            self.timeline_hub.publish([tweet['user_id']]+followers.get(tweet['user_id'], []), tweet)
+
+        return len(tweets)
\ No newline at end of file
@@ -0,0 +1,26 @@
+class TimelineVersions:
+    def __init__(self, user_dao, archive_watermark=None):
+        # every write that changes a timeline bumps its reader's counter in
+        # the database, so every process agrees on the version and reading
+        # it is one primary key lookup
+        self.user_dao=user_dao
+        self.archive_watermark=archive_watermark
+
+    def version(self, timeline_version, archive_generation=None):
+        return f'{archive_generation}.{timeline_version}' if archive_generation is not None else str(timeline_version)
+
+    def get(self, user_id):
+        archive_generation=self.archive_watermark.current() if self.archive_watermark else None
+        return self.version(self.user_dao.get_timeline_version(user_id), archive_generation)
+
+    def bump(self, user_ids, followers=False):
+        # a tweet or profile change also changes the followers' timelines
+        self.user_dao.bump_timeline_versions(user_ids, followers)
+
+class AsyncTimelineVersions(TimelineVersions):
+    async def get(self, user_id):
+        archive_generation=await self.archive_watermark.current() if self.archive_watermark else None
+        return self.version(await self.user_dao.get_timeline_version(user_id), archive_generation)
+
+    async def bump(self, user_ids, followers=False):
+        await self.user_dao.bump_timeline_versions(user_ids, followers)
\ No newline at end of file
@@ -1,12 +1,234 @@
+import json
+import base64
+import binascii
+
+from .cache import MISSING
+from .search_index import encode_search_cursor, decode_search_cursor
+
+def encode_cursor(tweet):
+    cursor=json.dumps([str(tweet['created_at']), tweet['id']])
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('utf-8')
+
+def decode_cursor(cursor):
+    try:
+        created_at, tweet_id=json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+    if not isinstance(created_at,str) or not isinstance(tweet_id,int):
+        raise ValueError('invalid cursor')
+
+    return created_at, tweet_id
+
+def timeline_page(tweets, limit):
+    next_cursor=encode_cursor(tweets[limit-1]) if len(tweets)>limit else None
+
+    return {
+        'timeline':[{
+            'id':tweet['id'],
+            'user_id':tweet['user_id'],
+            'tweet':tweet['tweet']
+        } for tweet in tweets[:limit]],
+        'next_cursor':next_cursor
+    }
+
 class TweetService:
-    def __init__(self, tweet_dao):
+    def __init__(self, tweet_dao, timeline_dao=None, timeline_cache=None, write_behind=None, timeline_merger=None, follow_graph=None, timeline_versions=None, search_index=None, archive_dao=None, timeline_hub=None, archive_watermark=None):
         self.tweet_dao=tweet_dao
+        self.timeline_dao=timeline_dao
+        self.timeline_cache=timeline_cache
+        self.write_behind=write_behind
+        self.timeline_merger=timeline_merger
+        self.follow_graph=follow_graph
+        self.timeline_versions=timeline_versions
+        self.search_index=search_index
+        self.archive_dao=archive_dao
+        self.timeline_hub=timeline_hub
+        self.archive_watermark=archive_watermark
+        self.archive_generation=None
+        if write_behind:
+            write_behind.insert_tweets=self.insert_tweets
+            write_behind.on_flush=self.tweets_inserted
 
     def tweet(self, user_id, tweet):
         if len(tweet)>300:
             return None
-        
-        return self.tweet_dao.insert_tweet(user_id, tweet)
-    
-    def get_timeline(self,user_id):
-        return self.tweet_dao.get_timeline(user_id)
\ No newline at end of file
+
+        if self.write_behind:
+            return self.write_behind.submit(user_id, tweet)
+
+        tweet_id=self.tweet_dao.insert_tweet(user_id, tweet)
+        if self.timeline_dao:
+            self.timeline_dao.fan_out_tweet(tweet_id)
+
+        if self.timeline_merger:
+            self.timeline_merger.tweeted(user_id, tweet_id)
+
+        if self.search_index:
+            self.search_index.tweeted({'id':tweet_id, 'user_id':user_id, 'tweet':tweet})
+
+        self.timeline_changed(user_id, {'id':tweet_id, 'user_id':user_id, 'tweet':tweet})
+
+        return tweet_id
+
+    def tweets(self, user_id, tweets):
+        results=[]
+        valid_tweets=[]
+        for tweet in tweets:
+            if not isinstance(tweet,str):
+                results.append({'result':'error', 'message':'invalid tweet'})
+            elif len(tweet)>300:
+                results.append({'result':'error', 'message':'over 300 characters'})
+            else:
+                results.append({'result':'success'})
+                valid_tweets.append({'user_id':user_id, 'tweet':tweet})
+
+        if not valid_tweets:
+            return results
+
+        self.insert_tweets(valid_tweets)
+        self.tweets_inserted([user_id])
+
+        return results
+
+    def insert_tweets(self, tweets):
+        return self.tweet_dao.insert_tweets(tweets, self.timeline_dao)
+
+    def tweets_inserted(self, user_ids):
+        if self.timeline_merger:
+            self.timeline_merger.invalidate(set(user_ids))
+
+        for user_id in set(user_ids):
+            self.timeline_changed(user_id)
+
+    def timeline_changed(self, user_id, tweet=None):
+        # after the tweet and its fan-out are written, so a new version is
+        # never served with the old timeline
+        if self.timeline_versions:
+            self.timeline_versions.bump([user_id], followers=True)
+
+        streaming=self.timeline_hub and self.timeline_hub.connections
+        if not (self.timeline_cache or streaming):
+            return
+
+        user_ids=[user_id]+self.get_follower_ids(user_id)
+        self.invalidate_timelines(user_ids)
+        if streaming:
+            self.timeline_hub.publish(user_ids, tweet)
+
+    def get_follower_ids(self, user_id):
+        if self.follow_graph:
+            return self.follow_graph.followers(user_id)
+
+        return self.tweet_dao.get_follower_ids(user_id)
+
+    def invalidate_timelines(self, user_ids):
+        if self.timeline_cache:
+            self.timeline_cache.invalidate(user_ids)
+
+    def get_timeline(self,user_id,since_id=None,limit=100,version=None,overlap=0):
+        # with since_id only the tweets after it, the oldest `limit` of them,
+        # and again those of the overlap ids below it.
+        # version is the ETag the response goes out with; in the cache key it
+        # keeps a body cached before another process's write off the new tag
+        if since_id is not None:
+            return self.cached(user_id, (version, 'since', since_id, limit, overlap), lambda: self.load_timeline_since(user_id, since_id, limit, overlap))
+
+        return self.cached(user_id, (version, 'all'), lambda: self.load_timeline(user_id))
+
+    def load_timeline_since(self,user_id,since_id,limit,overlap=0):
+        timeline_dao=self.timeline_dao or self.tweet_dao
+        return timeline_dao.get_timeline_since(user_id, since_id, limit, overlap)[::-1]
+
+    def load_timeline(self,user_id):
+        if self.timeline_dao:
+            return self.timeline_dao.get_timeline(user_id)
+
+        return self.tweet_dao.get_timeline(user_id)
+
+    def get_timeline_page(self, user_id, limit, cursor=None, version=None):
+        # the pull buffers only see this process's writes, so a versioned
+        # page is read from the database
+        return self.cached(user_id, (version, limit, cursor), lambda: self.load_timeline_page(user_id, limit, cursor, version is None))
+
+    def load_timeline_page(self, user_id, limit, cursor=None, merge=True):
+        created_at, tweet_id=decode_cursor(cursor) if cursor else (None, None)
+        timeline_dao=self.timeline_dao or self.tweet_dao
+
+        # fetch one extra row to know whether there is a next page
+        tweets=None
+        if self.timeline_merger and merge:
+            tweets=self.timeline_merger.get_timeline_page(user_id, limit+1, created_at, tweet_id)
+        if tweets is None:
+            tweets=timeline_dao.get_timeline_page(user_id, limit+1, created_at, tweet_id)
+
+        # the archive only holds tweets older than every hot one, so a page
+        # running out of hot tweets continues there
+        if self.archive_dao and len(tweets)<=limit:
+            if tweets:
+                created_at, tweet_id=tweets[-1]['created_at'], tweets[-1]['id']
+            tweets=tweets+self.archive_dao.get_timeline_page(user_id, limit+1-len(tweets), created_at, tweet_id)
+
+        return timeline_page(tweets, limit)
+
+    def search(self, query, limit, cursor=None, author_ids=None):
+        score, tweet_id=decode_search_cursor(cursor) if cursor else (None, None)
+
+        # picks up bulk tweets and tweets other processes wrote since the
+        # last refresh
+        self.search_index.refresh()
+        while True:
+            ranked=self.search_index.search(query, limit+1, score, tweet_id, author_ids)
+            page_ids=[match_id for _, match_id in ranked[:limit]]
+            tweets={tweet['id']:tweet for tweet in self.tweet_dao.get_tweets(page_ids)} if page_ids else {}
+            missing=[match_id for match_id in page_ids if match_id not in tweets]
+            if not missing:
+                break
+
+            # a lagging replica may not have them yet; what the primary lacks
+            # too was archived since it was indexed and is searched past
+            for tweet in self.tweet_dao.get_tweets(missing, True):
+                tweets[tweet['id']]=tweet
+            gone=[match_id for match_id in missing if match_id not in tweets]
+            if not gone:
+                break
+            self.search_index.remove(gone)
+
+        next_cursor=encode_search_cursor(*ranked[limit-1]) if len(ranked)>limit else None
+
+        return {
+            'results':[{
+                'id':tweet_id,
+                'user_id':tweets[tweet_id]['user_id'],
+                'tweet':tweets[tweet_id]['tweet']
+            } for _, tweet_id in ranked[:limit] if tweet_id in tweets],
+            'next_cursor':next_cursor
+        }
+
+    def check_archive(self):
+        # the archiver runs in its own process; once it moved tweets, what
+        # this process cached may still hold them
+        if not self.archive_watermark:
+            return
+
+        generation=self.archive_watermark.current()
+        if generation!=self.archive_generation:
+            if self.archive_generation is not None:
+                if self.timeline_cache:
+                    self.timeline_cache.invalidate_all()
+                if self.timeline_merger:
+                    self.timeline_merger.invalidate_all()
+            self.archive_generation=generation
+
+    def cached(self, user_id, key, load):
+        self.check_archive()
+        if not self.timeline_cache:
+            return load()
+
+        value=self.timeline_cache.get(user_id, key, MISSING)
+        if value is MISSING:
+            generation=self.timeline_cache.generation(user_id)
+            value=load()
+            self.timeline_cache.set(user_id, key, value, generation)
+
+        return value
\ No newline at end of file
@@ -1,24 +1,74 @@
 import jwt
-import bcrypt
 
 from datetime import datetime, timedelta
+from .password_hasher import PasswordHasher
 
 class UserService:
-    def __init__(self, user_dao, config):
+    def __init__(self, user_dao, config, timeline_dao=None, timeline_cache=None, password_hasher=None, follow_graph=None, profile_cache=None, timeline_versions=None):
         self.user_dao=user_dao
         self.configs=config
+        self.timeline_dao=timeline_dao
+        self.timeline_cache=timeline_cache
+        self.password_hasher=password_hasher or PasswordHasher()
+        self.follow_graph=follow_graph
+        self.profile_cache=profile_cache
+        self.timeline_versions=timeline_versions
     
     def create_new_user(self, new_user):
-        new_user['password']=bcrypt.hashpw(new_user['password'].encode('utf-8'),bcrypt.gensalt())
+        new_user['password']=self.password_hasher.hashpw(new_user['password'])
         new_user_id=self.user_dao.insert_user(new_user)
 
         return new_user_id
+
+    def sign_up(self, new_user):
+        new_user_id=self.create_new_user(new_user)
+
+        return self.signed_up(new_user_id, new_user)
+
+    def signed_up(self, new_user_id, new_user):
+        return {
+            'id':new_user_id,
+            'name':new_user['name'],
+            'email':new_user['email'],
+            'profile':new_user['profile']
+        }
     
     def get_user(self, new_user_id):
+        if self.profile_cache:
+            return self.get_users([new_user_id]).get(new_user_id)
+
         new_user=self.user_dao.get_user(new_user_id)
 
         return new_user
 
+    def get_users(self, user_ids, cached=True):
+        # cached=False reads every profile from the database
+        users={}
+        missing=[]
+        for user_id in set(user_ids):
+            user=self.profile_cache.get(user_id) if self.profile_cache and cached else None
+            if user is None:
+                missing.append(user_id)
+            else:
+                users[user_id]=user
+
+        # one IN query for every author not cached yet
+        for user in self.user_dao.get_users(missing) if missing else []:
+            users[user['id']]=user
+            if self.profile_cache:
+                self.profile_cache.set(user['id'], user)
+
+        return users
+
+    def update_profile(self, user_id, name=None, profile=None):
+        result=self.user_dao.update_profile(user_id, name, profile)
+        if self.profile_cache:
+            self.profile_cache.delete(user_id)
+        # hydrated timelines show the profile
+        self.bump_timelines([user_id], followers=True)
+
+        return result
+
     def get_user_id_and_password(self, email):
         user_credential=self.user_dao.get_user_id_and_password(email)
         return user_credential
@@ -28,9 +78,9 @@ class UserService:
         password=credential['password']
         user_credential=self.user_dao.get_user_id_and_password(email)
 
-        authorized=user_credential and bcrypt.checkpw(password.encode('utf-8'),user_credential['hashed_password'].encode('utf-8'))
+        authorized=user_credential and self.password_hasher.checkpw(password,user_credential['hashed_password'])
 
-        return authorized
+        return {'id':user_credential['id']} if authorized else None
 
     def generate_access_token(self, user_id):
         payload={'user_id':user_id, 'exp':datetime.utcnow()+timedelta(seconds=60*60*24)}
@@ -38,8 +88,116 @@ class UserService:
         token=jwt.encode(payload, self.configs['JWT_SECRET_KEY'],self.configs['ALGORITHM'])
         return token
 
+    def get_follow_ids(self, user_id):
+        if self.follow_graph:
+            return self.follow_graph.following(user_id)
+
+        return self.user_dao.get_follow_ids(user_id)
+
+    def bump_timelines(self, user_ids, followers=False):
+        if self.timeline_versions:
+            self.timeline_versions.bump(user_ids, followers)
+
+    def invalidate_timeline(self, user_id):
+        if self.timeline_cache:
+            self.timeline_cache.invalidate([user_id])
+
+    def followed(self, user_id, follow_ids):
+        if self.follow_graph:
+            for follow_id in follow_ids:
+                self.follow_graph.follow(user_id, follow_id)
+        self.invalidate_timeline(user_id)
+
+    def unfollowed(self, user_id, unfollow_ids):
+        if self.follow_graph:
+            for unfollow_id in unfollow_ids:
+                self.follow_graph.unfollow(user_id, unfollow_id)
+        self.invalidate_timeline(user_id)
+
+    def backfill_limit(self):
+        # how many of a newly followed author's tweets reach the timeline
+        return self.configs.get('TIMELINE_BACKFILL_LIMIT', 1000)
+
     def follow(self, user_id, follow_id):
-        return self.user_dao.insert_follow(user_id, follow_id)
+        result=self.user_dao.insert_follow(user_id, follow_id)
+        if self.timeline_dao:
+            self.timeline_dao.backfill_timeline(user_id, follow_id, self.backfill_limit())
+        self.followed(user_id, [follow_id])
+        self.bump_timelines([user_id])
+
+        return result
 
     def unfollow(self, user_id, unfollow_id):
-        return self.user_dao.insert_unfollow(user_id, unfollow_id)
\ No newline at end of file
+        result=self.user_dao.insert_unfollow(user_id, unfollow_id)
+        if self.timeline_dao:
+            self.timeline_dao.prune_timeline(user_id, unfollow_id)
+        self.unfollowed(user_id, [unfollow_id])
+        self.bump_timelines([user_id])
+
+        return result
+
+    def follows(self, user_id, follow_ids):
+        # checked against the database, not the follow graph, which may not
+        # have synced a follow another process just made
+        following=set(self.user_dao.get_follow_ids(user_id))
+        # one lookup for every id, so an unknown user is a per-item error
+        # instead of failing the whole insert on the foreign key
+        valid_ids=[follow_id for follow_id in follow_ids if isinstance(follow_id,int) and not isinstance(follow_id,bool)]
+        existing=self.get_users(valid_ids) if valid_ids else {}
+
+        results=[]
+        new_follow_ids=[]
+        for follow_id in follow_ids:
+            if not isinstance(follow_id,int) or isinstance(follow_id,bool):
+                results.append({'result':'error', 'message':'invalid user id'})
+            elif follow_id==user_id:
+                results.append({'result':'error', 'message':'cannot follow yourself'})
+            elif follow_id not in existing:
+                results.append({'result':'error', 'message':'user not found'})
+            elif follow_id in following:
+                results.append({'result':'error', 'message':'already following'})
+            else:
+                results.append({'result':'success'})
+                following.add(follow_id)
+                new_follow_ids.append(follow_id)
+
+        if new_follow_ids:
+            # a follow made elsewhere since the check is skipped, not a 500
+            followed_ids=set(self.user_dao.insert_follows(user_id, new_follow_ids))
+            for index, follow_id in enumerate(follow_ids):
+                if results[index]['result']=='success' and follow_id not in followed_ids:
+                    results[index]={'result':'error', 'message':'already following'}
+            new_follow_ids=[follow_id for follow_id in new_follow_ids if follow_id in followed_ids]
+
+        if new_follow_ids:
+            if self.timeline_dao:
+                for follow_id in new_follow_ids:
+                    self.timeline_dao.backfill_timeline(user_id, follow_id, self.backfill_limit())
+            self.followed(user_id, new_follow_ids)
+            self.bump_timelines([user_id])
+
+        return results
+
+    def unfollows(self, user_id, unfollow_ids):
+        following=set(self.user_dao.get_follow_ids(user_id))
+        results=[]
+        unfollowed_ids=[]
+        for unfollow_id in unfollow_ids:
+            if not isinstance(unfollow_id,int) or isinstance(unfollow_id,bool):
+                results.append({'result':'error', 'message':'invalid user id'})
+            elif unfollow_id not in following:
+                results.append({'result':'error', 'message':'not following'})
+            else:
+                results.append({'result':'success'})
+                following.discard(unfollow_id)
+                unfollowed_ids.append(unfollow_id)
+
+        if unfollowed_ids:
+            self.user_dao.insert_unfollows(user_id, unfollowed_ids)
+            if self.timeline_dao:
+                for unfollow_id in unfollowed_ids:
+                    self.timeline_dao.prune_timeline(user_id, unfollow_id)
+            self.unfollowed(user_id, unfollowed_ids)
+            self.bump_timelines([user_id])
+
+        return results
\ No newline at end of file
@@ -0,0 +1,119 @@
+import time
+import queue
+import logging
+import threading
+
+from concurrent.futures import Future
+
+logger=logging.getLogger(__name__)
+
+class TweetWriteBehindFull(Exception):
+    pass
+
+class TweetWriteBehind:
+    def __init__(self, tweet_dao, max_batch=100, max_delay=0.005, durable=True, max_pending=10000):
+        self.tweet_dao=tweet_dao
+        self.max_batch=max_batch
+        self.max_delay=max_delay
+        self.durable=durable
+        self.insert_tweets=tweet_dao.insert_tweets
+        self.on_flush=None
+
+        self.flushes=0
+        self.flushed_tweets=0
+        self.failed_tweets=0
+        self.rejected_tweets=0
+        self.max_batch_size=0
+        self.flush_seconds=0.0
+        self.max_flush_seconds=0.0
+
+        # bounded, so a slow database pushes back on writers instead of
+        # growing memory and the tweets lost on a crash without limit
+        self.queue=queue.Queue(max_pending)
+        self.thread=threading.Thread(target=self.run, name='tweet-write-behind', daemon=True)
+        self.thread.start()
+
+    def submit(self, user_id, tweet):
+        future=Future()
+        try:
+            self.queue.put_nowait(({'user_id':user_id, 'tweet':tweet}, future))
+        except queue.Full:
+            self.rejected_tweets+=1
+            raise TweetWriteBehindFull()
+
+        if self.durable:
+            return future.result()
+
+        return True
+
+    def run(self):
+        while True:
+            item=self.queue.get()
+            if item is None:
+                return
+
+            # group everything that arrives within max_delay of the first
+            # tweet, up to max_batch, into a single commit
+            batch=[item]
+            deadline=time.monotonic()+self.max_delay
+            while len(batch)<self.max_batch:
+                timeout=deadline-time.monotonic()
+                if timeout<=0:
+                    break
+                try:
+                    item=self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.flush(batch)
+                    return
+                batch.append(item)
+
+            self.flush(batch)
+
+    def flush(self, batch):
+        tweets=[tweet for tweet, _ in batch]
+        started=time.perf_counter()
+        try:
+            self.insert_tweets(tweets)
+        except Exception as e:
+            self.failed_tweets+=len(batch)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        elapsed=time.perf_counter()-started
+        self.flushes+=1
+        self.flushed_tweets+=len(batch)
+        self.max_batch_size=max(self.max_batch_size, len(batch))
+        self.flush_seconds+=elapsed
+        self.max_flush_seconds=max(self.max_flush_seconds, elapsed)
+
+        # the tweets are committed at this point, so a failing hook must
+        # neither fail the requests nor stop the flusher
+        try:
+            if self.on_flush:
+                self.on_flush([tweet['user_id'] for tweet in tweets])
+        except Exception:
+            logger.exception('tweet write-behind flush hook failed')
+
+        for _, future in batch:
+            future.set_result(True)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {
+            'mode':'durable' if self.durable else 'fast',
+            'pending':self.queue.qsize(),
+            'flushes':self.flushes,
+            'flushed_tweets':self.flushed_tweets,
+            'failed_tweets':self.failed_tweets,
+            'rejected_tweets':self.rejected_tweets,
+            'avg_batch_size':self.flushed_tweets/self.flushes if self.flushes else 0,
+            'max_batch_size':self.max_batch_size,
+            'avg_flush_seconds':self.flush_seconds/self.flushes if self.flushes else 0,
+            'max_flush_seconds':self.max_flush_seconds
+        }
\ No newline at end of file
@@ -0,0 +1,156 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('aiosqlite')
+
+from async_app import create_async_app
+from model import migrate, AsyncUserDao
+from service import AsyncUserService, LRUCache
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+@pytest.fixture
+def app(tmp_path):
+    db_path=tmp_path/'async.sqlite'
+    migrate(create_engine(f'sqlite:///{db_path}'))
+
+    return create_async_app({
+        'DB_URL':f'sqlite:///{db_path}',
+        'DB_ASYNC_URL':f'sqlite+aiosqlite:///{db_path}',
+        'JWT_SECRET_KEY':'secret',
+        'ALGORITHM':'HS256',
+        'BCRYPT_ROUNDS':4,
+        'TIMELINE_ETAGS':True
+    })
+
+async def sign_up_and_login(api, name):
+    await api.post('/signup', json={'name':name, 'email':f'{name}@mail.com', 'password':'password', 'profile':f'{name} profile'})
+    resp=await api.post('/login', json={'email':f'{name}@mail.com', 'password':'password'})
+    return json.loads(await resp.get_data())['access_token']
+
+def test_async_endpoints(app):
+    async def scenario():
+        api=app.test_client()
+        access_token1=await sign_up_and_login(api, 'test1')
+        access_token2=await sign_up_and_login(api, 'test2')
+
+        resp=await api.post('/tweet', json={'tweet':'test2 tweet'}, headers={'Authorization':access_token2})
+        assert resp.status_code==200
+        resp=await api.post('/follow', json={'follow':2}, headers={'Authorization':access_token1})
+        assert resp.status_code==200
+
+        resp=await api.get('/timeline', headers={'Authorization':access_token1})
+        assert json.loads(await resp.get_data())['timeline']==[{'user_id':2, 'tweet':'test2 tweet'}]
+
+        resp=await api.get('/timeline/1?limit=1')
+        page=json.loads(await resp.get_data())
+        assert [tweet['tweet'] for tweet in page['timeline']]==['test2 tweet']
+        assert page['next_cursor'] is None
+
+        # an unchanged timeline is answered with 304
+        resp=await api.get('/timeline/1', headers={'If-None-Match':resp.headers['ETag']})
+        assert resp.status_code==200
+        resp=await api.get('/timeline/1', headers={'If-None-Match':resp.headers['ETag']})
+        assert resp.status_code==304
+
+        resp=await api.post('/unfollow', json={'unfollow':2}, headers={'Authorization':access_token1})
+        assert resp.status_code==200
+        resp=await api.get('/timeline/1')
+        assert json.loads(await resp.get_data())['timeline']==[]
+
+        resp=await api.get('/timeline', headers={'Authorization':access_token1+'x'})
+        assert resp.status_code==401
+
+    asyncio.run(scenario())
+
+def test_async_archive_generation_etag(app):
+    app=create_async_app(dict(app.config, TWEET_ARCHIVE=True, TWEET_ARCHIVE_POLL=0))
+
+    async def scenario():
+        api=app.test_client()
+        await sign_up_and_login(api, 'test1')
+        etag=(await api.get('/timeline/1')).headers['ETag']
+
+        # the archiver moving tweets changes every timeline's ETag
+        create_engine(app.config['DB_URL']).execute("UPDATE archive_state SET generation=generation+1 WHERE id=1")
+        resp=await api.get('/timeline/1', headers={'If-None-Match':etag})
+        assert resp.status_code==200 and resp.headers['ETag']!=etag
+
+    asyncio.run(scenario())
+
+def test_async_user_service(app):
+    async def scenario():
+        database=create_async_engine(app.config['DB_ASYNC_URL'])
+        user_service=AsyncUserService(AsyncUserDao(database), app.config, profile_cache=LRUCache(10))
+        await user_service.sign_up({'name':'test1', 'email':'test1@mail.com', 'password':'password', 'profile':'test1 profile'})
+
+        assert (await user_service.get_user(1))['profile']=='test1 profile'
+        await user_service.update_profile(1, profile='new profile')
+        assert (await user_service.get_users([1]))[1]['profile']=='new profile'
+
+        # batch follows are sync only, and say so instead of returning a coroutine
+        with pytest.raises(NotImplementedError):
+            user_service.follows(1, [2])
+        await database.dispose()
+
+    asyncio.run(scenario())
+
+def test_async_concurrent_timeline_reads(app):
+    async def scenario():
+        api=app.test_client()
+        await sign_up_and_login(api, 'test1')
+
+        responses=await asyncio.gather(*[api.get('/timeline/1') for _ in range(20)])
+        assert all(resp.status_code==200 for resp in responses)
+
+    asyncio.run(scenario())
+
+def test_async_timeline_stream(app):
+    app=create_async_app(dict(app.config, TIMELINE_STREAM=True, TIMELINE_STREAM_MAX_CONNECTIONS=1, TIMELINE_STREAM_HEARTBEAT=0.05, TIMELINE_STREAM_POLL_INTERVAL=0.01))
+
+    async def next_event(connection):
+        while True:
+            event=await asyncio.wait_for(connection.receive(), 5)
+            if not event.startswith(b':'):
+                return event
+
+    async def scenario():
+        # served, so the poll task runs
+        async with app.test_app() as test_app:
+            await stream(test_app.test_client())
+
+    async def stream(api):
+        access_token1=await sign_up_and_login(api, 'test1')
+        access_token2=await sign_up_and_login(api, 'test2')
+        await api.post('/follow', json={'follow':2}, headers={'Authorization':access_token1})
+        await api.post('/tweet', json={'tweet':'test2 tweet'}, headers={'Authorization':access_token2})
+
+        async with api.request('/timeline/stream', headers={'Authorization':access_token1, 'Last-Event-ID':'0'}) as connection:
+            await connection.send_complete()
+            event=await next_event(connection)
+            assert event.startswith(b'id: ') and b'"tweet":"test2 tweet"' in event
+
+            resp=await api.get('/timeline/stream', headers={'Authorization':access_token2})
+            assert resp.status_code==503
+
+            await api.post('/tweet', json={'tweet':'pushed tweet'}, headers={'Authorization':access_token2})
+            assert b'"tweet":"pushed tweet"' in await next_event(connection)
+
+            # a tweet from another process never reaches this hub, the
+            # process's poll publishes it
+            create_engine(app.config['DB_URL']).execute("INSERT INTO tweets (user_id, tweet) VALUES (2, 'elsewhere')")
+            assert b'"tweet":"elsewhere"' in await next_event(connection)
+
+            await connection.disconnect()
+
+        # closing the connection frees its slot
+        await asyncio.sleep(0.1)
+        async with api.request('/timeline/stream', headers={'Authorization':access_token2}) as connection:
+            await connection.send_complete()
+            await asyncio.wait_for(connection.receive(), 5)
+            assert connection.status_code==200
+            await connection.disconnect()
+
+    asyncio.run(scenario())
\ No newline at end of file
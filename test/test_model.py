@@ -2,8 +2,11 @@ import bcrypt
 import pytest
 import config
 
-from model import UserDao, TweetDao
-from sqlalchemy import create_engine, text
+from model import UserDao, TweetDao, TimelineDao, Snowflake, instrument_pool, pool_timed_out, pool_status
+from model.snowflake import snowflake_time, snowflake_worker_id
+from model.timeline_dao import backfill_timelines
+from sqlalchemy import create_engine, text, exc
+from sqlalchemy.pool import QueuePool
 
 database=create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
 
@@ -15,6 +18,10 @@ def user_dao():
 def tweet_dao():
     return TweetDao(database)
 
+@pytest.fixture
+def timeline_dao():
+    return TimelineDao(database)
+
 def setup_function():
     hashed_password=bcrypt.hashpw(b'password',bcrypt.gensalt())
     new_users=[{
@@ -63,6 +70,7 @@ def teardown_function():
     database.execute(text("TRUNCATE users"))
     database.execute(text("TRUNCATE tweets"))
     database.execute(text("TRUNCATE users_follow_list"))
+    database.execute(text("TRUNCATE timelines"))
     database.execute(text("SET FOREIGN_KEY_CHECKS=1"))
 
 def get_user(user_id):
@@ -156,4 +164,140 @@ def test_get_timeline(user_dao,tweet_dao):
             'user_id':2,
             'tweet':'test2 tweet'
         }
-    ]
\ No newline at end of file
+    ]
+
+def test_fan_out_tweet(user_dao,tweet_dao,timeline_dao):
+    user_dao.insert_follow(1,2)
+    tweet_id=tweet_dao.insert_tweet(2,'fan out test')
+    timeline_dao.fan_out_tweet(tweet_id)
+
+    assert timeline_dao.get_timeline(1)==[{
+        'user_id':2,
+        'tweet':'fan out test'
+    }]
+    assert timeline_dao.get_timeline(2)==[{
+        'user_id':2,
+        'tweet':'fan out test'
+    }]
+
+def test_insert_tweets_fan_out(user_dao,tweet_dao,timeline_dao):
+    user_dao.insert_follow(1,2)
+    tweet_dao.insert_tweets([{'user_id':2, 'tweet':'first'}, {'user_id':2, 'tweet':'second'}], timeline_dao)
+
+    # only the new tweets are fanned out, not the author's earlier ones
+    assert sorted(tweet['tweet'] for tweet in timeline_dao.get_timeline(1))==['first','second']
+    assert timeline_dao.fan_out_pending(2)==2
+
+def test_backfill_timeline(user_dao,timeline_dao):
+    user_dao.insert_follow(1,2)
+    timeline_dao.backfill_timeline(1,2)
+
+    assert timeline_dao.get_timeline(1)==[{
+        'user_id':2,
+        'tweet':'test2 tweet'
+    }]
+
+def test_backfill_timeline_limit(user_dao,tweet_dao,timeline_dao):
+    tweet_dao.insert_tweet(2,'first')
+    tweet_dao.insert_tweet(2,'second')
+    user_dao.insert_follow(1,2)
+
+    # only the author's newest tweets
+    assert timeline_dao.backfill_timeline(1,2,2)==2
+    assert sorted(tweet['tweet'] for tweet in timeline_dao.get_timeline(1))==['first','second']
+
+def test_backfill_timelines(user_dao,timeline_dao):
+    user_dao.insert_follow(1,2)
+
+    assert backfill_timelines(database, chunk_size=1)==2
+    assert timeline_dao.get_timeline(1)==[{
+        'user_id':2,
+        'tweet':'test2 tweet'
+    }]
+    assert backfill_timelines(database)==0
+
+def test_prune_timeline(user_dao,timeline_dao):
+    user_dao.insert_follow(1,2)
+    timeline_dao.backfill_timeline(1,2)
+    user_dao.insert_unfollow(1,2)
+    timeline_dao.prune_timeline(1,2)
+
+    assert timeline_dao.get_timeline(1)==[]
+
+def test_get_timeline_page(user_dao,tweet_dao):
+    first_id=tweet_dao.insert_tweet(1,'first')
+    second_id=tweet_dao.insert_tweet(1,'second')
+    user_dao.insert_follow(1,2)
+
+    page=tweet_dao.get_timeline_page(1,2)
+    assert [tweet['id'] for tweet in page]==[second_id,first_id]
+
+    last=page[-1]
+    page=tweet_dao.get_timeline_page(1,2,last['created_at'],last['id'])
+    assert [(tweet['user_id'],tweet['tweet']) for tweet in page]==[(2,'test2 tweet')]
+
+def test_snowflake():
+    now=[1700000000.0]
+    snowflake=Snowflake(3, clock=lambda: now[0])
+
+    ids=snowflake.next_ids(3)
+    assert ids==sorted(set(ids))
+    assert snowflake_time(ids[0])==1700000000000
+
+    # a clock going back never makes ids go back
+    now[0]-=10
+    assert snowflake.next_id()>ids[-1]
+
+    with pytest.raises(ValueError):
+        Snowflake(1024)
+
+def test_snowflake_worker_id():
+    # the environment of the process wins over the shared config
+    assert snowflake_worker_id({'TWEET_ID_WORKER':1}, {'TWEET_ID_WORKER':'7'})==7
+    assert snowflake_worker_id({'TWEET_ID_WORKER':1}, {})==1
+    with pytest.raises(ValueError):
+        snowflake_worker_id({}, {})
+
+def test_snowflake_after_fork():
+    snowflake=Snowflake(1)
+    # as if the app had been created in the parent of a forked worker
+    snowflake.pid-=1
+    with pytest.raises(RuntimeError):
+        snowflake.next_id()
+
+def test_snowflake_timeline(user_dao,timeline_dao):
+    tweet_dao=TweetDao(database, id_generator=Snowflake(1))
+    timeline_dao=TimelineDao(database, order_by_id=True)
+    user_dao.insert_follow(1,2)
+
+    # tweets of the same second still come back newest first
+    first_id=tweet_dao.insert_tweet(1,'first')
+    tweet_dao.insert_tweets([{'user_id':2, 'tweet':'second'}, {'user_id':1, 'tweet':'third'}])
+    assert first_id>2**32
+    assert [tweet['tweet'] for tweet in tweet_dao.get_timeline(1)]==['third','second','first','test2 tweet']
+
+    page=tweet_dao.get_timeline_page(1,2)
+    assert [tweet['tweet'] for tweet in page]==['third','second']
+    page=tweet_dao.get_timeline_page(1,2,None,page[-1]['id'])
+    assert [tweet['tweet'] for tweet in page]==['first','test2 tweet']
+
+    timeline_dao.fan_out_pending(1)
+    timeline_dao.fan_out_pending(2)
+    page=timeline_dao.get_timeline_page(1,2,None,first_id+1)
+    assert [tweet['tweet'] for tweet in page]==['first','test2 tweet']
+
+def test_pool_saturation():
+    engine=instrument_pool(create_engine('sqlite://', poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=0.01))
+
+    # taking the last connection saturates the pool until it is returned
+    connection=engine.connect()
+    assert pool_status(engine)['saturated']
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    pool_timed_out(engine)
+    connection.close()
+
+    status=pool_status(engine)
+    assert not status['saturated']
+    assert status['saturations']==1 and status['timeouts']==1
+    assert status['max_saturated_seconds']>=0.01
\ No newline at end of file
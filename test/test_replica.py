@@ -0,0 +1,133 @@
+import pytest
+import threading
+
+from model import UserDao, TweetDao, ReplicaRouter, migrate
+from service import TimelineMerger
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+@pytest.fixture
+def primary(tmp_path):
+    database=create_engine(f"sqlite:///{tmp_path/'primary.sqlite'}", poolclass=QueuePool)
+    migrate(database)
+    return database
+
+@pytest.fixture
+def replica(tmp_path):
+    database=create_engine(f"sqlite:///{tmp_path/'replica.sqlite'}", poolclass=QueuePool)
+    migrate(database)
+    database.execute(text("""
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            1,
+            'replicated tweet'
+        )
+    """))
+    return database
+
+def test_reads_go_to_replica(primary,replica):
+    tweet_dao=TweetDao(primary,ReplicaRouter(primary,[replica]))
+
+    assert tweet_dao.get_timeline(1)==[{
+        'user_id':1,
+        'tweet':'replicated tweet'
+    }]
+
+def test_read_your_writes(primary,replica):
+    now=[0]
+    tweet_dao=TweetDao(primary,ReplicaRouter(primary,[replica],read_your_writes=5,clock=lambda: now[0]))
+    tweet_dao.insert_tweet(1,'new tweet')
+
+    # the author reads the primary within the window
+    assert tweet_dao.get_timeline(1)==[{
+        'user_id':1,
+        'tweet':'new tweet'
+    }]
+
+    # and the replica after it
+    now[0]=5
+    assert tweet_dao.get_timeline(1)==[{
+        'user_id':1,
+        'tweet':'replicated tweet'
+    }]
+
+def test_read_your_writes_batched(primary,replica):
+    for database in (primary, replica):
+        database.execute(text("""
+            INSERT INTO users (
+                id,
+                name,
+                email,
+                profile,
+                hashed_password
+            ) VALUES (
+                1,
+                'test1',
+                'test1@mail.com',
+                'test1 profile',
+                'password'
+            ), (
+                2,
+                'test2',
+                'test2@mail.com',
+                'test2 profile',
+                'password'
+            )
+        """))
+
+    now=[0]
+    user_dao=UserDao(primary,ReplicaRouter(primary,[replica],read_your_writes=5,clock=lambda: now[0]))
+    user_dao.update_profile(2, profile='new profile')
+
+    # a lookup including the user who just wrote reads the primary
+    assert [user['profile'] for user in sorted(user_dao.get_users([1,2]), key=lambda user: user['id'])]==['test1 profile','new profile']
+
+    now[0]=5
+    assert [user['profile'] for user in sorted(user_dao.get_users([1,2]), key=lambda user: user['id'])]==['test1 profile','test2 profile']
+
+def test_read_your_writes_pull_timeline(primary,replica):
+    tweet_dao=TweetDao(primary,ReplicaRouter(primary,[replica],read_your_writes=5))
+    merger=TimelineMerger(tweet_dao, lambda user_id: [])
+    tweet_dao.insert_tweet(1,'new tweet')
+
+    # the author's buffer is loaded from the primary within the window
+    assert [tweet['tweet'] for tweet in merger.get_timeline_page(1,10)]==['new tweet']
+
+def test_round_robin(primary,replica):
+    router=ReplicaRouter(primary,[primary,replica])
+
+    assert [router.reader() for _ in range(4)]==[primary,replica,primary,replica]
+
+def test_least_connections(primary,replica):
+    router=ReplicaRouter(primary,[primary,replica],strategy='least_connections')
+    conn=primary.connect()
+
+    assert router.reader()==replica
+    conn.close()
+
+def test_unknown_strategy(primary):
+    with pytest.raises(ValueError):
+        ReplicaRouter(primary,strategy='random')
+
+def test_concurrent_mark_write(primary,replica):
+    # writes past the cap are evicted while other threads add to them
+    router=ReplicaRouter(primary,[replica],max_tracked_writes=10)
+    errors=[]
+
+    def write(offset):
+        try:
+            for key in range(offset, offset+2000):
+                router.mark_write(key)
+        except Exception as e:
+            errors.append(e)
+
+    threads=[threading.Thread(target=write, args=(i*2000,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors==[]
+    assert len(router.recent_writes)==10
\ No newline at end of file
@@ -0,0 +1,110 @@
+import re
+import pytest
+
+from model import UserDao, TweetDao, TimelineDao, ArchiveDao, Snowflake, migrate
+from model.schema import MIGRATIONS
+from sqlalchemy import create_engine, event, text
+
+# any SCAN, including a scan of a whole index, reads every row of its table;
+# only derived tables and the constant row of a SELECT without FROM may do so.
+# These are SQLite plans: MySQL picks its own plans and is not covered here
+SCAN=re.compile(r'^SCAN (?:TABLE )?(.+?)(?: AS \w+)?(?: USING .*)?$')
+ALLOWED_SCANS={'CONSTANT ROW'}
+
+@pytest.fixture
+def database(tmp_path):
+    database=create_engine(f"sqlite:///{tmp_path/'schema.sqlite'}")
+    migrate(database)
+    return database
+
+def capture_statements(database, calls):
+    statements=[]
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(database, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for call in calls:
+            call()
+    finally:
+        event.remove(database, 'before_cursor_execute', before_cursor_execute)
+
+    return statements
+
+def test_migrate_is_idempotent(database):
+    assert migrate(database)==MIGRATIONS[-1][0]
+
+def test_dao_queries_use_indexes(database):
+    user_dao=UserDao(database)
+    tweet_dao=TweetDao(database)
+    timeline_dao=TimelineDao(database)
+    tweet_id_dao=TweetDao(database, id_generator=Snowflake(1))
+    timeline_id_dao=TimelineDao(database, order_by_id=True)
+    archive_dao=ArchiveDao(database)
+
+    user_id=user_dao.insert_user({'name':'test1', 'email':'test1@mail.com', 'profile':'test1 profile', 'password':'password'})
+    follow_id=user_dao.insert_user({'name':'test2', 'email':'test2@mail.com', 'profile':'test2 profile', 'password':'password'})
+    tweet_id=tweet_dao.insert_tweet(follow_id, 'test2 tweet')
+    created_at=database.execute(text("SELECT created_at FROM tweets WHERE id=:id"), {'id':tweet_id}).scalar()
+
+    statements=capture_statements(database, [
+        lambda: user_dao.get_user(user_id),
+        lambda: user_dao.get_user_id_and_password('test1@mail.com'),
+        lambda: user_dao.insert_follow(user_id, follow_id),
+        lambda: user_dao.get_follow_ids(user_id),
+        lambda: user_dao.get_follower_ids(follow_id),
+        lambda: user_dao.get_users([user_id, follow_id]),
+        lambda: user_dao.update_profile(user_id, profile='test1 new profile'),
+        lambda: user_dao.bump_timeline_versions([follow_id], True),
+        lambda: user_dao.get_timeline_version(user_id),
+        lambda: list(user_dao.iter_follow_edges(chunk_size=1)),
+        lambda: user_dao.insert_unfollow(user_id, follow_id),
+        lambda: user_dao.insert_follows(user_id, [follow_id]),
+        lambda: user_dao.insert_unfollows(user_id, [follow_id]),
+        lambda: user_dao.get_last_follow_change_id(),
+        lambda: user_dao.get_follow_changes(0, 10),
+        lambda: user_dao.prune_follow_changes(1),
+        lambda: user_dao.insert_follow(user_id, follow_id),
+        lambda: tweet_dao.insert_tweets([{'user_id':user_id, 'tweet':'test1 tweet'}]),
+        lambda: tweet_dao.get_follower_ids(follow_id),
+        lambda: tweet_dao.get_tweet(tweet_id),
+        lambda: tweet_dao.get_tweets([tweet_id]),
+        lambda: tweet_dao.get_tweets_after(0, 10),
+        lambda: tweet_dao.get_tweet_ids_after(0, tweet_id),
+        lambda: tweet_dao.get_recent_tweets([user_id, follow_id], 10),
+        lambda: tweet_dao.get_timeline(user_id),
+        lambda: tweet_dao.get_timeline_since(user_id, tweet_id, 10, 1000),
+        lambda: timeline_dao.get_timeline_since(user_id, tweet_id, 10, 1000),
+        lambda: tweet_dao.get_last_tweet_id(),
+        lambda: tweet_dao.get_follows_among([user_id], [follow_id]),
+        lambda: tweet_dao.get_timeline_page(user_id, 10),
+        lambda: tweet_dao.get_timeline_page(user_id, 10, created_at, tweet_id),
+        lambda: timeline_dao.fan_out_tweet(tweet_id),
+        lambda: timeline_dao.fan_out_pending(user_id),
+        lambda: timeline_dao.fan_out_pending(user_id, tweet_id),
+        lambda: tweet_dao.insert_tweets([{'user_id':follow_id, 'tweet':'test2 tweet'}], timeline_dao),
+        lambda: timeline_dao.backfill_timeline(user_id, follow_id),
+        lambda: timeline_dao.backfill_timeline(user_id, follow_id, 10),
+        lambda: timeline_dao.get_timeline(user_id),
+        lambda: timeline_dao.get_timeline_page(user_id, 10),
+        lambda: timeline_dao.get_timeline_page(user_id, 10, created_at, tweet_id),
+        lambda: timeline_dao.prune_timeline(user_id, follow_id),
+        lambda: tweet_id_dao.insert_tweet(user_id, 'test1 tweet'),
+        lambda: tweet_id_dao.get_recent_tweets([user_id, follow_id], 10),
+        lambda: tweet_id_dao.get_timeline_page(user_id, 10, None, tweet_id),
+        lambda: timeline_id_dao.get_timeline(user_id),
+        lambda: timeline_id_dao.get_timeline_page(user_id, 10, None, tweet_id),
+        lambda: archive_dao.archive_tweets(-1, 1),
+        lambda: archive_dao.get_generation(),
+        lambda: archive_dao.get_timeline_page(user_id, 10),
+        lambda: archive_dao.get_timeline_page(user_id, 10, created_at, tweet_id)
+    ])
+    assert statements
+
+    for statement, parameters in statements:
+        plan=database.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        # scanning a derived table is fine as long as its own rows come from an index
+        derived={row[-1].split(' ', 1)[1] for row in plan if row[-1].startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        scans=[SCAN.match(row[-1]) for row in plan]
+        full_scans=[scan.group(0) for scan in scans if scan and scan.group(1) not in derived|ALLOWED_SCANS]
+        assert not full_scans, f'{statement} falls back to a full scan: {full_scans}'
\ No newline at end of file
@@ -2,9 +2,12 @@ import jwt
 import bcrypt
 import pytest
 import config
+import threading
 
-from model import UserDao, TweetDao
-from service import UserService, TweetService
+from datetime import datetime
+
+from model import UserDao, TweetDao, ArchiveDao
+from service import UserService, TweetService, LRUCache, TimelineCache, PasswordHasher, PasswordHasherBusy, TweetWriteBehind, TweetWriteBehindFull, TimelineMerger, FollowGraph, TweetArchiver, SearchIndex, ArchiveWatermark, StreamCursor
 from sqlalchemy import create_engine, text
 
 database=create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
@@ -65,6 +68,7 @@ def teardown_function():
     database.execute(text("TRUNCATE users"))
     database.execute(text("TRUNCATE tweets"))
     database.execute(text("TRUNCATE users_follow_list"))
+    database.execute(text("TRUNCATE tweets_archive"))
     database.execute(text("SET FOREIGN_KEY_CHECKS=1"))
 
 def get_user(user_id):
@@ -160,4 +164,330 @@ def test_get_timeline(user_service,tweet_service):
             'user_id':1,
             'tweet':'tweet test'
         }
-    ]
\ No newline at end of file
+    ]
+
+def test_get_timeline_page(user_service,tweet_service):
+    tweet_service.tweet(1,'first')
+    tweet_service.tweet(1,'second')
+    user_service.follow(1,2)
+
+    page=tweet_service.get_timeline_page(1,2)
+    assert [tweet['tweet'] for tweet in page['timeline']]==['second','first']
+    assert page['next_cursor'] is not None
+
+    page=tweet_service.get_timeline_page(1,2,page['next_cursor'])
+    assert [tweet['tweet'] for tweet in page['timeline']]==['test2 tweet']
+    assert page['next_cursor'] is None
+
+def test_get_timeline_page_invalid_cursor(tweet_service):
+    with pytest.raises(ValueError):
+        tweet_service.get_timeline_page(1,10,'not a cursor')
+
+def test_lru_cache():
+    now=[0]
+    cache=LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set(1,'a')
+    cache.set(2,'b')
+    assert cache.get(1)=='a'
+
+    # 2 is the least recently used entry
+    cache.set(3,'c')
+    assert cache.get(2) is None
+    assert cache.get(3)=='c'
+
+    now[0]=10
+    assert cache.get(1) is None
+    assert cache.stats()=={'size':1,'maxsize':2,'hits':2,'misses':2}
+
+def test_timeline_cache_invalidation():
+    cache=TimelineCache()
+    user_service=UserService(UserDao(database),config.test_config,timeline_cache=cache)
+    tweet_service=TweetService(TweetDao(database),timeline_cache=cache)
+
+    assert tweet_service.get_timeline(1)==[]
+    assert tweet_service.get_timeline(1)==[]
+    assert cache.stats()['hits']==1
+
+    # follow invalidates the follower
+    user_service.follow(1,2)
+    assert tweet_service.get_timeline(1)==[{
+        'user_id':2,
+        'tweet':'test2 tweet'
+    }]
+
+    # tweet invalidates the author's followers
+    tweet_service.tweet(2,'new tweet')
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline_page(1,1)['timeline']]==['new tweet']
+
+def test_timeline_cache_generations():
+    cache=TimelineCache(maxsize=2)
+    generation=cache.generation(1)
+    assert cache.set(1,'all',['a'],generation)
+    assert cache.get(1,'all')==['a']
+
+    # a load that started before an invalidation is not stored
+    generation=cache.generation(1)
+    cache.invalidate([1])
+    assert not cache.set(1,'all',['stale'],generation)
+    assert cache.get(1,'all') is None
+
+    # a forgotten generation keeps current entries and never revives older ones
+    cache.set(1,'all',['b'],cache.generation(1))
+    cache.invalidate([2,3])
+    assert cache.get(1,'all')==['b']
+    cache.invalidate([1])
+    cache.invalidate([4,5])
+    assert cache.get(1,'all') is None
+
+def test_password_hasher():
+    hasher=PasswordHasher(workers=1, max_pending=1, rounds=4)
+    hashed_password=hasher.hashpw('password')
+
+    assert hasher.checkpw('password', hashed_password)
+    assert hasher.checkpw('password', hashed_password.decode('utf-8'))
+    assert not hasher.checkpw('password123', hashed_password)
+
+    # a saturated pool rejects instead of queueing
+    started=threading.Event()
+    release=threading.Event()
+    def block():
+        started.set()
+        release.wait()
+
+    blocked=threading.Thread(target=hasher.run, args=(block,))
+    blocked.start()
+    started.wait()
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hashpw('password')
+
+    release.set()
+    blocked.join()
+    hasher.shutdown()
+
+def test_write_behind():
+    write_behind=TweetWriteBehind(TweetDao(database), max_batch=3, max_delay=5, durable=True)
+    tweet_service=TweetService(TweetDao(database), write_behind=write_behind)
+
+    threads=[threading.Thread(target=tweet_service.tweet, args=(1, f'tweet {i}')) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_behind.close()
+
+    timeline=tweet_service.get_timeline(1)
+    assert sorted(tweet['tweet'] for tweet in timeline)==['tweet 0', 'tweet 1', 'tweet 2']
+
+    # the batch fills up long before the delay runs out
+    stats=write_behind.stats()
+    assert (stats['flushes'], stats['flushed_tweets'], stats['max_batch_size'])==(1, 3, 3)
+
+def test_write_behind_full():
+    write_behind=TweetWriteBehind(TweetDao(database), max_batch=10, max_delay=0, durable=False, max_pending=1)
+    tweet_service=TweetService(TweetDao(database), write_behind=write_behind)
+    inserting=threading.Event()
+    release=threading.Event()
+    batches=[]
+    insert_tweets=write_behind.insert_tweets
+    def slow_insert(tweets):
+        batches.append([tweet['tweet'] for tweet in tweets])
+        inserting.set()
+        release.wait()
+        return insert_tweets(tweets)
+    write_behind.insert_tweets=slow_insert
+
+    tweet_service.tweet(1, 'first')
+    inserting.wait()
+    tweet_service.tweet(1, 'second')
+    # the flusher is stuck and the queue holds its one pending tweet
+    with pytest.raises(TweetWriteBehindFull):
+        tweet_service.tweet(1, 'third')
+
+    release.set()
+    write_behind.close()
+    assert batches==[['first'], ['second']]
+    assert write_behind.stats()['rejected_tweets']==1
+
+def test_timeline_merger(user_service):
+    merger=TimelineMerger(TweetDao(database), UserDao(database).get_follow_ids, per_author=2)
+    tweet_service=TweetService(TweetDao(database), timeline_merger=merger)
+    user_service.follow(1,2)
+    for tweet in ['first','second','third']:
+        tweet_service.tweet(1,tweet)
+
+    page=tweet_service.get_timeline_page(1,1)
+    assert [tweet['tweet'] for tweet in page['timeline']]==['third']
+
+    # pages reaching past the buffered tweets fall back to SQL
+    page=tweet_service.get_timeline_page(1,1,page['next_cursor'])
+    assert [tweet['tweet'] for tweet in page['timeline']]==['second']
+    page=tweet_service.get_timeline_page(1,1,page['next_cursor'])
+    assert [tweet['tweet'] for tweet in page['timeline']]==['first']
+
+    # a new tweet lands in the loaded buffer of its author
+    tweet_service.tweet(2,'new tweet')
+    page=tweet_service.get_timeline_page(1,1)
+    assert [tweet['tweet'] for tweet in page['timeline']]==['new tweet']
+
+    assert merger.stats()=={'authors':2, 'merged_pages':2, 'fallback_pages':2}
+
+def test_timeline_merger_ttl(user_service):
+    now=[0]
+    merger=TimelineMerger(TweetDao(database), UserDao(database).get_follow_ids, ttl=10, clock=lambda: now[0])
+    tweet_service=TweetService(TweetDao(database), timeline_merger=merger)
+    user_service.follow(1,2)
+    tweet_service.tweet(1,'first')
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline_page(1,1)['timeline']]==['first']
+
+    # a tweet written by another process is picked up once the buffer expires
+    TweetDao(database).insert_tweet(2,'elsewhere')
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline_page(1,1)['timeline']]==['first']
+    now[0]=10
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline_page(1,1)['timeline']]==['elsewhere']
+
+def test_follow_graph():
+    follow_graph=FollowGraph(compact_after=3)
+    follow_graph.load([(1,2),(1,3),(2,3),(4,1)])
+    assert follow_graph.following(1)==[2,3]
+    assert follow_graph.followers(3)==[1,2]
+    assert follow_graph.following(5)==[]
+
+    follow_graph.follow(1,4)
+    follow_graph.unfollow(1,2)
+    assert follow_graph.following(1)==[3,4]
+    assert follow_graph.followers(2)==[]
+    assert follow_graph.stats()['pending_changes']==2
+
+    # the third change folds the deltas back into the arrays
+    follow_graph.follow(5,1)
+    assert follow_graph.following(5)==[1]
+    assert follow_graph.followers(1)==[4,5]
+    assert follow_graph.is_following(1,4) and not follow_graph.is_following(1,2)
+    assert follow_graph.stats()['pending_changes']==0
+    assert follow_graph.stats()['edges']==5
+
+def test_follow_graph_compact_concurrent_changes():
+    follow_graph=FollowGraph(compact_after=100)
+    follow_graph.load([(1,2),(1,3)])
+    build=follow_graph.build
+
+    def build_while_changing(edges):
+        indexes=build(edges)
+        # the lock is free while the arrays are built
+        follow_graph.follow(4,1)
+        follow_graph.unfollow(1,3)
+        return indexes
+
+    follow_graph.build=build_while_changing
+    follow_graph.compact()
+    assert follow_graph.following(1)==[2]
+    assert follow_graph.following(4)==[1]
+    assert follow_graph.followers(1)==[4]
+    assert follow_graph.followers(3)==[]
+    assert follow_graph.stats()['edges']==2
+
+def test_follow_graph_sync(user_service):
+    follow_graph=FollowGraph(user_dao=UserDao(database), interval=0)
+    follow_graph.load_from(UserDao(database))
+    user_service.follow_graph=follow_graph
+
+    # follows made through another process come from the change log
+    other_dao=UserDao(database)
+    other_dao.insert_follow(1,2)
+    assert follow_graph.following(1)==[2]
+    assert follow_graph.followers(2)==[1]
+
+    # the bulk follow checks the database, and a follow racing the insert
+    # is reported per item
+    assert user_service.follows(1,[2])==[{'result':'error', 'message':'already following'}]
+    assert other_dao.insert_follows(2,[1])==[1]
+    assert other_dao.insert_follows(2,[1])==[]
+
+    other_dao.insert_unfollow(1,2)
+    assert follow_graph.following(1)==[]
+    assert follow_graph.is_following(2,1)
+
+def test_search_index_late_commit_and_archive():
+    now=[0]
+    tweet_dao=TweetDao(database)
+    search_index=SearchIndex(tweet_dao, clock=lambda: now[0])
+    tweet_service=TweetService(tweet_dao, search_index=search_index)
+    search_index.refresh()
+
+    database.execute(text("INSERT INTO tweets (id, user_id, tweet) VALUES (21, 1, 'hello first')"))
+    search_index.refresh()
+    # a lower id committing after the higher one was indexed
+    database.execute(text("INSERT INTO tweets (id, user_id, tweet) VALUES (20, 1, 'hello late')"))
+    now[0]=1
+    page=tweet_service.search('hello', 10)
+    assert [tweet['tweet'] for tweet in page['results']]==['hello first', 'hello late']
+
+    # an archived tweet is skipped and the page is filled from the next ones
+    database.execute(text("DELETE FROM tweets WHERE id=21"))
+    page=tweet_service.search('hello', 1)
+    assert [tweet['tweet'] for tweet in page['results']]==['hello late']
+    assert page['next_cursor'] is None
+    assert search_index.stats()['removed']==1
+
+def test_search_index_tweeted_and_compact():
+    tweet_dao=TweetDao(database)
+    search_index=SearchIndex(tweet_dao, compact_after=2)
+    tweet_service=TweetService(tweet_dao, search_index=search_index)
+    search_index.refresh()
+
+    # another process's tweet below the one written here is still read by
+    # the next refresh, and the tweet written here is not indexed twice
+    database.execute(text("INSERT INTO tweets (id, user_id, tweet) VALUES (30, 2, 'hello other')"))
+    tweet_id=tweet_service.tweet(1, 'hello mine')
+    assert search_index.stats()['scanned_id']<30<tweet_id
+    assert [tweet['tweet'] for tweet in tweet_service.search('hello', 10)['results']]==['hello mine', 'hello other']
+    assert search_index.stats()['postings']==6
+
+    # archived tweets are dropped from the arrays once compact_after of them
+    # are removed
+    database.execute(text("DELETE FROM tweets WHERE id IN (30, :tweet_id)"), {'tweet_id':tweet_id})
+    assert tweet_service.search('hello', 10)['results']==[]
+    assert search_index.stats()=={'tweets':1, 'tokens':2, 'postings':2, 'removed':0, 'last_id':1, 'scanned_id':tweet_id}
+
+def test_tweet_archive(user_service):
+    archive_dao=ArchiveDao(database)
+    now=[0]
+    tweet_service=TweetService(TweetDao(database), timeline_cache=TimelineCache(), archive_dao=archive_dao, archive_watermark=ArchiveWatermark(archive_dao, clock=lambda: now[0]))
+    user_service.follow(1,2)
+    tweet_service.tweet(2,'second')
+    tweet_service.tweet(1,'third')
+    database.execute(text("UPDATE tweets SET created_at=:created_at WHERE tweet<>'third'"), {'created_at':datetime(2020,1,1)})
+    assert len(tweet_service.get_timeline(1))==3
+
+    # the horizon is taken from the database clock
+    archiver=TweetArchiver(ArchiveDao(database), horizon_days=30, chunk_size=1, pause=0)
+    assert archiver.run()==2
+    assert archiver.stats()=={'horizon_days':30, 'runs':1, 'chunks':2, 'archived_tweets':2}
+
+    # the cached timeline is dropped once the archive generation is polled,
+    # then the hot table alone serves the full timeline and pages go on
+    # into the archive
+    assert len(tweet_service.get_timeline(1))==3
+    now[0]=1
+    assert tweet_service.get_timeline(1)==[{'user_id':1, 'tweet':'third'}]
+    page=tweet_service.get_timeline_page(1,2)
+    assert [tweet['tweet'] for tweet in page['timeline']]==['third','second']
+    page=tweet_service.get_timeline_page(1,2,page['next_cursor'])
+    assert [tweet['tweet'] for tweet in page['timeline']]==['test2 tweet']
+    assert page['next_cursor'] is None
+
+def test_stream_cursor_late_commit():
+    now=[0]
+    cursor=StreamCursor(1, overlap=5, clock=lambda: now[0])
+    assert [tweet['id'] for tweet in cursor.unsent([{'id':2}, {'id':4}])]==[2,4]
+
+    # id 3 commits after 4 was sent; it is still above the watermark, and
+    # reading from there again skips what was already sent
+    assert cursor.after_id==1
+    assert [tweet['id'] for tweet in cursor.unsent([{'id':2}, {'id':3}, {'id':4}])]==[3]
+
+    now[0]=5
+    assert cursor.unsent([])==[]
+    assert cursor.after_id==4
+    assert cursor.sent==set()
+    assert [tweet['id'] for tweet in cursor.unsent([{'id':4}, {'id':5}])]==[5]
\ No newline at end of file
@@ -1,9 +1,12 @@
 from app import create_app
-from sqlalchemy import create_engine, text
+from view.admission import InFlight
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.engine import Engine
 
 import config
 import pytest
 import json
+import gzip
 import bcrypt
 
 database=create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
@@ -173,4 +176,406 @@ def test_unfollow(api):
     assert tweets=={
         'user_id':1,
         'timeline':[]
-    }
\ No newline at end of file
+    }
+
+def test_timeline_pagination(api):
+    # login & access token
+    resp=api.post('/login', data=json.dumps({'email':'test2@mail.com', 'password':'password'}), content_type='application/json')
+    resp_json=json.loads(resp.data.decode('utf-8'))
+    access_token=resp_json['access_token']
+
+    # tweet
+    resp=api.post('/tweet', data=json.dumps({'tweet':'test tweet'}), content_type='application/json', headers={'Authorization':access_token})
+    assert resp.status_code==200
+
+    # first page
+    resp=api.get('/timeline?limit=1', headers={'Authorization':access_token})
+    page=json.loads(resp.data.decode('utf-8'))
+    assert resp.status_code==200
+    assert [tweet['tweet'] for tweet in page['timeline']]==['test tweet']
+    assert page['next_cursor'] is not None
+
+    # second page
+    resp=api.get(f"/timeline/2?limit=1&cursor={page['next_cursor']}")
+    page=json.loads(resp.data.decode('utf-8'))
+    assert resp.status_code==200
+    assert [tweet['tweet'] for tweet in page['timeline']]==['test2 tweet']
+    assert page['next_cursor'] is None
+
+    # broken cursor
+    resp=api.get('/timeline/2?limit=1&cursor=broken')
+    assert resp.status_code==400
+
+    # limits below one are rejected, not replaced by the maximum
+    for limit in (0, -1):
+        resp=api.get(f'/timeline/2?limit={limit}')
+        assert resp.status_code==400
+
+def test_token_cache():
+    app=create_app(dict(config.test_config, JWT_CACHE_SIZE=10))
+    api=app.test_client()
+
+    # login & access token
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    resp_json=json.loads(resp.data.decode('utf-8'))
+    access_token=resp_json['access_token']
+
+    for _ in range(3):
+        resp=api.get('/timeline', headers={'Authorization':access_token})
+        assert resp.status_code==200
+
+    token_cache=app.extensions['token_cache']
+    assert token_cache.stats()['misses']==1
+    assert token_cache.stats()['hits']==2
+
+    # forged tokens are never cached
+    resp=api.get('/timeline', headers={'Authorization':access_token+'x'})
+    assert resp.status_code==401
+    assert token_cache.stats()['size']==1
+
+def count_queries(func):
+    statements=[]
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        resp=func()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+    return resp, len(statements)
+
+def test_query_count(api):
+    resp, queries=count_queries(lambda: api.post('/signup', data=json.dumps({
+        'name':'new',
+        'email':'new@mail.com',
+        'profile':'new profile',
+        'password':'password'
+    }), content_type='application/json'))
+    assert resp.status_code==200
+    assert json.loads(resp.data.decode('utf-8'))['email']=='new@mail.com'
+    assert queries==1
+
+    resp, queries=count_queries(lambda: api.post('/login', data=json.dumps({'email':'test1@mail.com','password':'password'}), content_type='application/json'))
+    assert resp.status_code==200
+    assert queries==1
+
+def test_bulk_tweet_and_follow(api):
+    # login & access token
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    resp_json=json.loads(resp.data.decode('utf-8'))
+    access_token=resp_json['access_token']
+
+    # bulk tweet with one invalid item
+    resp=api.post('/tweets', data=json.dumps({'tweets':['first', 'x'*301, 'second']}), content_type='application/json', headers={'Authorization':access_token})
+    assert resp.status_code==200
+    assert json.loads(resp.data.decode('utf-8'))=={
+        'results':[
+            {'result':'success'},
+            {'result':'error', 'message':'over 300 characters'},
+            {'result':'success'}
+        ]
+    }
+
+    # bulk follow
+    resp=api.post('/follows', data=json.dumps({'follow':[2, 2, 1, 100]}), content_type='application/json', headers={'Authorization':access_token})
+    assert json.loads(resp.data.decode('utf-8'))=={
+        'results':[
+            {'result':'success'},
+            {'result':'error', 'message':'already following'},
+            {'result':'error', 'message':'cannot follow yourself'},
+            {'result':'error', 'message':'user not found'}
+        ]
+    }
+
+    resp=api.get('/timeline/1')
+    tweets=json.loads(resp.data.decode('utf-8'))
+    assert sorted(tweet['tweet'] for tweet in tweets['timeline'])==['first', 'second', 'test2 tweet']
+
+    # bulk unfollow
+    resp=api.post('/unfollows', data=json.dumps({'unfollow':[2]}), content_type='application/json', headers={'Authorization':access_token})
+    assert json.loads(resp.data.decode('utf-8'))=={'results':[{'result':'success'}]}
+
+    resp=api.get('/timeline/1')
+    tweets=json.loads(resp.data.decode('utf-8'))
+    assert sorted(tweet['tweet'] for tweet in tweets['timeline'])==['first', 'second']
+
+def test_pool_stats(api):
+    resp=api.get('/timeline/1')
+    assert resp.status_code==200
+
+    resp=api.get('/stats/pool')
+    stats=json.loads(resp.data.decode('utf-8'))
+    assert resp.status_code==200
+    assert stats['checkouts']>=1
+    assert stats['checked_out']==0
+    assert stats['timeouts']==0
+
+def test_metrics(api):
+    resp=api.get('/timeline/2')
+    assert resp.status_code==200
+
+    resp=api.get('/metrics')
+    metrics=resp.data.decode('utf-8')
+    assert resp.status_code==200
+    assert 'miniter_request_latency_seconds_count{route="/timeline/<int:user_id>",method="GET",status="200"} 1' in metrics
+    assert 'miniter_query_latency_seconds_count{method="TweetDao.get_timeline"} 1' in metrics
+    assert 'miniter_timeline_rows_bucket{le="1"} 1' in metrics
+
+def test_metrics_unhandled_error():
+    app=create_app(config.test_config)
+    app.config['PROPAGATE_EXCEPTIONS']=True
+
+    @app.route('/error')
+    def error():
+        raise ZeroDivisionError
+
+    api=app.test_client()
+    with pytest.raises(ZeroDivisionError):
+        api.get('/error')
+
+    metrics=api.get('/metrics').data.decode('utf-8')
+    assert 'miniter_request_latency_seconds_count{route="/error",method="GET",status="500"} 1' in metrics
+
+def test_timeline_etag():
+    app=create_app(dict(config.test_config, TIMELINE_ETAGS=True, TIMELINE_CACHE_SIZE=10))
+    api=app.test_client()
+
+    resp=api.get('/timeline/1')
+    etag=resp.headers['ETag']
+    assert resp.status_code==200
+
+    # an unchanged timeline is answered with the version query alone
+    resp, queries=count_queries(lambda: api.get('/timeline/1', headers={'If-None-Match':etag}))
+    assert resp.status_code==304
+    assert queries==1
+
+    # pages are tagged separately
+    resp=api.get('/timeline/1?limit=1', headers={'If-None-Match':etag})
+    assert resp.status_code==200
+
+    # following changes the follower's timeline
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    access_token=json.loads(resp.data.decode('utf-8'))['access_token']
+    api.post('/follow', data=json.dumps({'follow':2}), content_type='application/json', headers={'Authorization':access_token})
+    resp=api.get('/timeline/1', headers={'If-None-Match':etag})
+    assert resp.status_code==200
+    etag=resp.headers['ETag']
+
+    # and so does a tweet of a followed user, written through another
+    # process; the timeline this process cached is not sent under the new tag
+    other_api=create_app(dict(config.test_config, TIMELINE_ETAGS=True, TIMELINE_CACHE_SIZE=10)).test_client()
+    resp=other_api.post('/login', data=json.dumps({'email':'test2@mail.com', 'password':'password'}), content_type='application/json')
+    access_token=json.loads(resp.data.decode('utf-8'))['access_token']
+    other_api.post('/tweet', data=json.dumps({'tweet':'new tweet'}), content_type='application/json', headers={'Authorization':access_token})
+    resp=api.get('/timeline/1', headers={'If-None-Match':etag})
+    assert resp.status_code==200
+    assert json.loads(resp.data.decode('utf-8'))['timeline'][0]['tweet']=='new tweet'
+    resp=api.get('/timeline/1', headers={'If-None-Match':resp.headers['ETag']})
+    assert resp.status_code==304
+
+def test_gzip_response():
+    app=create_app(dict(config.test_config, GZIP_MIN_SIZE=10, TIMELINE_ETAGS=True))
+    api=app.test_client()
+
+    resp=api.get('/timeline/2', headers={'Accept-Encoding':'gzip'})
+    assert resp.status_code==200
+    assert resp.headers['Content-Encoding']=='gzip'
+    assert json.loads(gzip.decompress(resp.data).decode('utf-8'))['timeline']==[{
+        'user_id':2,
+        'tweet':'test2 tweet'
+    }]
+
+    # the compressed body carries a weak tag that still revalidates
+    etag=resp.headers['ETag']
+    assert etag.startswith('W/')
+    resp=api.get('/timeline/2', headers={'Accept-Encoding':'gzip', 'If-None-Match':etag})
+    assert resp.status_code==304
+
+    resp=api.get('/timeline/2')
+    assert 'Content-Encoding' not in resp.headers
+
+    # small payloads are sent as they are
+    resp=api.get('/ping', headers={'Accept-Encoding':'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+
+def test_admission_control():
+    app=create_app(dict(config.test_config, ADMISSION_LIMITS={'login':{'rate':1, 'burst':2}, 'tweet':{'concurrency':1}}))
+    api=app.test_client()
+
+    credential=json.dumps({'email':'test1@mail.com', 'password':'password'})
+    for _ in range(2):
+        resp=api.post('/login', data=credential, content_type='application/json')
+        assert resp.status_code==200
+
+    # the bucket is empty, the client is told when to come back
+    resp=api.post('/login', data=credential, content_type='application/json')
+    assert resp.status_code==429
+    assert resp.headers['Retry-After']=='1'
+
+    resp=api.get('/stats/admission')
+    stats=json.loads(resp.data.decode('utf-8'))
+    assert stats['login']['shed']=={'rate_limited':1}
+    assert stats['tweet']=={'shed':{}, 'in_flight':0, 'concurrency':1}
+
+    resp=api.get('/metrics')
+    assert 'miniter_requests_shed_total{route="login",reason="rate_limited"} 1' in resp.data.decode('utf-8')
+
+    in_flight=InFlight(1)
+    assert in_flight.enter()
+    assert not in_flight.enter()
+    in_flight.exit()
+    assert in_flight.enter()
+
+def test_search():
+    app=create_app(dict(config.test_config, SEARCH_INDEX=True))
+    api=app.test_client()
+
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    access_token=json.loads(resp.data.decode('utf-8'))['access_token']
+    for tweet in ['hello world', 'hello there', 'goodbye world']:
+        api.post('/tweet', data=json.dumps({'tweet':tweet}), content_type='application/json', headers={'Authorization':access_token})
+
+    # more matching terms rank first, then newer tweets
+    resp=api.get('/search?q=hello+world&limit=2')
+    page=json.loads(resp.data.decode('utf-8'))
+    assert resp.status_code==200
+    assert [tweet['tweet'] for tweet in page['results']]==['hello world', 'goodbye world']
+
+    resp=api.get(f"/search?q=hello+world&limit=2&cursor={page['next_cursor']}")
+    page=json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in page['results']]==['hello there']
+    assert page['next_cursor'] is None
+
+    # the follow graph filter leaves out users the caller does not follow
+    resp=api.get('/search?q=tweet')
+    assert [tweet['tweet'] for tweet in json.loads(resp.data.decode('utf-8'))['results']]==['test2 tweet']
+    resp=api.get('/search?q=tweet&following=1', headers={'Authorization':access_token})
+    assert json.loads(resp.data.decode('utf-8'))['results']==[]
+
+    resp=api.get('/search?q=tweet&following=1')
+    assert resp.status_code==401
+    resp=api.get('/search?q=')
+    assert resp.status_code==400
+
+def test_hydrated_timeline():
+    app=create_app(dict(config.test_config, PROFILE_CACHE_SIZE=10, TIMELINE_ETAGS=True))
+    api=app.test_client()
+
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    access_token1=json.loads(resp.data.decode('utf-8'))['access_token']
+    api.post('/follow', data=json.dumps({'follow':2}), content_type='application/json', headers={'Authorization':access_token1})
+    api.post('/tweet', data=json.dumps({'tweet':'test1 tweet'}), content_type='application/json', headers={'Authorization':access_token1})
+
+    resp, queries=count_queries(lambda: api.get('/timeline/1?hydrate=1'))
+    timeline=json.loads(resp.data.decode('utf-8'))['timeline']
+    assert [tweet['author'] for tweet in timeline]==[
+        {'name':'test1', 'profile':'test1 profile'},
+        {'name':'test2', 'profile':'test2 profile'}
+    ]
+    # the version, the timeline and one batched author lookup
+    assert queries==3
+    etag=resp.headers['ETag']
+
+    # under an ETag the authors are read again rather than from the profile
+    # cache, which may predate the version
+    resp, queries=count_queries(lambda: api.get('/timeline/1?limit=10&hydrate=1'))
+    assert [tweet['author']['name'] for tweet in json.loads(resp.data.decode('utf-8'))['timeline']]==['test1', 'test2']
+    assert queries==3
+
+    # a profile change made through another process reaches the followers'
+    # timelines
+    other_api=create_app(dict(config.test_config, PROFILE_CACHE_SIZE=10, TIMELINE_ETAGS=True)).test_client()
+    resp=other_api.post('/login', data=json.dumps({'email':'test2@mail.com', 'password':'password'}), content_type='application/json')
+    access_token2=json.loads(resp.data.decode('utf-8'))['access_token']
+    resp=other_api.post('/profile', data=json.dumps({'profile':'new profile'}), content_type='application/json', headers={'Authorization':access_token2})
+    assert resp.status_code==200
+
+    resp=api.get('/timeline/1?hydrate=1', headers={'If-None-Match':etag})
+    assert resp.status_code==200
+    assert json.loads(resp.data.decode('utf-8'))['timeline'][1]['author']=={'name':'test2', 'profile':'new profile'}
+
+    resp=other_api.get('/profile/2')
+    assert json.loads(resp.data.decode('utf-8'))=={'id':2, 'name':'test2', 'profile':'new profile'}
+    resp=api.get('/profile/100')
+    assert resp.status_code==404
+
+def test_timeline_since_id(api):
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    access_token=json.loads(resp.data.decode('utf-8'))['access_token']
+    api.post('/follow', data=json.dumps({'follow':2}), content_type='application/json', headers={'Authorization':access_token})
+
+    resp=api.get('/timeline/1?since_id=0')
+    delta=json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in delta['timeline']]==['test2 tweet']
+    newest_id=delta['newest_id']
+
+    for tweet in ['first', 'second', 'third']:
+        api.post('/tweet', data=json.dumps({'tweet':tweet}), content_type='application/json', headers={'Authorization':access_token})
+
+    # newer tweets, the oldest ones first when they do not fit, and the
+    # tweets just below since_id again
+    resp=api.get(f'/timeline/1?since_id={newest_id}&limit=2')
+    delta=json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in delta['timeline']]==['second', 'first', 'test2 tweet']
+    assert delta['has_more']
+
+    resp=api.get(f"/timeline/1?since_id={delta['newest_id']}&limit=2")
+    delta=json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in delta['timeline']]==['third', 'second', 'first', 'test2 tweet']
+    assert not delta['has_more']
+
+    # a tweet committing after a higher id was read is still delivered
+    newest_id=delta['newest_id']
+    database.execute(text("INSERT INTO tweets (id, user_id, tweet) VALUES (:id, 2, 'newer')"), {'id':newest_id+2})
+    resp=api.get(f'/timeline/1?since_id={newest_id}')
+    delta=json.loads(resp.data.decode('utf-8'))
+    assert delta['newest_id']==newest_id+2
+
+    database.execute(text("INSERT INTO tweets (id, user_id, tweet) VALUES (:id, 2, 'late')"), {'id':newest_id+1})
+    resp=api.get(f"/timeline/1?since_id={delta['newest_id']}")
+    delta=json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in delta['timeline']][:2]==['newer', 'late']
+    assert delta['newest_id']==newest_id+2
+
+    resp=api.get('/timeline/1?since_id=-1')
+    assert resp.status_code==400
+
+def test_timeline_stream():
+    app=create_app(dict(config.test_config, TIMELINE_STREAM=True, TIMELINE_STREAM_MAX_CONNECTIONS=1, TIMELINE_STREAM_HEARTBEAT=0.01, TIMELINE_STREAM_POLL_INTERVAL=0.01))
+    api=app.test_client()
+
+    resp=api.post('/login', data=json.dumps({'email':'test1@mail.com', 'password':'password'}), content_type='application/json')
+    access_token1=json.loads(resp.data.decode('utf-8'))['access_token']
+    api.post('/follow', data=json.dumps({'follow':2}), content_type='application/json', headers={'Authorization':access_token1})
+    resp=api.post('/login', data=json.dumps({'email':'test2@mail.com', 'password':'password'}), content_type='application/json')
+    access_token2=json.loads(resp.data.decode('utf-8'))['access_token']
+
+    # resuming from Last-Event-ID first replays the missed tweets
+    stream=api.get('/timeline/stream', headers={'Authorization':access_token1, 'Last-Event-ID':'0'}, buffered=False)
+    assert stream.mimetype=='text/event-stream'
+    events=iter(stream.response)
+    event=next(events)
+    assert event.startswith(b'id: ') and b'"tweet":"test2 tweet"' in event
+
+    resp=api.get('/timeline/stream', headers={'Authorization':access_token2})
+    assert resp.status_code==503
+
+    api.post('/tweet', data=json.dumps({'tweet':'pushed tweet'}), content_type='application/json', headers={'Authorization':access_token2})
+    event=next(events)
+    while event.startswith(b':'):
+        event=next(events)
+    assert b'event: tweet' in event and b'"tweet":"pushed tweet"' in event
+
+    # another process's tweet reaches the stream through this process's poll
+    database.execute(text("INSERT INTO tweets (user_id, tweet) VALUES (2, 'elsewhere')"))
+    event=next(events)
+    while event.startswith(b':'):
+        event=next(events)
+    assert b'"tweet":"elsewhere"' in event
+
+    stream.close()
+    app.extensions['timeline_poller'].close()
+    stats=json.loads(api.get('/stats/timeline_stream').data.decode('utf-8'))
+    assert stats['connections']==0 and stats['users']==0
\ No newline at end of file
@@ -1,67 +1,173 @@
 import jwt
+import time
+import hashlib
 
-from flask import Flask, jsonify, request, current_app, Response, g
+from flask import Flask, request, current_app, Response, g
+from sqlalchemy import exc
 from flask.json import JSONEncoder
 from functools import wraps
+from model import pool_status, pool_timed_out, snowflake_span, ROW_BUCKETS
+from service import LRUCache, PasswordHasherBusy, TweetWriteBehindFull, StreamCursor
+from .serialization import default, json_response, compress, server_sent_event
+from .admission import Admission
 
 class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj,set):
-            return list(obj)
-        return JSONEncoder.default(self,obj)
+        try:
+            return default(obj)
+        except TypeError:
+            return JSONEncoder.default(self,obj)
+
+def decode_access_token(access_token, app=None):
+    app=app or current_app
+    token_cache=app.extensions.get('token_cache')
+    if token_cache is None:
+        return jwt.decode(access_token, app.config['JWT_SECRET_KEY'], app.config['ALGORITHM'])
+
+    key=hashlib.sha256(access_token.encode('utf-8')).digest()
+    payload=token_cache.get(key)
+    if payload is None:
+        payload=jwt.decode(access_token, app.config['JWT_SECRET_KEY'], app.config['ALGORITHM'])
+        # keep the verified payload no longer than the token itself is valid
+        ttl=payload['exp']-time.time() if 'exp' in payload else None
+        token_cache.set(key, payload, ttl)
+
+    return payload
+
+def timeline_etag(version, query_string):
+    # the version is read before the timeline query, so a write racing the
+    # query leaves the response tagged with the older version
+    return f'{version}.{hashlib.sha1(query_string).hexdigest()[:8]}'
 
 ##################################################
 # Decorator
 ##################################################
+def authenticate():
+    access_token=request.headers.get('Authorization')
+    if access_token is None:
+        return None
+
+    try:
+        payload=decode_access_token(access_token)
+    except jwt.InvalidTokenError:
+        return None
+
+    return payload['user_id'] if payload else None
+
 def login_required(f):
     @wraps(f)
     def decorated_func(*args, **kwargs):
-        access_token=request.headers.get('Authorization')
-        if access_token is not None:
-            try:
-                payload=jwt.decode(access_token, current_app.config['JWT_SECRET_KEY'], current_app.config['ALGORITHM'])
-            except jwt.InvalidTokenError:
-                payload=None
-            
-            if payload is None: return Response(status=401)
-
-            user_id=payload['user_id']
-            g.user_id=user_id
-        else:
+        user_id=authenticate()
+        if user_id is None:
             return Response(status=401)
-        
+
+        g.user_id=user_id
         return f(*args, **kwargs)
     return decorated_func
 
 def create_endpoints(app, services):
-    app.json_encode=CustomJSONEncoder
+    app.json_encoder=CustomJSONEncoder
+
+    if app.config.get('GZIP_MIN_SIZE'):
+        @app.after_request
+        def gzip_response(response):
+            if 'gzip' not in request.accept_encodings:
+                return response
+
+            return compress(response, app.config['GZIP_MIN_SIZE'], app.config.get('GZIP_LEVEL', 6))
+
+    if app.config.get('JWT_CACHE_SIZE'):
+        app.extensions['token_cache']=LRUCache(app.config['JWT_CACHE_SIZE'])
 
     user_service=services.user_service
     tweet_service=services.tweet_service
+
+    # how many ids below since_id a poll reads again for late commits
+    since_overlap=app.config.get('TIMELINE_SINCE_OVERLAP', snowflake_span(5) if app.config.get('TWEET_IDS')=='snowflake' else 1000)
+
+    metrics=app.extensions.get('metrics')
+    if metrics:
+        request_latency=metrics.histogram(
+            'miniter_request_latency_seconds',
+            'HTTP request latency per route and status.',
+            ('route', 'method', 'status')
+        )
+        timeline_rows=metrics.histogram(
+            'miniter_timeline_rows',
+            'Tweets returned per timeline read.',
+            buckets=ROW_BUCKETS
+        )
+
+        @app.before_request
+        def start_timer():
+            g.request_started=time.perf_counter()
+
+        @app.after_request
+        def record_response_status(response):
+            g.response_status=response.status_code
+            return response
+
+        # teardown runs for unhandled exceptions too, which skip
+        # after_request whenever exceptions propagate
+        @app.teardown_request
+        def record_request_latency(exception):
+            if 'request_started' in g:
+                route=request.url_rule.rule if request.url_rule else 'unmatched'
+                status=g.get('response_status', 500) if exception is None else 500
+                request_latency.observe((route, request.method, status), time.perf_counter()-g.request_started)
+
+        @app.route('/metrics', methods=['GET'])
+        def prometheus_metrics():
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    admission=Admission(
+        app.config.get('ADMISSION_LIMITS', {}),
+        metrics.counter(
+            'miniter_requests_shed_total',
+            'Requests rejected by admission control per route and reason.',
+            ('route', 'reason')
+        ) if metrics else None
+    )
+
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(e):
+        admission.shed_request(request.endpoint, 'password_hasher_busy')
+        return Response(status=503, headers={'Retry-After':'1'})
+
+    @app.errorhandler(TweetWriteBehindFull)
+    def write_behind_full(e):
+        admission.shed_request(request.endpoint, 'write_behind_full')
+        return Response(status=503, headers={'Retry-After':'1'})
+
+    @app.errorhandler(exc.TimeoutError)
+    def pool_timeout(e):
+        pool_timed_out(app.extensions['database'])
+        admission.shed_request(request.endpoint, 'pool_timeout')
+        return Response(status=503, headers={'Retry-After':'1'})
     
     @app.route('/ping', methods=['GET'])
     def ping():
         return 'pong'
 
     @app.route('/signup', methods=['POST'])
+    @admission.limit('sign_up')
     def sign_up():
         new_user=request.json
-        new_user_id=user_service.create_new_user(new_user)
-        new_user=user_service.get_user(new_user_id)
+        new_user=user_service.sign_up(new_user)
 
-        return jsonify(new_user)
+        return json_response(new_user)
 
     @app.route('/login', methods=['POST'])
+    @admission.limit('login')
     def login():
         credential=request.json
-        authorized=user_service.login(credential)
+        user_credential=user_service.login(credential)
         
-        if authorized:
-            user_credential=user_service.get_user_id_and_password(credential['email'])
+        if user_credential:
             user_id=user_credential['id']
             token=user_service.generate_access_token(user_id)
             
-            return jsonify({
+            return json_response({
                 'user_id':user_id,
                 'access_token':token
                 })
@@ -70,6 +176,7 @@ def create_endpoints(app, services):
 
     @app.route('/tweet', methods=['POST'])
     @login_required
+    @admission.limit('tweet')
     def tweet():
         user_tweet=request.json
         tweet=user_tweet['tweet']
@@ -83,6 +190,7 @@ def create_endpoints(app, services):
 
     @app.route('/follow', methods=['POST'])
     @login_required
+    @admission.limit('follow')
     def follow():
         payload=request.json
         user_id=g.user_id
@@ -94,6 +202,7 @@ def create_endpoints(app, services):
 
     @app.route('/unfollow', methods=['POST'])
     @login_required
+    @admission.limit('unfollow')
     def unfollow():
         payload=request.json
         user_id=g.user_id
@@ -103,22 +212,291 @@ def create_endpoints(app, services):
 
         return 'success', 200
 
-    @app.route('/timeline/<int:user_id>', methods=['GET'])
-    def timeline(user_id):
-        timeline=tweet_service.get_timeline(user_id)
+    @app.route('/profile', methods=['POST'])
+    @login_required
+    @admission.limit('update_profile')
+    def update_profile():
+        payload=request.json
+        name=payload.get('name') if isinstance(payload,dict) else None
+        profile=payload.get('profile') if isinstance(payload,dict) else None
+        if (name is None and profile is None) or not all(isinstance(value,(str,type(None))) for value in (name, profile)):
+            return 'invalid profile', 400
+
+        user_service.update_profile(g.user_id, name, profile)
+
+        return 'success', 200
+
+    @app.route('/profile/<int:user_id>', methods=['GET'])
+    def profile(user_id):
+        user=user_service.get_user(user_id)
+        if user is None:
+            return 'user not found', 404
+
+        return json_response({
+            'id':user['id'],
+            'name':user['name'],
+            'profile':user['profile']
+        })
+
+    def bulk_items(payload, key):
+        items=payload.get(key) if isinstance(payload,dict) else None
+        if not isinstance(items,list) or len(items)>app.config.get('BULK_MAX_ITEMS', 1000):
+            return None
+
+        return items
+
+    @app.route('/tweets', methods=['POST'])
+    @login_required
+    @admission.limit('bulk_tweet')
+    def bulk_tweet():
+        tweets=bulk_items(request.json, 'tweets')
+        if tweets is None:
+            return 'invalid tweets', 400
+
+        results=tweet_service.tweets(g.user_id, tweets)
+
+        return json_response({'results':results})
+
+    @app.route('/follows', methods=['POST'])
+    @login_required
+    @admission.limit('bulk_follow')
+    def bulk_follow():
+        follow_ids=bulk_items(request.json, 'follow')
+        if follow_ids is None:
+            return 'invalid follow', 400
+
+        results=user_service.follows(g.user_id, follow_ids)
+
+        return json_response({'results':results})
+
+    @app.route('/unfollows', methods=['POST'])
+    @login_required
+    @admission.limit('bulk_unfollow')
+    def bulk_unfollow():
+        unfollow_ids=bulk_items(request.json, 'unfollow')
+        if unfollow_ids is None:
+            return 'invalid unfollow', 400
+
+        results=user_service.unfollows(g.user_id, unfollow_ids)
 
-        return jsonify({
+        return json_response({'results':results})
+
+    def tagged(response, etag):
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control']='no-cache'
+        return response
+
+    def hydrate(tweets, versioned=False):
+        # authors of the whole page in one batched lookup instead of one
+        # client round trip per author. Under an ETag they are read from the
+        # database, as a cached profile may predate the version
+        users=user_service.get_users((tweet['user_id'] for tweet in tweets), not versioned)
+        return [dict(tweet, author={
+            'name':users[tweet['user_id']]['name'],
+            'profile':users[tweet['user_id']]['profile']
+        } if tweet['user_id'] in users else None) for tweet in tweets]
+
+    def timeline_response(user_id):
+        etag=None
+        version=None
+        if tweet_service.timeline_versions:
+            version=tweet_service.timeline_versions.get(user_id)
+            etag=timeline_etag(version, request.query_string)
+        if etag and request.if_none_match.contains_weak(etag):
+            return tagged(Response(status=304), etag)
+
+        limit=request.args.get('limit', type=int)
+        cursor=request.args.get('cursor')
+        since_id=request.args.get('since_id', type=int)
+        hydrated=request.args.get('hydrate') in ('1', 'true')
+        max_limit=app.config.get('TIMELINE_MAX_LIMIT', 100)
+        if limit is not None and limit<1:
+            return 'invalid limit', 400
+
+        if since_id is not None:
+            limit=min(limit or max_limit, max_limit)
+            if since_id<0:
+                return 'invalid since_id', 400
+
+            # the tweets after since_id, and those just below it again since
+            # they may have committed late; with more than limit new ones
+            # the client polls again from newest_id to get the rest
+            tweets=tweet_service.get_timeline(user_id, since_id, limit+1, version, since_overlap)
+            has_more=len([tweet for tweet in tweets if tweet['id']>since_id])>limit
+            timeline=tweets[1:] if has_more else tweets
+            if metrics:
+                timeline_rows.observe((), len(timeline))
+
+            return tagged(json_response({
+                'user_id':user_id,
+                'timeline':hydrate(timeline, etag is not None) if hydrated else timeline,
+                'newest_id':max(timeline[0]['id'], since_id) if timeline else since_id,
+                'has_more':has_more
+            }), etag)
+
+        if limit is None and cursor is None:
+            timeline=tweet_service.get_timeline(user_id, version=version)
+            if metrics:
+                timeline_rows.observe((), len(timeline))
+            if hydrated:
+                timeline=hydrate(timeline, etag is not None)
+
+            return tagged(json_response({
+                'user_id':user_id,
+                'timeline':timeline
+            }), etag)
+
+        limit=min(limit or max_limit, max_limit)
+
+        try:
+            page=tweet_service.get_timeline_page(user_id, limit, cursor, version)
+        except ValueError:
+            return 'invalid cursor', 400
+
+        if metrics:
+            timeline_rows.observe((), len(page['timeline']))
+
+        return tagged(json_response({
             'user_id':user_id,
-            'timeline':timeline
+            'timeline':hydrate(page['timeline'], etag is not None) if hydrated else page['timeline'],
+            'next_cursor':page['next_cursor']
+        }), etag)
+
+    @app.route('/stats/pool', methods=['GET'])
+    def pool_stats():
+        return json_response(pool_status(app.extensions['database']))
+
+    @app.route('/stats/write_behind', methods=['GET'])
+    def write_behind_stats():
+        if not tweet_service.write_behind:
+            return 'write-behind disabled', 404
+
+        return json_response(tweet_service.write_behind.stats())
+
+    @app.route('/stats/timeline_merge', methods=['GET'])
+    def timeline_merge_stats():
+        if not tweet_service.timeline_merger:
+            return 'pull timelines disabled', 404
+
+        return json_response(tweet_service.timeline_merger.stats())
+
+    @app.route('/stats/follow_graph', methods=['GET'])
+    def follow_graph_stats():
+        if not user_service.follow_graph:
+            return 'follow graph disabled', 404
+
+        return json_response(user_service.follow_graph.stats())
+
+    @app.route('/stats/timeline_stream', methods=['GET'])
+    def timeline_stream_stats():
+        if not tweet_service.timeline_hub:
+            return 'timeline stream disabled', 404
+
+        return json_response(tweet_service.timeline_hub.stats())
+
+    @app.route('/stats/admission', methods=['GET'])
+    def admission_stats():
+        return json_response(admission.stats())
+
+    @app.route('/search', methods=['GET'])
+    def search():
+        if not tweet_service.search_index:
+            return 'search disabled', 404
+
+        query=request.args.get('q', '').strip()
+        if not query:
+            return 'missing query', 400
+
+        max_limit=app.config.get('SEARCH_MAX_LIMIT', 100)
+        limit=min(request.args.get('limit', 20, type=int), max_limit)
+        if limit<1:
+            return 'invalid limit', 400
+
+        # following=1 searches only the caller and the users they follow
+        author_ids=None
+        if request.args.get('following') in ('1', 'true'):
+            user_id=authenticate()
+            if user_id is None:
+                return Response(status=401)
+            author_ids=set(user_service.get_follow_ids(user_id))|{user_id}
+
+        try:
+            page=tweet_service.search(query, limit, request.args.get('cursor'), author_ids)
+        except ValueError:
+            return 'invalid cursor', 400
+
+        return json_response({
+            'query':query,
+            'results':page['results'],
+            'next_cursor':page['next_cursor']
         })
 
-    @app.route('/timeline', methods=['GET'])
+    @app.route('/timeline/stream', methods=['GET'])
     @login_required
-    def user_timeline():
+    def timeline_stream():
+        timeline_hub=tweet_service.timeline_hub
+        if not timeline_hub:
+            return 'timeline stream disabled', 404
+
+        # EventSource sends the id of the last event it saw when it reconnects;
+        # event ids are the stream's watermark, so a reconnect may repeat a
+        # few tweets but misses none
+        since_id=request.headers.get('Last-Event-ID', request.args.get('since_id'))
+        try:
+            since_id=int(since_id) if since_id is not None else None
+        except ValueError:
+            return 'invalid since_id', 400
+
         user_id=g.user_id
-        timeline=tweet_service.get_timeline(user_id)
+        max_limit=app.config.get('TIMELINE_MAX_LIMIT', 100)
+        heartbeat=app.config.get('TIMELINE_STREAM_HEARTBEAT', 15)
+        overlap=app.config.get('TIMELINE_STREAM_OVERLAP', 5)
 
-        return jsonify({
-            'user_id':user_id,
-            'timeline':timeline
+        # subscribed before reading, so a tweet written in between is not lost
+        subscription=timeline_hub.subscribe(user_id)
+        if subscription is None:
+            admission.shed_request('timeline_stream', 'over_capacity')
+            return Response(status=503, headers={'Retry-After':'1'})
+
+        resume=since_id is not None
+        if not resume:
+            newest=tweet_service.get_timeline_page(user_id, 1)['timeline']
+            since_id=newest[0]['id'] if newest else 0
+
+        def events():
+            cursor=StreamCursor(since_id, overlap)
+            catch_up_from=since_id if resume else None
+            while True:
+                tweets=[]
+                if catch_up_from is None:
+                    tweets, stale=subscription.get(heartbeat)
+                    if stale:
+                        catch_up_from=cursor.after_id
+                if catch_up_from is not None:
+                    batch=tweet_service.load_timeline_since(user_id, catch_up_from, max_limit)
+                    tweets+=batch
+                    catch_up_from=batch[0]['id'] if len(batch)==max_limit else None
+
+                sent=cursor.unsent(tweets)
+                for tweet in sent:
+                    yield server_sent_event('tweet', tweet, cursor.after_id)
+                if not sent:
+                    # also how a closed connection is noticed
+                    yield b': keep-alive\n\n'
+
+        response=Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control':'no-cache',
+            'X-Accel-Buffering':'no'
         })
+        response.call_on_close(lambda: timeline_hub.unsubscribe(subscription))
+        return response
+
+    @app.route('/timeline/<int:user_id>', methods=['GET'])
+    def timeline(user_id):
+        return timeline_response(user_id)
+
+    @app.route('/timeline', methods=['GET'])
+    @login_required
+    def user_timeline():
+        return timeline_response(g.user_id)
@@ -0,0 +1,118 @@
+import math
+import time
+import threading
+
+from collections import OrderedDict
+from flask import request, Response, g
+from functools import wraps
+
+class TokenBuckets:
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate=rate
+        self.burst=burst
+        self.max_keys=max_keys
+        self.clock=clock
+        self.buckets=OrderedDict()
+        self.lock=threading.Lock()
+
+    def take(self, key):
+        # returns 0 when a token was taken, else the seconds until one refills
+        with self.lock:
+            now=self.clock()
+            tokens, updated_at=self.buckets.pop(key, (self.burst, now))
+            tokens=min(self.burst, tokens+(now-updated_at)*self.rate)
+            if tokens>=1:
+                tokens-=1
+                wait=0
+            else:
+                wait=(1-tokens)/self.rate
+
+            # a forgotten key starts again from a full bucket
+            self.buckets[key]=(tokens, now)
+            if len(self.buckets)>self.max_keys:
+                self.buckets.popitem(last=False)
+
+            return wait
+
+class InFlight:
+    def __init__(self, limit):
+        self.limit=limit
+        self.count=0
+        self.lock=threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            if self.count>=self.limit:
+                return False
+            self.count+=1
+            return True
+
+    def exit(self):
+        with self.lock:
+            self.count-=1
+
+def client_key():
+    user_id=g.get('user_id')
+    return ('user', user_id) if user_id is not None else ('ip', request.remote_addr)
+
+class Admission:
+    def __init__(self, limits, shed_counter=None):
+        self.limits=limits
+        self.shed_counter=shed_counter
+        self.in_flight={}
+        self.shed={}
+        self.lock=threading.Lock()
+
+    def shed_request(self, route, reason):
+        with self.lock:
+            self.shed[(route, reason)]=self.shed.get((route, reason), 0)+1
+        if self.shed_counter:
+            self.shed_counter.inc((route, reason))
+
+    def limit(self, name):
+        # limits come from ADMISSION_LIMITS[name]: rate and burst for a token
+        # bucket per user or client IP, concurrency for requests in flight
+        limits=self.limits.get(name)
+
+        def decorator(f):
+            if not limits:
+                return f
+
+            buckets=TokenBuckets(limits['rate'], limits.get('burst', limits['rate'])) if limits.get('rate') else None
+            in_flight=InFlight(limits['concurrency']) if limits.get('concurrency') else None
+            if in_flight:
+                self.in_flight[name]=in_flight
+
+            @wraps(f)
+            def decorated_func(*args, **kwargs):
+                if buckets:
+                    wait=buckets.take(client_key())
+                    if wait:
+                        self.shed_request(name, 'rate_limited')
+                        return Response(status=429, headers={'Retry-After':str(math.ceil(wait))})
+
+                if not in_flight:
+                    return f(*args, **kwargs)
+
+                # over the limit the request fails fast instead of queueing
+                if not in_flight.enter():
+                    self.shed_request(name, 'over_concurrency')
+                    return Response(status=503, headers={'Retry-After':'1'})
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    in_flight.exit()
+            return decorated_func
+        return decorator
+
+    def stats(self):
+        with self.lock:
+            shed=dict(self.shed)
+
+        routes={}
+        for (route, reason), count in shed.items():
+            routes.setdefault(route, {'shed':{}})['shed'][reason]=count
+        for route, in_flight in self.in_flight.items():
+            routes.setdefault(route, {'shed':{}}).update({'in_flight':in_flight.count, 'concurrency':in_flight.limit})
+
+        return routes
\ No newline at end of file
@@ -0,0 +1,205 @@
+import jwt
+
+from quart import request, Response, g
+from functools import wraps
+from service import PasswordHasherBusy, StreamCursor
+from . import decode_access_token, timeline_etag
+from .serialization import dumps, server_sent_event
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+def create_async_endpoints(app, services):
+    user_service=services.user_service
+    tweet_service=services.tweet_service
+
+    def login_required(f):
+        @wraps(f)
+        async def decorated_func(*args, **kwargs):
+            access_token=request.headers.get('Authorization')
+            if access_token is None:
+                return Response('', status=401)
+
+            try:
+                payload=decode_access_token(access_token, app)
+            except jwt.InvalidTokenError:
+                return Response('', status=401)
+
+            g.user_id=payload['user_id']
+            return await f(*args, **kwargs)
+        return decorated_func
+
+    @app.errorhandler(PasswordHasherBusy)
+    async def password_hasher_busy(e):
+        return Response('', status=503, headers={'Retry-After':'1'})
+
+    @app.after_request
+    async def allow_cors(response):
+        response.headers.setdefault('Access-Control-Allow-Origin', '*')
+        return response
+
+    @app.route('/ping', methods=['GET'])
+    async def ping():
+        return 'pong'
+
+    @app.route('/signup', methods=['POST'])
+    async def sign_up():
+        new_user=await request.get_json()
+        new_user=await user_service.sign_up(new_user)
+
+        return json_response(new_user)
+
+    @app.route('/login', methods=['POST'])
+    async def login():
+        credential=await request.get_json()
+        user_credential=await user_service.login(credential)
+
+        if user_credential:
+            user_id=user_credential['id']
+            token=user_service.generate_access_token(user_id)
+
+            return json_response({
+                'user_id':user_id,
+                'access_token':token
+            })
+        else:
+            return '', 401
+
+    @app.route('/tweet', methods=['POST'])
+    @login_required
+    async def tweet():
+        user_tweet=await request.get_json()
+
+        result=await tweet_service.tweet(g.user_id, user_tweet['tweet'])
+        if result is None:
+            return 'over 300 characters', 400
+
+        return 'success', 200
+
+    @app.route('/follow', methods=['POST'])
+    @login_required
+    async def follow():
+        payload=await request.get_json()
+        await user_service.follow(g.user_id, payload['follow'])
+
+        return 'success', 200
+
+    @app.route('/unfollow', methods=['POST'])
+    @login_required
+    async def unfollow():
+        payload=await request.get_json()
+        await user_service.unfollow(g.user_id, payload['unfollow'])
+
+        return 'success', 200
+
+    def tagged(response, etag):
+        if etag:
+            response.set_etag(etag)
+            response.headers['Cache-Control']='no-cache'
+        return response
+
+    async def timeline_response(user_id):
+        etag=None
+        version=None
+        if tweet_service.timeline_versions:
+            version=await tweet_service.timeline_versions.get(user_id)
+            etag=timeline_etag(version, request.query_string)
+        if etag and request.if_none_match.contains_weak(etag):
+            return tagged(Response('', status=304), etag)
+
+        limit=request.args.get('limit', type=int)
+        cursor=request.args.get('cursor')
+
+        if limit is not None and limit<1:
+            return 'invalid limit', 400
+
+        if limit is None and cursor is None:
+            timeline=await tweet_service.get_timeline(user_id, version)
+
+            return tagged(json_response({
+                'user_id':user_id,
+                'timeline':timeline
+            }), etag)
+
+        max_limit=app.config.get('TIMELINE_MAX_LIMIT', 100)
+        limit=min(limit or max_limit, max_limit)
+
+        try:
+            page=await tweet_service.get_timeline_page(user_id, limit, cursor, version)
+        except ValueError:
+            return 'invalid cursor', 400
+
+        return tagged(json_response({
+            'user_id':user_id,
+            'timeline':page['timeline'],
+            'next_cursor':page['next_cursor']
+        }), etag)
+
+    @app.route('/timeline/stream', methods=['GET'])
+    @login_required
+    async def timeline_stream():
+        timeline_hub=tweet_service.timeline_hub
+        if not timeline_hub:
+            return 'timeline stream disabled', 404
+
+        since_id=request.headers.get('Last-Event-ID', request.args.get('since_id'))
+        try:
+            since_id=int(since_id) if since_id is not None else None
+        except ValueError:
+            return 'invalid since_id', 400
+
+        user_id=g.user_id
+        max_limit=app.config.get('TIMELINE_MAX_LIMIT', 100)
+        heartbeat=app.config.get('TIMELINE_STREAM_HEARTBEAT', 15)
+        overlap=app.config.get('TIMELINE_STREAM_OVERLAP', 5)
+
+        subscription=timeline_hub.subscribe(user_id)
+        if subscription is None:
+            return Response('', status=503, headers={'Retry-After':'1'})
+
+        resume=since_id is not None
+        if not resume:
+            newest=(await tweet_service.get_timeline_page(user_id, 1))['timeline']
+            since_id=newest[0]['id'] if newest else 0
+
+        # the same loop as the WSGI stream, but an idle connection waits as
+        # a coroutine, so one worker holds thousands of them
+        async def events():
+            try:
+                cursor=StreamCursor(since_id, overlap)
+                catch_up_from=since_id if resume else None
+                while True:
+                    tweets=[]
+                    if catch_up_from is None:
+                        tweets, stale=await subscription.get(heartbeat)
+                        if stale:
+                            catch_up_from=cursor.after_id
+                    if catch_up_from is not None:
+                        batch=await tweet_service.load_timeline_since(user_id, catch_up_from, max_limit)
+                        tweets+=batch
+                        catch_up_from=batch[0]['id'] if len(batch)==max_limit else None
+
+                    sent=cursor.unsent(tweets)
+                    for tweet in sent:
+                        yield server_sent_event('tweet', tweet, cursor.after_id)
+                    if not sent:
+                        yield b': keep-alive\n\n'
+            finally:
+                timeline_hub.unsubscribe(subscription)
+
+        response=Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control':'no-cache',
+            'X-Accel-Buffering':'no'
+        })
+        # a stream is open for as long as the client stays
+        response.timeout=None
+        return response
+
+    @app.route('/timeline/<int:user_id>', methods=['GET'])
+    async def timeline(user_id):
+        return await timeline_response(user_id)
+
+    @app.route('/timeline', methods=['GET'])
+    @login_required
+    async def user_timeline():
+        return await timeline_response(g.user_id)
\ No newline at end of file
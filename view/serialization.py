@@ -0,0 +1,54 @@
+import json
+import gzip
+
+from datetime import date, datetime
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson=None
+
+def default(obj):
+    if isinstance(obj,(set,frozenset)):
+        return list(obj)
+    if isinstance(obj,(datetime,date)):
+        return obj.isoformat()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+def dumps(payload):
+    if orjson:
+        # orjson writes datetimes as ISO 8601 itself, the same as default does
+        return orjson.dumps(payload, default=default)
+
+    return json.dumps(payload, default=default, ensure_ascii=False, separators=(',',':')).encode('utf-8')
+
+def server_sent_event(event, payload, event_id=None):
+    # dumps escapes newlines, so the payload always fits one data line
+    head=f'id: {event_id}\nevent: {event}\n' if event_id is not None else f'event: {event}\n'
+    return head.encode('utf-8')+b'data: '+dumps(payload)+b'\n\n'
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+def compress(response, min_size, level=6):
+    if (response.direct_passthrough
+            or response.status_code<200 or response.status_code in (204, 304)
+            or response.mimetype!='application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body=response.get_data()
+    if len(body)<min_size:
+        return response
+
+    response.set_data(gzip.compress(body, level))
+    response.headers['Content-Encoding']='gzip'
+
+    # the compressed body is a different representation of the same version
+    etag, weak=response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
\ No newline at end of file